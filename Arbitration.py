@@ -0,0 +1,100 @@
+import logging
+
+ArbitrationLogger = logging.getLogger('ArbitrationLogger')
+
+# Thread arbitration policies of a PE, see Arbiter.
+ARBITRATION_POLICIES = ('round_robin', 'oldest_first', 'longest_queue_first', 'lookahead_nonzero')
+
+# Couples lookahead_nonzero looks at behind the top of a thread.
+LOOKAHEAD = 4
+
+
+def check_policy(policy):
+    """
+    :raise ValueError: if policy isn't one of ARBITRATION_POLICIES.
+    """
+    if policy not in ARBITRATION_POLICIES:
+        ArbitrationLogger.critical("Unknown arbitration policy: {}".format(policy))
+        raise ValueError("Unknown arbitration policy: {}".format(policy))
+
+
+class Arbiter:
+    """
+    Thread arbitration of a PE: each clock cycle, which of its candidates - threads whose top couple needs the MAC
+    (see PE.is_mac_couple), with room in both output buffers for limited buffers - gets the MAC.
+    A policy scores candidates, the highest score wins and ties go to the first one in round-robin order from onThread.
+    onThread moves on by one on every MAC whatever the policy, so a policy that scores every candidate the same is round-robin.
+    Arbiters are stateless - per thread state lives in the PE (see PE.waiting) - so a single one serves a whole array.
+    Policies:
+        'round_robin'         - no score: the first candidate from onThread. PE's keep their own inline round-robin for it.
+        'oldest_first'        - the candidate whose couple has been left in the input buffers the most cycles.
+        'longest_queue_first' - the candidate with the most items in its west and north input buffers.
+        'lookahead_nonzero'   - the candidate with the most zero / bubble couples right behind its top (up to LOOKAHEAD,
+                                couples present in both input buffers only): once its MAC is done, they all pass on
+                                in the following cycles, while the other candidates wait for the MAC.
+    """
+
+    def __init__(self, policy):
+
+        check_policy(policy)
+
+        self.policy = policy
+
+    def score(self, pe, thread_number):
+        """
+        Score of candidate thread_number of pe, higher first.
+        """
+        if self.policy == 'oldest_first':
+            return pe.waiting[thread_number]
+
+        if self.policy == 'longest_queue_first':
+            return pe.west_buffer.size[thread_number] + pe.north_buffer.size[thread_number]
+
+        if self.policy == 'lookahead_nonzero':
+            visible = min(pe.west_buffer.size[thread_number], pe.north_buffer.size[thread_number], LOOKAHEAD + 1)
+            run = 0
+            for offset in range(1, visible):
+                if pe.is_mac_couple(thread_number, pe.west_buffer.peek_at(thread_number, offset), pe.north_buffer.peek_at(thread_number, offset)):
+                    break
+                run += 1
+            return run
+
+        return 0
+
+    def order(self, pe):
+        """
+        Threads in the order pe.tock should go through them this cycle: the winner first, then the others in round-robin order.
+        Also counts the cycles every non-zero couple of pe is left waiting in its input buffers (PE.waiting).
+        :return: list of thread numbers
+        """
+        thread_reorder = list(range(pe.onThread, pe.thread_count)) + list(range(pe.onThread))
+
+        west_buffer, north_buffer = pe.west_buffer, pe.north_buffer
+        east_buffer, south_buffer = pe.east_buffer,  pe.south_buffer
+
+        winner, best, waiting = None, None, []
+        for thread_number in thread_reorder:
+
+            if west_buffer.is_empty(thread_number) or north_buffer.is_empty(thread_number):
+                continue
+            if not pe.is_mac_couple(thread_number, west_buffer.peek(thread_number), north_buffer.peek(thread_number)):
+                continue
+            waiting.append(thread_number)
+
+            # Same check as PElimited.tock, without recording IS_FULL events. Only buffers with a depth limit can be full.
+            if east_buffer.depth_limit is not None and east_buffer.is_full(threadID=thread_number, log=False):
+                continue
+            if south_buffer.depth_limit is not None and south_buffer.is_full(threadID=thread_number, log=False):
+                continue
+
+            score = self.score(pe, thread_number)
+            if winner is None or score > best:
+                winner, best = thread_number, score
+
+        for thread_number in waiting:
+            pe.waiting[thread_number] = 0 if thread_number == winner else pe.waiting[thread_number] + 1
+
+        if winner is None:
+            return thread_reorder
+
+        return [winner] + [thread_number for thread_number in thread_reorder if thread_number != winner]
@@ -1,4 +1,5 @@
 import logging
+from TraceRecorder import PUSH, PUSH_DROPPED, IS_FULL
 
 BufferLogger = logging.getLogger('BufferLogger')
 
@@ -6,61 +7,174 @@ BufferLogger = logging.getLogger('BufferLogger')
 class BUFFER:
     """
     Data Structure to hold intermediate literals between PE's.
-    Has a dictionary, each key is a thread id, each value is a list behave like a Fifo.
+    Each thread has its own preallocated ring buffer, indexed by integer thread id, that behave like a Fifo.
+    Reading is done in two phases: peek at the top of a thread, and commit to remove it once it was consumed.
     """
-    def __init__(self, thread_count, iindex, jindex, log):
+    __slots__ = ('slots', 'head', 'size', 'occupancy', 'thread_count', 'iindex', 'jindex', 'depth_limit', 'consumer')
 
-        self.buffer = dict()
+    def __init__(self, thread_count, iindex, jindex, log, capacity=4):
 
-        # For each thread, count how many data items in buffer, not including None's (None=bubble)
-        self.load = dict()
+        self.thread_count = thread_count
+
+        # Ring buffer per thread: storage list, index of the top item and number of items.
+        self.slots = [[None] * capacity for _ in range(thread_count)]
+        self.head  = [0] * thread_count
+        self.size  = [1] * thread_count
+
+        # For each thread, count how many data items in buffer, not including None's (None=bubble).
+        # SystolicArray copies it into its Telemetry store each clock cycle.
+        self.occupancy = [0] * thread_count
 
         self.iindex = iindex
         self.jindex = jindex
 
-        for t in range(thread_count):
-            self.buffer['T{}'.format(t)] = [None]
-            self.load['T{}'.format(t)] = []
-
         self.depth_limit = None
 
+        # PE reading from this buffer. Pushing wakes it up (see PE.pending).
+        self.consumer = None
+
         if log:
-            BufferLogger.debug("BUFFER <{},{}>: {}".format(self.iindex, self.jindex, self.buffer))
+            BufferLogger.debug("BUFFER <{},{}>: {}".format(self.iindex, self.jindex, self.contents()))
 
-    def push_to(self, threadID, value, log):
+    def reset(self):
         """
-        try to push value to channel threadID, if log=True, then log a proper message.
+        Empty every thread back to a single bubble, as constructed. Grown ring buffers keep their capacity.
         """
-        try:
-            self.buffer['T{}'.format(threadID)].append(value)
+        self.slots     = [[None] * len(slots) for slots in self.slots]
+        self.head      = [0] * self.thread_count
+        self.size      = [1] * self.thread_count
+        self.occupancy = [0] * self.thread_count
 
-            if log:
-                BufferLogger.debug("<{},{}>: Value {} Pushed to Thread: {}".format(self.iindex, self.jindex, value, threadID))
+    def fill(self, threadID, values):
+        """
+        Replace the contents of channel threadID with <values>, top first (None=bubble). See SystolicArray.restore.
+        """
+        capacity = len(self.slots[threadID])
+        while capacity < len(values):
+            capacity *= 2
 
-        except KeyError:
+        self.slots[threadID]     = list(values) + [None] * (capacity - len(values))
+        self.head[threadID]      = 0
+        self.size[threadID]      = len(values)
+        self.occupancy[threadID] = sum(value is not None for value in values)
+
+    def _check_thread(self, threadID):
+
+        if not 0 <= threadID < self.thread_count:
 
             BufferLogger.error('Invalid Thread ID ({}) in Buffer <{},{}>'.format(threadID, self.iindex, self.jindex))
 
             raise ValueError('Invalid Thread ID ({}) in Buffer <{},{}>'.format(threadID, self.iindex, self.jindex))
 
-    def __repr__(self):
-        return "<{},{}>".format(self.iindex, self.jindex)
+    def _grow(self, threadID):
+        """
+        Double the ring buffer of threadID, unrolled so its head returns to 0.
+        """
+        slots = self.slots[threadID]
+        head  = self.head[threadID]
+
+        self.slots[threadID] = slots[head:] + slots[:head] + [None] * len(slots)
+        self.head[threadID]  = 0
+
+    def _append(self, threadID, value):
+
+        slots = self.slots[threadID]
+        size  = self.size[threadID]
+
+        if size == len(slots):
+            self._grow(threadID)
+            slots = self.slots[threadID]
+
+        slots[(self.head[threadID] + size) % len(slots)] = value
+        self.size[threadID] = size + 1
+
+        if value is not None:
+            self.occupancy[threadID] += 1
+
+        if self.consumer is not None:
+            self.consumer.pending = True
+
+    def push_to(self, threadID, value, log):
+        """
+        try to push value to channel threadID, if log is a TraceRecorder, then record a proper event.
+        """
+        self._check_thread(threadID)
+
+        self._append(threadID, value)
+
+        if log:
+            log.record(PUSH, self.iindex, self.jindex, threadID, value, self.size[threadID])
+
+    def is_empty(self, threadID):
+
+        return self.size[threadID] == 0
+
+    def peek(self, threadID):
+        """
+        Return the top of channel threadID without removing it.
+        :raise IndexError: if the channel is empty.
+        """
+        if self.size[threadID] == 0:
+            raise IndexError('peek from empty buffer thread')
+
+        return self.slots[threadID][self.head[threadID]]
+
+    def peek_at(self, threadID, offset):
+        """
+        Return item <offset> of channel threadID, counting from the top (0), without removing anything.
+        :raise IndexError: if the channel holds <offset> items or less.
+        """
+        if offset >= self.size[threadID]:
+            raise IndexError('peek beyond buffer thread end')
+
+        slots = self.slots[threadID]
+        return slots[(self.head[threadID] + offset) % len(slots)]
+
+    def commit(self, threadID):
+        """
+        Remove the top of channel threadID, after it was peeked and consumed.
+        """
+        slots = self.slots[threadID]
+        head  = self.head[threadID]
+
+        if slots[head] is not None:
+            self.occupancy[threadID] -= 1
+
+        slots[head] = None
+        self.head[threadID] = (head + 1) % len(slots)
+        self.size[threadID] -= 1
+
+    def length(self, threadID):
+
+        return self.size[threadID]
 
-    def update_load(self):
+    def values(self, threadID):
         """
-        Update load logger according to current buffer state
+        :return: list of channel threadID items, top first.
         """
-        for key, buffer in self.buffer.items():
-            self.load[key].append(len([1 for i in buffer if i is not None]))
+        slots = self.slots[threadID]
+        head  = self.head[threadID]
+        return [slots[(head + k) % len(slots)] for k in range(self.size[threadID])]
+
+    def contents(self):
+        """
+        :return: dictionary of thread id to list of items, for logging.
+        """
+        return {t: self.values(t) for t in range(self.thread_count)}
+
+    def __repr__(self):
+        return "<{},{}>".format(self.iindex, self.jindex)
 
 
 class BUFFERlimited(BUFFER):
     """
     Buffer with limited depth
     """
+    __slots__ = ()
+
     def __init__(self, thread_count, depth, iindex, jindex, log):
 
-        super().__init__(thread_count=thread_count, iindex=iindex, jindex=jindex, log=log)
+        super().__init__(thread_count=thread_count, iindex=iindex, jindex=jindex, log=log, capacity=depth)
 
         self.depth_limit = depth
 
@@ -69,51 +183,51 @@ class BUFFERlimited(BUFFER):
 
     def push_to(self, threadID, value, log):
 
-        try:
-
-            if len(self.buffer['T{}'.format(threadID)]) < self.depth_limit:
+        self._check_thread(threadID)
 
-                self.buffer['T{}'.format(threadID)].append(value)
+        if self.size[threadID] < self.depth_limit:
 
-                if log:
-                    BufferLogger.info("<{},{}>: Value {} Pushed to Buffer-Thread: {}. "
-                                      "Buffer Size Now: {}".format(self.iindex, self.jindex, value, threadID, len(self.buffer['T{}'.format(threadID)])))
-                return True
+            self._append(threadID, value)
 
-            else:
-                if log:
-                    BufferLogger.info("BUFFERlimited <{},{}>: Value {} Didn't push to Thread: {} because it's full".format(self.iindex, self.jindex, value, threadID))
-                return False
+            if log:
+                log.record(PUSH, self.iindex, self.jindex, threadID, value, self.size[threadID])
+            return True
 
-        except KeyError:
-            BufferLogger.error('Invalid Thread ID ({}) in Buffer <{},{}>'.format(threadID, self.iindex, self.jindex))
-            raise ValueError('Invalid Thread ID ({}) in Buffer <{},{}>'.format(threadID, self.iindex, self.jindex))
+        else:
+            if log:
+                log.record(PUSH_DROPPED, self.iindex, self.jindex, threadID, value)
+            return False
 
     def delete_last(self, threadID, log):
 
-        try:
+        self._check_thread(threadID)
 
-            del self.buffer['T{}'.format(threadID)][-1]
+        if self.size[threadID] == 0:
+            raise IndexError('delete from empty buffer thread')
 
-            BufferLogger.info('BUFFERlimited <{},{}>: Last Element Removed From Thread {}'.format(self.iindex, self.jindex, threadID))
+        slots = self.slots[threadID]
+        tail  = (self.head[threadID] + self.size[threadID] - 1) % len(slots)
 
-        except KeyError:
+        if slots[tail] is not None:
+            self.occupancy[threadID] -= 1
 
-            BufferLogger.error('Invalid Thread ID ({}) in Buffer <{},{}>'.format(threadID, self.iindex, self.jindex))
-            raise ValueError('Invalid Thread ID ({}) in Buffer <{},{}>'.format(threadID, self.iindex, self.jindex))
+        slots[tail] = None
+        self.size[threadID] -= 1
+
+        BufferLogger.info('BUFFERlimited <{},{}>: Last Element Removed From Thread {}'.format(self.iindex, self.jindex, threadID))
 
     def is_full(self, threadID, log):
 
-        if len(self.buffer['T{}'.format(threadID)]) < self.depth_limit:
+        if self.size[threadID] < self.depth_limit:
 
             if log:
-                BufferLogger.debug('BUFFERlimited <{},{}> - Thread {} Is Not Full'.format(self.iindex, self.jindex, threadID))
+                log.record(IS_FULL, self.iindex, self.jindex, threadID, False)
             return False
 
         else:
 
             if log:
-                BufferLogger.debug('BUFFERlimited <{},{}> - Thread {} Is Full'.format(self.iindex, self.jindex, threadID))
+                log.record(IS_FULL, self.iindex, self.jindex, threadID, True)
             return True
 
 
@@ -121,52 +235,113 @@ class FIFO(BUFFER):
     """
     Input FIFO for SystolicArray edges.
     Inherit from BUFFER class, in order to simplify systolicArray build in SystolicArray.py.
+    A lazy feeder: each thread reads its operands on demand from a 1D view of the input tensor (an ndarray or np.memmap),
+    behind <skew> virtual bubbles for the diagonal skew. Nothing is copied, so setup is O(threads) whatever the input length.
+    head[t] counts operands (bubbles included) already read from thread t, size[t] the ones left.
     """
-    def __init__(self, threads, i, j, thread_count, log):
+    __slots__ = ('streams', 'skew')
+
+    def __init__(self, threads, i, j, thread_count, log, skew=0):
         """
         Override PE constructor. FIFO constructor called separated from pe_array build,
         and its indexes are fixed to -1.
+        :param threads: per thread 1D sequence of operands - typically a view of the input tensor.
+        :param skew: number of bubbles in front of every thread.
         """
+        # BUFFER.__init__ logs contents() - which reads the streams behind their skew - so both come first.
+        self.skew    = skew
+        self.streams = list(threads)
+
         super().__init__(thread_count=thread_count, iindex=i, jindex=j, log=log)
-        del self.load
 
-        for t, thread in zip(range(len(threads)), threads):
-            self.buffer['T{}'.format(t)] = thread
+        self.load(self.streams)
 
         if log:
-            BufferLogger.debug("BUFFER Changed To FIFO: <{},{}>: {}".format(self.iindex, self.jindex, self.buffer))
+            BufferLogger.debug("BUFFER Changed To FIFO: <{},{}>: {}".format(self.iindex, self.jindex, self.contents()))
+
+    def load(self, threads):
+        """
+        Read a new input from now on - per thread 1D sequence of operands, same skew.
+        """
+        self.streams = list(threads)
+        self.reset()
+
+    def reset(self):
+        """
+        Rewind every thread to its first operand.
+        """
+        self.head = [0] * self.thread_count
+        self.size = [self.skew + len(thread) for thread in self.streams]
+
+    def peek(self, threadID):
+
+        if self.size[threadID] == 0:
+            raise IndexError('peek from empty buffer thread')
+
+        position = self.head[threadID] - self.skew
+        if position < 0:
+            return None
+        return self.streams[threadID][position]
+
+    def peek_at(self, threadID, offset):
+
+        if offset >= self.size[threadID]:
+            raise IndexError('peek beyond buffer thread end')
+
+        position = self.head[threadID] - self.skew + offset
+        if position < 0:
+            return None
+        return self.streams[threadID][position]
+
+    def commit(self, threadID):
+
+        self.head[threadID] += 1
+        self.size[threadID] -= 1
+
+    def values(self, threadID):
+
+        position = self.head[threadID] - self.skew
+        return [None] * max(-position, 0) + list(self.streams[threadID][max(position, 0):])
 
 
 class OUTPUT(BUFFER):
     """
-    Special BUFFER class without None
+    Special BUFFER class without None.
+    Counts drained operands per thread: once a thread holds <drain_length> items, on_drained(buffer, threadID) is called.
     """
-    def __init__(self, thread_count, iindex, jindex, log):
+    __slots__ = ('drain_length', 'on_drained')
 
-        super().__init__(thread_count=thread_count, iindex=iindex, jindex=jindex, log=log)
+    def __init__(self, thread_count, iindex, jindex, log, drain_length=None, on_drained=None):
 
-        del self.buffer
-        del self.load
+        super().__init__(thread_count=thread_count, iindex=iindex, jindex=jindex, log=log)
 
-        self.buffer = dict()
+        self.drain_length = drain_length
+        self.on_drained   = on_drained
 
+        self.size = [0] * thread_count
         for t in range(thread_count):
-            self.buffer['T{}'.format(t)] = []
+            self.slots[t][0] = None
 
         if log:
-            BufferLogger.debug("BUFFER Changed To OUTPUT <{},{}>: {}".format(self.iindex, self.jindex, self.buffer))
+            BufferLogger.debug("BUFFER Changed To OUTPUT <{},{}>: {}".format(self.iindex, self.jindex, self.contents()))
 
-    def push_to(self, threadID, value, log):
-        try:
+    def reset(self):
+        """
+        Empty every thread. Set drain_length beforehand if the input length changes.
+        """
+        super().reset()
 
-            if value is not None:
-                self.buffer['T{}'.format(threadID)].append(value)
+        self.size = [0] * self.thread_count
 
-        except KeyError:
+    def push_to(self, threadID, value, log):
 
-            BufferLogger.error('Invalid Thread ID ({}) in Buffer <{},{}>'.format(threadID, self.iindex, self.jindex))
+        self._check_thread(threadID)
 
-            raise ValueError('Invalid Thread ID ({}) in Buffer <{},{}>'.format(threadID, self.iindex, self.jindex))
+        if value is not None:
+            self._append(threadID, value)
+
+            if self.size[threadID] == self.drain_length and self.on_drained is not None:
+                self.on_drained(self, threadID)
 
     def is_full(self, threadID, log):
         """
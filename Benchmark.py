@@ -0,0 +1,205 @@
+import os
+import sys
+import json
+import time
+import platform
+import itertools
+import numpy as np
+from SystolicArray import SystolicArray, ENGINE_VERSION
+from Utilities import pack_FIFOs, array_shape
+from MTSA_generator_script import generate_inputs
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'BenchmarkBaseline.json')
+
+# Benchmark grids. Buffer depth -1 is unlimited (PE), any other depth is limited (PElimited).
+GRIDS = {'quick': {'array_size':      (4, 8),
+                   'thread_number':   (1, 4),
+                   'sparsity':        (0.0, 0.7),
+                   'buffer_depth':    (2, -1),
+                   'inputMultiplier': (25,),
+                   'engine':          ('object', 'vectorized')},
+         'full':  {'array_size':      (4, 8, 16),
+                   'thread_number':   (1, 4, 16),
+                   'sparsity':        (0.0, 0.5, 0.9),
+                   'buffer_depth':    (2, 8, -1),
+                   'inputMultiplier': (10, 50),
+                   'engine':          ('object', 'vectorized')}}
+
+# Run phases, timed separately. pack_FIFOs is part of construction (object engine only), and is timed on its own as well.
+PHASES = ('construction', 'pack_FIFOs', 'tick', 'isDone', 'summarize')
+
+
+def case_name(configDict):
+
+    # Square arrays are named by their edge, rectangular ones by rows X columns.
+    rows, columns = array_shape(configDict['array_size'])
+    array_size    = rows if rows == columns else '{}X{}'.format(rows, columns)
+
+    return '{} N{} T{} S{:.2f} D{} X{}'.format(configDict['engine'], array_size, configDict['thread_number'],
+                                               configDict['sparsity'], configDict['buffer_depth'], configDict['inputMultiplier'])
+
+
+def benchmark_case(configDict, repeats=5):
+    """
+    Time full runs of a configuration, <repeats> times on the same inputs, keeping the fastest time of each phase.
+    :return: dictionary - simulated cycles, seconds per phase, cycles per second and PE updates (PE-cycles) per second.
+             Rates count the clock loop only (tick and isDone).
+    """
+    data_matrices, weight_matrices = generate_inputs(configDict, verbose=False)
+
+    best = dict.fromkeys(PHASES, np.inf)
+    for _ in range(repeats):
+        times = dict.fromkeys(PHASES, 0.0)
+
+        if configDict['engine'] == 'object':
+            start = time.perf_counter()
+            pack_FIFOs(data_matrices,   axis=0, thread_count=configDict['thread_number'], log=False)
+            pack_FIFOs(weight_matrices, axis=1, thread_count=configDict['thread_number'], log=False)
+            times['pack_FIFOs'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        systolic_array = SystolicArray(west_matrices=data_matrices,
+                                       north_matrices=weight_matrices,
+                                       array_size=configDict['array_size'],
+                                       thread_count=configDict['thread_number'],
+                                       buffer_depth=configDict['buffer_depth'],
+                                       log=False,
+                                       engine=configDict['engine'],
+                                       telemetry='off')
+        times['construction'] = time.perf_counter() - start
+
+        while 1:
+            start = time.perf_counter()
+            systolic_array.tick(log=False)
+            middle = time.perf_counter()
+            done = systolic_array.isDone()
+            end = time.perf_counter()
+
+            times['tick']   += middle - start
+            times['isDone'] += end - middle
+
+            if done:
+                break
+
+        cycles = systolic_array.clock - 1
+
+        start = time.perf_counter()
+        systolic_array.summarize()
+        times['summarize'] = time.perf_counter() - start
+
+        best = {phase: min(best[phase], times[phase]) for phase in PHASES}
+
+    loop = best['tick'] + best['isDone']
+
+    result = {'cycles': cycles}
+    result.update(('{}_seconds'.format(phase), best[phase]) for phase in PHASES)
+    result['cycles_per_second']     = cycles / loop
+    result['pe_updates_per_second'] = cycles * np.prod(array_shape(configDict['array_size'])) / loop
+
+    return result
+
+
+def run_benchmarks(grid='quick', repeats=5, seed=0, verbose=True):
+    """
+    Benchmark every configuration of a grid (a GRIDS name, or a dictionary of the same form).
+    :return: dictionary of case name (see case_name) to benchmark_case result
+    """
+    grid = GRIDS[grid] if isinstance(grid, str) else grid
+    keys = sorted(grid)
+
+    if verbose:
+        print('{:>34} | {:>7} | {:>9} {:>9} {:>9} {:>9} {:>9} | {:>10} {:>12}'.format(
+            'case', 'cycles', 'build[s]', 'pack[s]', 'tick[s]', 'isDone[s]', 'summ[s]', 'cycles/s', 'PE-upd/s'))
+
+    results = dict()
+    for values in itertools.product(*[grid[key] for key in keys]):
+        configDict = dict(zip(keys, values), seed=seed)
+        name       = case_name(configDict)
+
+        results[name] = benchmark_case(configDict, repeats=repeats)
+
+        if verbose:
+            r = results[name]
+            print('{:>34} | {:>7} | {:>9.4f} {:>9.4f} {:>9.4f} {:>9.4f} {:>9.4f} | {:>10.0f} {:>12.0f}'.format(
+                name, r['cycles'], r['construction_seconds'], r['pack_FIFOs_seconds'], r['tick_seconds'], r['isDone_seconds'],
+                r['summarize_seconds'], r['cycles_per_second'], r['pe_updates_per_second']))
+
+    return results
+
+
+def environment():
+    """
+    Where a benchmark ran - baselines are only comparable on the same machine and software.
+    """
+    return {'engine_version': ENGINE_VERSION,
+            'python':         platform.python_version(),
+            'numpy':          np.__version__,
+            'machine':        platform.machine(),
+            'processor':      platform.processor(),
+            'node':           platform.node(),
+            'time':           time.strftime('%Y-%m-%d %H:%M:%S')}
+
+
+def save_baseline(results, path=BASELINE_FILE):
+    """
+    Save benchmark results as the baseline later runs are compared against.
+    """
+    with open(path, 'w') as js:
+        json.dump({'environment': environment(), 'cases': results}, js, indent=4)
+
+    print('[INFO] - Baseline Saved To ' + path)
+
+
+def load_baseline(path=BASELINE_FILE):
+    """
+    :return: baseline dictionary saved by save_baseline, or None if there is none.
+    """
+    try:
+        with open(path, 'r') as js:
+            return json.load(js)
+    except (IOError, ValueError):
+        return None
+
+
+def compare(results, baseline, tolerance=0.1, verbose=True):
+    """
+    Compare simulated cycles per second against a baseline, case by case.
+    A case regresses if it is more than <tolerance> (relative) slower. Cases missing on either side are skipped.
+    :return: dictionary of regressed case name to speed ratio (new / baseline)
+    """
+    different = [key for key, value in environment().items() if key != 'time' and baseline['environment'].get(key) != value]
+    if verbose and different:
+        print('[WARNING] - Baseline Environment Differs: {}'.format(', '.join(different)))
+
+    regressions = dict()
+    ratios      = []
+    for name in sorted(set(results) & set(baseline['cases'])):
+        ratio = results[name]['cycles_per_second'] / baseline['cases'][name]['cycles_per_second']
+        ratios.append(ratio)
+
+        if ratio < 1 - tolerance:
+            regressions[name] = ratio
+        if verbose:
+            print('{:>34} | {:>10.0f} -> {:>10.0f} | x{:.2f}{}'.format(name, baseline['cases'][name]['cycles_per_second'],
+                                                                    results[name]['cycles_per_second'], ratio,
+                                                                    '  REGRESSION' if name in regressions else ''))
+
+    if verbose and ratios:
+        print('-------------------------------------------------------------------------------')
+        print('{} Cases, Geometric Mean Speed Ratio x{:.2f}, {} Regressions (Tolerance {:.0%})'.format(
+            len(ratios), float(np.exp(np.mean(np.log(ratios)))), len(regressions), tolerance))
+
+    return regressions
+
+
+if __name__ == '__main__':
+    # Usage: python Benchmark.py [quick|full] [--save]
+    # Compares against the stored baseline (exit status 1 on regression), or stores one with --save or if there is none.
+    grid     = sys.argv[1] if len(sys.argv) > 1 and not sys.argv[1].startswith('--') else 'quick'
+    results  = run_benchmarks(grid)
+    baseline = load_baseline()
+
+    if '--save' in sys.argv or baseline is None:
+        save_baseline(results)
+    elif compare(results, baseline):
+        sys.exit(1)
@@ -0,0 +1,108 @@
+import os
+import sys
+import time
+import logging
+import numpy as np
+from SystolicArray import SystolicArray
+
+CheckpointLogger = logging.getLogger('CheckpointLogger')
+
+
+def save_checkpoint(systolic_array, path):
+    """
+    Write a snapshot of systolic_array (see SystolicArray.snapshot) to <path>, as an uncompressed .npz archive.
+    The file is replaced atomically - an interrupted write leaves the previous checkpoint in place.
+    :return: size of the checkpoint [bytes]
+    """
+    temporary = path + '.tmp'
+    with open(temporary, 'wb') as f:
+        np.savez(f, **systolic_array.snapshot())
+    os.replace(temporary, path)
+
+    size = os.path.getsize(path)
+    CheckpointLogger.info("Checkpoint Of Clock {} Saved To {} ({} Bytes)".format(systolic_array.clock, path, size))
+    return size
+
+
+def load_checkpoint(path, log=False, trace=None, profile=False):
+    """
+    :return: SystolicArray restored from the checkpoint at <path> (see SystolicArray.restore).
+    """
+    with np.load(path) as archive:
+        state = {name: archive[name] for name in archive.files}
+
+    return SystolicArray.restore(state, log=log, trace=trace, profile=profile)
+
+
+class Checkpointer:
+    """
+    Periodic checkpoints of a long run into a single file, every <every_cycles> clock cycles and/or <every_seconds> seconds.
+    Typical loop:
+        systolic_array = checkpointer.resume() or SystolicArray(...)
+        while 1:
+            systolic_array.tick(log)
+            if systolic_array.isDone():
+                systolic_array.summarize()
+                break
+            checkpointer.update(systolic_array)
+        checkpointer.clear()
+    """
+
+    def __init__(self, path, every_cycles=None, every_seconds=None):
+
+        if every_cycles is None and every_seconds is None:
+            CheckpointLogger.critical("Checkpoint period isn't set")
+            raise ValueError("Checkpoint period isn't set")
+
+        self.path          = path
+        self.every_cycles  = every_cycles
+        self.every_seconds = every_seconds
+
+        self.last_clock = None
+        self.last_time  = time.time()
+
+    def resume(self, log=False, trace=None, profile=False):
+        """
+        :return: SystolicArray restored from the latest checkpoint, or None if there is none.
+        """
+        if not os.path.exists(self.path):
+            return None
+
+        systolic_array  = load_checkpoint(self.path, log=log, trace=trace, profile=profile)
+        self.last_clock = systolic_array.clock
+        self.last_time  = time.time()
+
+        CheckpointLogger.info("Resumed From {} On Clock {}".format(self.path, systolic_array.clock))
+        return systolic_array
+
+    def update(self, systolic_array):
+        """
+        Call once per clock cycle. Saves a checkpoint once a period is over.
+        :return: True if a checkpoint was saved.
+        """
+        if self.last_clock is None:
+            self.last_clock = systolic_array.clock
+
+        due = ((self.every_cycles is not None and systolic_array.clock - self.last_clock >= self.every_cycles) or
+               (self.every_seconds is not None and time.time() - self.last_time >= self.every_seconds))
+        if not due:
+            return False
+
+        save_checkpoint(systolic_array, self.path)
+        self.last_clock = systolic_array.clock
+        self.last_time  = time.time()
+        return True
+
+    def clear(self):
+        """
+        Remove the checkpoint - typically once the run is over, so the next one starts afresh.
+        """
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+if __name__ == '__main__':
+    # Inspect a checkpoint file.
+    with np.load(sys.argv[1]) as archive:
+        for name in archive.files:
+            print('{:32} {:10} {}'.format(name, str(archive[name].dtype), archive[name].shape))
@@ -0,0 +1,340 @@
+import os
+import json
+import time
+import logging
+import numpy as np
+from SystolicArray import SystolicArray
+
+EstimatorLogger = logging.getLogger('EstimatorLogger')
+
+CALIBRATION_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'EstimatorCalibration.json')
+
+# Calibration grid, and per regime the coupling coefficients and the relative clock error at each grid point,
+# as fitted by calibrate(). Errors are in grid order (array size, threads, sparsity, buffer depth, inputMultiplier) -
+# the unlimited regime has a single buffer depth, -1. Used until a calibration file exists.
+DEFAULT_CALIBRATION = {'grid':      {'array_sizes': [4, 8], 'threads': [1, 2, 4, 8, 16], 'sparsity_values': [0.0, 0.3, 0.5, 0.7, 0.9],
+                                     'buffer_depths': [2, 4], 'inputMultipliers': [25, 200]},
+                       'unlimited': {'coefficients': [0.584, 0.219, 0.138],
+                                     'errors':       [0.000, 0.000, 0.000, 0.000, 0.000, 0.000, 0.000, 0.000, 0.000, 0.000, 0.000, 0.000,
+                                                     -0.030, -0.001, -0.022, -0.010, 0.021, 0.001, 0.003, 0.000, 0.000, 0.000, -0.052,
+                                                     -0.044, 0.004, 0.005, 0.042, -0.004, 0.014, 0.002, 0.000, 0.000, 0.002, -0.026, -0.080,
+                                                     -0.027, 0.038, 0.020, 0.008, 0.003, 0.000, 0.000, -0.040, -0.010, -0.033, -0.020,
+                                                     0.008, -0.044, 0.027, 0.006, 0.000, 0.000, 0.000, 0.000, 0.000, 0.000, 0.000, 0.000,
+                                                     0.000, 0.000, 0.000, 0.000, 0.000, 0.023, 0.012, -0.002, 0.017, 0.003, 0.007, 0.000,
+                                                     0.000, 0.000, -0.082, -0.030, -0.043, 0.013, 0.024, -0.001, 0.008, 0.002, 0.000, 0.000,
+                                                     -0.055, -0.018, -0.066, -0.049, -0.001, 0.020, 0.020, 0.003, 0.000, 0.000, -0.065,
+                                                     -0.027, -0.077, -0.032, 0.021, -0.043, 0.025, 0.004]},
+                       'limited':   {'coefficients': [-1.400, 0.527, 0.307, 4.126],
+                                     'errors':       [0.000, 0.000, 0.000, 0.000, 0.000, 0.000, 0.000, 0.000, 0.000, 0.000, 0.000, 0.000,
+                                                     0.000, 0.000, 0.000, 0.000, 0.000, 0.000, 0.000, 0.000, 0.000, 0.000, 0.000, 0.000,
+                                                     0.027, 0.001, -0.043, -0.063, 0.025, -0.020, -0.017, -0.022, 0.043, 0.001, -0.005,
+                                                     -0.001, 0.000, 0.003, 0.003, 0.001, 0.000, 0.000, 0.000, 0.000, -0.061, -0.132, -0.079,
+                                                     -0.071, -0.001, -0.022, 0.022, -0.052, 0.054, -0.024, 0.048, -0.009, 0.018, 0.004,
+                                                     0.014, 0.002, 0.000, 0.000, 0.000, 0.000, -0.025, -0.085, -0.021, -0.030, -0.044,
+                                                     -0.134, -0.012, -0.088, 0.086, -0.041, 0.071, -0.031, 0.035, 0.006, 0.010, 0.003,
+                                                     0.000, 0.000, 0.000, 0.000, -0.019, -0.034, -0.035, -0.009, -0.053, -0.075, 0.055,
+                                                     -0.038, -0.022, -0.060, 0.097, -0.081, 0.066, 0.007, 0.064, 0.006, 0.000, 0.000, 0.000,
+                                                     0.000, 0.000, 0.000, 0.000, 0.000, 0.000, 0.000, 0.000, 0.000, 0.000, 0.000, 0.000,
+                                                     0.000, 0.000, 0.000, 0.000, 0.000, 0.000, 0.000, 0.000, 0.000, 0.041, 0.038, 0.004,
+                                                     0.010, 0.055, -0.038, 0.048, -0.004, 0.040, 0.000, 0.024, 0.004, 0.014, 0.002, 0.008,
+                                                     0.001, 0.000, 0.000, 0.000, 0.000, -0.135, -0.183, -0.082, -0.092, -0.049, -0.058,
+                                                     -0.013, -0.020, 0.035, -0.028, 0.028, 0.002, 0.010, 0.004, 0.015, 0.002, 0.000, 0.000,
+                                                     0.000, 0.000, -0.098, -0.099, -0.070, -0.049, -0.108, -0.198, -0.035, -0.118, 0.090,
+                                                     -0.073, 0.095, -0.034, 0.034, 0.007, 0.023, 0.004, 0.000, 0.000, 0.000, 0.000, -0.036,
+                                                     -0.056, -0.047, -0.036, -0.041, -0.109, -0.063, -0.059, 0.011, -0.190, -0.048, -0.127,
+                                                     0.057, 0.009, 0.044, 0.008]}}
+
+
+def load_calibration(path=CALIBRATION_FILE):
+    """
+    Read calibration file written by calibrate(). Fall back to DEFAULT_CALIBRATION if there is none,
+    or if it was written before calibrate() recorded its grid.
+    """
+    try:
+        with open(path, 'r') as js:
+            calibration = json.load(js)
+    except (IOError, ValueError):
+        return DEFAULT_CALIBRATION
+
+    if 'grid' not in calibration:
+        EstimatorLogger.warning("Calibration file {} has no grid errors - calibrate again. Using default calibration".format(path))
+        return DEFAULT_CALIBRATION
+    return calibration
+
+
+def grid_error(calibration, array_size, thread_count, sparsity, buffer_depth, inputMultiplier):
+    """
+    Largest calibration clock error around a configuration: over the grid points bracketing it on every axis,
+    or on an axis where it is a grid value, over that value and its neighbours.
+    :return: relative error, or None if the configuration is outside the calibrated grid.
+    """
+    grid   = calibration['grid']
+    regime = 'limited' if buffer_depth >= 0 else 'unlimited'
+    axes   = [grid['array_sizes'], grid['threads'], grid['sparsity_values'],
+              grid['buffer_depths'] if regime == 'limited' else [-1], grid['inputMultipliers']]
+    if not calibration[regime]['errors']:
+        return None
+    errors = np.abs(np.reshape(calibration[regime]['errors'], [len(values) for values in axes]))
+
+    window = []
+    for values, value in zip(axes, (array_size, thread_count, sparsity, buffer_depth, inputMultiplier)):
+        values = np.asarray(values)
+        if not values[0] <= value <= values[-1]:
+            return None
+        low  = int(np.searchsorted(values, value, side='right')) - 1
+        high = int(np.searchsorted(values, value, side='left'))
+        if low == high:
+            low, high = max(low - 1, 0), high + 1
+        window.append(slice(low, high + 1))
+
+    return float(errors[tuple(window)].max())
+
+
+def single_pe_cycles(thread_count, input_length, sparsity, samples, rng):
+    """
+    Monte-Carlo model of a single PE, with no neighbours.
+    Each thread streams <input_length> couples. A couple needs the MAC with probability (1-sparsity)^2 (both literals non-zero),
+    otherwise it passes on the same cycle. Threads compete for the MAC in Round-Robin order, like PE.tock.
+    :return: clock cycles to drain all threads, and the lower bound max(input_length, MAC count), per sample.
+    """
+    needs_mac = rng.random((samples, thread_count, input_length)) < (1 - sparsity) ** 2
+    bound     = np.maximum(needs_mac.sum(axis=(1, 2)), input_length)
+
+    # One loop iteration per clock cycle, so the cost grows with the cycle count - see estimate.
+    # Couples are read from a flat copy with a couple past each thread end that never needs the MAC,
+    # so drained threads drop out of the competition without masking.
+    heads = np.zeros((samples, thread_count, input_length + 1), dtype=bool)
+    heads[:, :, :input_length] = needs_mac
+    heads = heads.reshape(-1)
+    base  = np.arange(samples * thread_count).reshape(samples, thread_count) * (input_length + 1)
+
+    # Round-Robin rank of each thread, per pointer value.
+    ranks = (np.arange(thread_count) - np.arange(thread_count)[:, None]) % thread_count
+
+    rows     = np.arange(samples)
+    position = np.zeros((samples, thread_count), dtype=np.int64)
+    onThread = np.zeros(samples, dtype=np.int64)
+    cycles   = np.zeros(samples, dtype=np.int64)
+
+    while True:
+        active  = position < input_length
+        running = active.any(axis=1)
+        if not running.any():
+            break
+
+        head  = heads[base + position]
+        first = np.where(head, ranks[onThread], thread_count).argmin(axis=1)
+        mac   = head[rows, first]
+
+        position += active & ~head
+        position[rows, first] += mac
+        onThread  = (onThread + mac) % thread_count
+        cycles   += running
+
+    return cycles, bound
+
+
+def _features(contention, array_size, thread_count, buffer_depth):
+    """
+    Regression features of the coupling model. A stalled couple also stalls its row and column neighbours,
+    so the array excess over a lone PE grows with the array size and the thread count, and more so the shallower the buffers.
+    """
+    features = [contention, contention * np.log2(array_size), contention * np.log2(thread_count)]
+    if buffer_depth >= 0:
+        features.append(contention / buffer_depth)
+    return np.array(features)
+
+
+def _slowest_pe(array_size, thread_count, input_length, sparsity, repeats, rng):
+    """
+    Run single_pe_cycles on <repeats> arrays of array_size^2 PE's. The slowest PE of an array sets its pace.
+    :return: per repeat - excess of the slowest PE over input length due to its MAC count, and further excess due to contention.
+    """
+    cycles, bound = single_pe_cycles(thread_count, input_length, sparsity, repeats * array_size ** 2, rng)
+    cycles = cycles.reshape(repeats, array_size ** 2).max(axis=1)
+    bound  = bound.reshape(repeats, array_size ** 2).max(axis=1)
+    return bound - input_length, cycles - bound
+
+
+def estimate(array_size, thread_count, sparsity, buffer_depth, inputMultiplier, repeats=4, seed=None, calibration=None):
+    """
+    Predict runOnce summary without cycle-accurate simulation, on an array_size x array_size array -
+    the model is calibrated on square arrays only, rectangular ones are always simulated (see simulate_config).
+    - Clock: a PE needs at least max(input length, MAC count) cycles. Threads competing for the MAC add an excess,
+      estimated by single_pe_cycles on array_size^2 PE's and scaled by the calibrated coupling model.
+    - Utilization: expected MAC count per PE, spread over its active cycles, counted inside the window summarize keeps.
+    - Relative uncertainty: Monte-Carlo spread and the calibration error around the configuration (see grid_error).
+      Configurations outside the calibrated grid aren't extrapolated: their uncertainty is infinite,
+      so simulate_config always simulates them.
+    Cost grows with array_size^2 * thread_count * clock - single_pe_cycles takes one NumPy step per clock cycle:
+    a few ms for 4x4 and 8x8 arrays with short inputs (inputMultiplier 25), but about 0.35s for 8x8, 16 threads and
+    inputMultiplier 200 (clock ~7500), and about 3s for 16x16 - the 8x8 run is simulated cycle accurately in about 6s.
+    :return: dictionary with summary keys, plus 'total_clock_std' (Monte-Carlo spread) and 'relative_uncertainty'.
+    """
+    if calibration is None:
+        calibration = load_calibration()
+    regime = calibration['limited' if buffer_depth >= 0 else 'unlimited']
+
+    error = grid_error(calibration, array_size, thread_count, sparsity, buffer_depth, inputMultiplier)
+    if error is None:
+        EstimatorLogger.warning("Configuration outside the estimator calibration grid: {}x{} array, {} threads, sparsity {}, "
+                                "buffer depth {}, inputMultiplier {}".format(array_size, array_size, thread_count, sparsity,
+                                                                            buffer_depth, inputMultiplier))
+
+    rng          = np.random.default_rng(seed)
+    input_length = array_size * inputMultiplier
+    fill         = 2 * (array_size - 1)
+
+    mac_bound, contention = _slowest_pe(array_size, thread_count, input_length, sparsity, repeats, rng)
+
+    coupling = np.array([_features(c, array_size, thread_count, buffer_depth) @ regime['coefficients'] for c in contention])
+    clocks   = input_length - fill + 1 + mac_bound + np.maximum(coupling, 0)
+
+    total_clock = float(clocks.mean())
+
+    # Ticks between first and last clock, active span of each PE (starting at cycle i+j), and the window summarize keeps.
+    ticks    = total_clock + 2 * fill - 1
+    span     = ticks - fill
+    diagonal = np.add.outer(np.arange(array_size), np.arange(array_size))
+    overlap  = np.clip(np.minimum(diagonal + span, ticks - 2 * fill) - np.maximum(diagonal, 2 * fill), 0, None)
+    macs     = thread_count * input_length * (1 - sparsity) ** 2
+
+    utilization_per_pe = macs / span * overlap / total_clock
+
+    summary = dict()
+    summary['total_clock']           = total_clock
+    summary['avg_clock_per_matrix']  = total_clock / thread_count
+    summary['utilization_per_pe']    = utilization_per_pe
+    summary['total_avg_utilization'] = utilization_per_pe.mean()
+    summary['total_std_utilization'] = utilization_per_pe.std()
+    summary['total_clock_std']       = float(clocks.std())
+    summary['relative_uncertainty']  = float(np.hypot(clocks.std() / total_clock, error)) if error is not None else float('inf')
+    summary['estimated']             = True
+
+    return summary
+
+
+def simulate(array_size, thread_count, sparsity, buffer_depth, inputMultiplier, seed=None):
+    """
+    Cycle accurate reference, with inputs drawn the same way runOnce does.
+    :return: clock and utilization per PE after summarize.
+    """
+    rng           = np.random.default_rng(seed)
+    values        = np.arange(10)
+    probabilities = [sparsity] + [(1 - sparsity) / values[1:].shape[0] for _ in values[1:]]
+
+    input_length    = array_size * inputMultiplier
+    data_matrices   = rng.choice(values, (thread_count, array_size, input_length), p=probabilities)
+    weight_matrices = rng.choice(values, (thread_count, input_length, array_size), p=probabilities)
+
+    systolic_array = SystolicArray(west_matrices=data_matrices,
+                                   north_matrices=weight_matrices,
+                                   array_size=array_size,
+                                   thread_count=thread_count,
+                                   buffer_depth=buffer_depth,
+                                   log=False,
+                                   engine='vectorized',
+                                   telemetry='off')
+    while 1:
+        systolic_array.tick(log=False)
+        if systolic_array.isDone():
+            systolic_array.summarize()
+            break
+
+    return systolic_array.clock, systolic_array.utilization_per_pe
+
+
+def calibrate(array_sizes=(4, 8), threads=(1, 2, 4, 8, 16), sparsity_values=(0.0, 0.3, 0.5, 0.7, 0.9),
+              buffer_depths=(2, 4, -1), inputMultipliers=(25, 200), seed=0, save=True):
+    """
+    Run cycle accurate simulations over a configuration grid, fit the coupling model to them,
+    and report estimate errors before and after the fit.
+    The fit minimizes relative clock errors, so short and long inputs weigh the same. The error left at each grid point
+    is kept in the calibration (see grid_error) - estimates outside the grid are never trusted, so the grid should
+    cover the configurations estimated, e.g. the sweep of SpeedUpAndUtilizationExpe.generate_multiple_runs.
+    :return: new calibration dictionary
+    """
+    array_sizes, threads, sparsity_values, inputMultipliers = sorted(array_sizes), sorted(threads), sorted(sparsity_values), sorted(inputMultipliers)
+    limited_depths = sorted(depth for depth in buffer_depths if depth >= 0)
+
+    old_calibration = load_calibration()
+    rng = np.random.default_rng(seed)
+
+    rows = {'limited': [], 'unlimited': []}
+
+    for array_size in array_sizes:
+        for thread_count in threads:
+            for sparsity in sparsity_values:
+                for buffer_depth in limited_depths + ([-1] if -1 in buffer_depths else []):
+                    for inputMultiplier in inputMultipliers:
+
+                        run_seed = int(rng.integers(2 ** 31))
+                        start    = time.time()
+                        clock, utilization = simulate(array_size, thread_count, sparsity, buffer_depth, inputMultiplier, seed=run_seed)
+                        simulate_time = time.time() - start
+
+                        input_length = array_size * inputMultiplier
+                        mac_bound, contention = _slowest_pe(array_size, thread_count, input_length, sparsity, 4, np.random.default_rng(run_seed))
+
+                        start = time.time()
+                        old   = estimate(array_size, thread_count, sparsity, buffer_depth, inputMultiplier, seed=run_seed, calibration=old_calibration)
+                        estimate_time = time.time() - start
+
+                        rows['limited' if buffer_depth >= 0 else 'unlimited'].append(
+                            {'config': (array_size, thread_count, sparsity, buffer_depth, inputMultiplier),
+                             'features': _features(contention.mean(), array_size, thread_count, buffer_depth),
+                             'target': clock - (input_length - 2 * (array_size - 1) + 1) - mac_bound.mean(),
+                             'clock': clock, 'utilization': utilization.mean(),
+                             'old_clock': old['total_clock'], 'old_utilization': old['total_avg_utilization'],
+                             'simulate_time': simulate_time, 'estimate_time': estimate_time})
+
+    calibration = {'grid': {'array_sizes': array_sizes, 'threads': threads, 'sparsity_values': sparsity_values,
+                            'buffer_depths': limited_depths, 'inputMultipliers': inputMultipliers}}
+    for regime, regime_rows in rows.items():
+        if not regime_rows:
+            # No grid point to trust in this regime.
+            calibration[regime] = {'coefficients': old_calibration[regime]['coefficients'], 'errors': []}
+            continue
+        features = np.array([r['features'] for r in regime_rows])
+        targets  = np.array([r['target'] for r in regime_rows])
+        clocks   = np.array([r['clock'] for r in regime_rows])
+        coefficients = np.linalg.lstsq(features / clocks[:, None], targets / clocks, rcond=None)[0]
+
+        base   = clocks - targets
+        fitted = base + np.maximum(features @ coefficients, 0)
+        calibration[regime] = {'coefficients': coefficients.tolist(),
+                               'errors': np.round((fitted - clocks) / clocks, 3).tolist()}
+
+    print('[INFO] - Estimator Calibration Against Cycle Accurate Simulation')
+    print('----------------------------------------------------------------------------------------------------------')
+    print('{:>6} {:>7} {:>8} {:>6} {:>6} | {:>8} {:>8} {:>8} {:>6} | {:>6} {:>6} {:>6} | {:>8} {:>8}'.format(
+        'size', 'threads', 'sparsity', 'depth', 'input', 'clock', 'before', 'after', 'uncert', 'util', 'before', 'after', 'sim[s]', 'est[s]'))
+
+    errors = {'clock_before': [], 'clock_after': [], 'util_before': [], 'util_after': []}
+    for regime, regime_rows in rows.items():
+        for r in regime_rows:
+            array_size, thread_count, sparsity, buffer_depth, inputMultiplier = r['config']
+            new = estimate(array_size, thread_count, sparsity, buffer_depth, inputMultiplier, seed=seed, calibration=calibration)
+            print('{:>6} {:>7} {:>8.2f} {:>6} {:>6} | {:>8} {:>8.0f} {:>8.0f} {:>6.3f} | {:>6.3f} {:>6.3f} {:>6.3f} | {:>8.3f} {:>8.3f}'.format(
+                array_size, thread_count, sparsity, buffer_depth, inputMultiplier, r['clock'], r['old_clock'], new['total_clock'],
+                new['relative_uncertainty'], r['utilization'], r['old_utilization'], new['total_avg_utilization'], r['simulate_time'], r['estimate_time']))
+            errors['clock_before'].append(abs(r['old_clock'] - r['clock']) / r['clock'])
+            errors['clock_after'].append(abs(new['total_clock'] - r['clock']) / r['clock'])
+            errors['util_before'].append(abs(r['old_utilization'] - r['utilization']))
+            errors['util_after'].append(abs(new['total_avg_utilization'] - r['utilization']))
+
+    print('----------------------------------------------------------------------------------------------------------')
+    print('Clock relative error - before: mean {:.3f} max {:.3f}, after: mean {:.3f} max {:.3f}'.format(
+        np.mean(errors['clock_before']), np.max(errors['clock_before']), np.mean(errors['clock_after']), np.max(errors['clock_after'])))
+    print('Utilization absolute error - before: mean {:.3f} max {:.3f}, after: mean {:.3f} max {:.3f}'.format(
+        np.mean(errors['util_before']), np.max(errors['util_before']), np.mean(errors['util_after']), np.max(errors['util_after'])))
+
+    if save:
+        with open(CALIBRATION_FILE, 'w') as js:
+            json.dump(calibration, js, indent=4)
+        print('[INFO] - Calibration Saved To ' + CALIBRATION_FILE)
+
+    return calibration
+
+if __name__ == '__main__':
+    calibrate()
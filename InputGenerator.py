@@ -0,0 +1,157 @@
+import sys
+import time
+import logging
+import numpy as np
+
+InputGeneratorLogger = logging.getLogger('InputGeneratorLogger')
+
+# Zeros layouts, see generate_tensor.
+PATTERNS = ('element', 'block', 'row', 'column', 'nm', 'cluster')
+
+# Configuration keys of a pattern (see MTSA_generator_script.generate_inputs). Only 'pattern' is required.
+PATTERN_KEYS = ('pattern', 'block_shape', 'group_size', 'cluster_length')
+
+# Elements per generated chunk. Chunks are drawn from their own child seeds, so it is part of what a seed yields - keep it fixed.
+CHUNK_ELEMENTS = 1 << 22
+
+
+def generate_tensor(shape, sparsity, pattern='element', axis=2, top_value=10, seed=None, path=None, dtype=np.int64,
+                    block_shape=(4, 4), group_size=4, cluster_length=8):
+    """
+    Draw a (threads, rows, columns) input tensor: a zeros mask laid out by <pattern>, over values drawn uniformly from [1, top_value).
+    Operand streams - what an edge FIFO feeds, one per row (column) - run along <axis>: 2 for west tensors, 1 for north tensors.
+    Patterns, per thread, with <sparsity> the probability (or share) of zeros:
+        'element' - each operand is zero on its own - same distribution as generate_inputs without a pattern.
+        'block'   - tiles of block_shape (streams, operands) are zero.
+        'row'     - whole streams are zero.
+        'column'  - an operand position is zero across all streams.
+        'nm'      - N:M - every group_size consecutive operands of a stream hold exactly round(group_size * sparsity) zeros.
+        'cluster' - zero runs of cluster_length operands on average, alternating with non-zero runs
+                    (zero runs are made longer if non-zero runs would be shorter than an operand).
+    The tensor is generated in chunks of operand positions, each one from its own child of <seed>
+    (an int, a sequence of ints, or None for fresh entropy) - a seeded tensor is the same whatever memory it is generated in.
+    :param path: if given, the tensor is written straight into a new .npy file, chunk by chunk, and returned as np.memmap.
+    :return: tensor
+    """
+    if pattern not in PATTERNS:
+        InputGeneratorLogger.critical("Unknown sparsity pattern: {}".format(pattern))
+        raise ValueError("Unknown sparsity pattern: {}".format(pattern))
+    if not 0 <= sparsity <= 1:
+        InputGeneratorLogger.critical("Sparsity most be in range [0,1], not {}".format(sparsity))
+        raise ValueError("Sparsity most be in range [0,1], not {}".format(sparsity))
+    if axis not in (1, 2):
+        InputGeneratorLogger.critical("Streams axis most be 1 or 2, not {}".format(axis))
+        raise ValueError("Streams axis most be 1 or 2, not {}".format(axis))
+
+    threads, streams, length = shape[0], shape[3 - axis], shape[axis]
+    block_streams, block_operands = block_shape
+
+    if path is None:
+        tensor = np.zeros(shape, dtype=dtype)
+    else:
+        tensor = np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=tuple(shape))
+
+    root = np.random.SeedSequence(seed)
+
+    def child(*key):
+        return np.random.default_rng(np.random.SeedSequence(root.entropy, spawn_key=root.spawn_key + key))
+
+    # Whole streams are few - drawn up front. Other masks are drawn chunk by chunk.
+    if pattern == 'row':
+        zero_streams = child(0).random((threads, streams, 1)) < sparsity
+
+    # Chunks are cut on block and group edges.
+    step  = max(CHUNK_ELEMENTS // max(threads * streams, 1), 1)
+    align = block_operands if pattern == 'block' else group_size if pattern == 'nm' else 1
+    step  = max(step - step % align, align)
+
+    zero_state = None
+    for chunk, start in enumerate(range(0, length, step)):
+        rng = child(1, chunk)
+        operands = min(step, length - start)
+        chunk_shape = (threads, streams, operands)
+
+        if pattern == 'element':
+            zero = rng.random(chunk_shape) < sparsity
+        elif pattern == 'block':
+            tiles = rng.random((threads, -(-streams // block_streams), -(-operands // block_operands))) < sparsity
+            zero  = tiles.repeat(block_streams, axis=1).repeat(block_operands, axis=2)[:, :streams, :operands]
+        elif pattern == 'row':
+            zero = np.broadcast_to(zero_streams, chunk_shape)
+        elif pattern == 'column':
+            zero = np.broadcast_to(rng.random((threads, 1, operands)) < sparsity, chunk_shape)
+        elif pattern == 'nm':
+            groups = -(-operands // group_size)
+            # The first zeros of a random permutation of each group are zero.
+            order = rng.random((threads, streams, groups, group_size)).argsort(axis=3)
+            zero  = np.zeros(order.shape, dtype=bool)
+            np.put_along_axis(zero, order[..., :int(round(group_size * sparsity))], True, axis=3)
+            zero  = zero.reshape(threads, streams, -1)[:, :, :operands]
+        else:
+            zero, zero_state = _clustered_zeros(rng, threads * streams, operands, sparsity, cluster_length, zero_state)
+            zero = zero.reshape(chunk_shape)
+
+        values = rng.integers(1, top_value, size=chunk_shape).astype(dtype, copy=False)
+        values[zero] = 0
+
+        if axis == 2:
+            tensor[:, :, start:start + operands] = values
+        else:
+            tensor[:, start:start + operands, :] = values.transpose(0, 2, 1)
+
+    if path is not None:
+        tensor.flush()
+
+    return tensor
+
+
+def _clustered_zeros(rng, streams, operands, sparsity, cluster_length, zero_state):
+    """
+    Zeros mask of <streams> streams of a chunk: a two-state Markov chain per stream, drawn as alternating runs of
+    geometric lengths - zero runs of cluster_length operands on average, non-zero runs long enough for <sparsity> zeros.
+    :param zero_state: per stream, whether the last operand of the previous chunk was zero. None on the first chunk.
+    :return: (streams, operands) mask, and the state to carry into the next chunk.
+    """
+    if sparsity in (0, 1):
+        zero = np.full((streams, operands), bool(sparsity))
+        return zero, zero[:, -1]
+
+    zero_run    = max(cluster_length, sparsity / (1 - sparsity))
+    nonzero_run = zero_run * (1 - sparsity) / sparsity
+
+    # The chain is memoryless - a run cut at a chunk edge simply goes on with a fresh length.
+    if zero_state is None:
+        zero_state = rng.random(streams) < sparsity
+
+    # Enough runs to cover the chunk on average, plus more for the streams that fall short.
+    runs = 2 * (int(operands / (zero_run + nonzero_run)) + 8)
+    run_zero = zero_state[:, None] ^ (np.arange(runs) % 2 == 1)
+    lengths  = rng.geometric(1 / np.where(run_zero, zero_run, nonzero_run))
+    while lengths.sum(axis=1).min() < operands:
+        more      = zero_state[:, None] ^ (np.arange(runs, 2 * runs) % 2 == 1)
+        lengths   = np.concatenate((lengths, rng.geometric(1 / np.where(more, zero_run, nonzero_run))), axis=1)
+        run_zero  = np.concatenate((run_zero, more), axis=1)
+        runs     *= 2
+
+    # Cut every stream at the chunk end: runs past it get a length of 0.
+    ends    = np.minimum(lengths.cumsum(axis=1), operands)
+    lengths = np.diff(ends, axis=1, prepend=0)
+    zero    = np.repeat(run_zero.reshape(-1), lengths.reshape(-1)).reshape(streams, operands)
+
+    return zero, zero[:, -1]
+
+
+if __name__ == '__main__':
+    # Usage: python InputGenerator.py <path.npy> <threads> <rows> <columns> <sparsity> [pattern] [axis] [seed]
+    # Write a tensor straight to a .npy file - e.g. multi-GB inputs, later loaded with np.load(path, mmap_mode='r').
+    path, threads, rows, columns, sparsity = sys.argv[1], int(sys.argv[2]), int(sys.argv[3]), int(sys.argv[4]), float(sys.argv[5])
+    pattern = sys.argv[6] if len(sys.argv) > 6 else 'element'
+    axis    = int(sys.argv[7]) if len(sys.argv) > 7 else 2
+    seed    = int(sys.argv[8]) if len(sys.argv) > 8 else None
+
+    start  = time.time()
+    tensor = generate_tensor((threads, rows, columns), sparsity, pattern=pattern, axis=axis, seed=seed, path=path)
+    elapsed = time.time() - start
+
+    print('[INFO] - {} {} Tensor Written To {} In {:.1f}s ({:.0f} MB/s), Sparsity {:.3f}'.format(
+        tensor.shape, pattern, path, elapsed, tensor.nbytes / 2 ** 20 / max(elapsed, 1e-9), 1 - np.count_nonzero(tensor) / max(tensor.size, 1)))
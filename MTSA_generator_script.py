@@ -2,128 +2,397 @@ import os
 import json
 import numpy as np
 from SystolicArray import SystolicArray
+from SystolicArrayBatch import SystolicArrayBatch
+from Estimator import estimate
+from ResultsStore import ResultsStore
+from Checkpoint import Checkpointer
+from ResultCache import ResultCache, cache_key, DEFAULT_CACHE_DIRECTORY
+from InputGenerator import generate_tensor, PATTERN_KEYS
+from Utilities import dataflow_shapes, array_shape
+from TraceRecorder import TraceRecorder
 from pprint import pprint
-from datetime import datetime
 
 
-def runOnce(dumpTo='Default_WorkArea'):
+def prompt_config():
     """
-    - Create work dir 'dumpTo' if not exist, step into it.
-    - If exist, check if exist config file. if so: read it, else: prompt the user to specify properties for the simulator.
-    - Generate single experiment according to those parameters.
-    - Save summary into work area directory.
-    :param dumpTo: Location directory to save results into
+    Prompt the user to specify properties for the simulator.
+    :return: configuration dictionary
     """
+    configDict = dict()
+    configDict['thread_number']     = int(input('How Many Threads?'))
+    array_edges                     = [int(edge) for edge in input('What is the size of the Systolic Array? Enter 1 number for a square array, '
+                                                                   'or 2 - rows and columns - for a rectangular one').split()]
+    configDict['array_size']        = array_edges[0] if len(array_edges) == 1 else array_edges
+    configDict['sparsity']          = float(input('What is the sparsity level? Enter number in range [0,1] to indicate the probability for zero'))
+    configDict['is_limited_buffer'] = input('Are the buffers depth limited? (Yes/No)')
+    if configDict['is_limited_buffer'] == 'Yes':
+        configDict['is_limited_buffer'] = True
+    elif configDict['is_limited_buffer'] == 'No':
+        configDict['is_limited_buffer'] = False
+    if configDict['is_limited_buffer']:
+        configDict['buffer_depth']  = int(input('What is the limit? Enter some Integer in range [2, inf].\n'))
+    else:
+        configDict['buffer_depth'] = -1
+    configDict['inputMultiplier'] = int(input('How long are the inputs? Enter an integer to multiply SA edge (the longer one) by.\n'
+                                              'For example: for 8X8 SA, 8X800 west input tensors and 800X8 north input tensors, Enter 100.'))
+    configDict['loggingNow'] = input("Want's to log progress (Yes/No)? Note that it might make the simulation approx 16 time slower")
+    if configDict['loggingNow'] == 'Yes':
+        configDict['loggingNow'] = True
+    elif configDict['loggingNow'] == 'No':
+        configDict['loggingNow'] = False
 
-    if not os.path.exists(dumpTo):
-        try:
-            os.makedirs(dumpTo)
-        except OSError:
-            print("[ERROR] - Can't Create " + dumpTo + " Directory.")
-            exit(1)
+    return configDict
 
-        os.chdir(dumpTo)
-    else:
-        try:
-            os.chdir(dumpTo)
-        except OSError:
-            print("[ERROR] - Can't Change Directory To " + dumpTo)
-            exit(2)
-
-        # Check if ConfigFile exist in directory
-        fileList = [f for f in os.listdir('.') if os.path.isfile(os.path.join('.', f))]
-        configDict = dict()
-        found = False
-        for f in fileList:
-            if f.endswith('.json'):
+
+def load_config(dumpTo, interactive=True, verbose=True):
+    """
+    Read configuration file from work dir 'dumpTo'.
+    If there is none: prompt the user and save the answers into 'dumpTo', or raise IOError if not interactive.
+    :return: configuration dictionary
+    """
+    # Check if ConfigFile exist in directory
+    fileList = [f for f in os.listdir(dumpTo) if os.path.isfile(os.path.join(dumpTo, f))]
+    for f in fileList:
+        if f.endswith('.json'):
+            with open(os.path.join(dumpTo, f), 'r') as js:
+                try:
+                    configDict = json.load(js)
+                except ValueError:
+                    raise IOError('JSON Configuration file Corrupted: ' + os.path.join(dumpTo, f))
+            if verbose:
                 print('[INFO] - Configuration File Found.')
-                with open(f, 'r') as js:
-                    try:
-                        configDict = json.load(js)
-                    except Exception:
-                        print('JSON Configuration file Corrupted or something')
-                        break
                 print('[INFO] - Configurations:\n------------------------')
                 pprint(configDict)
-                found = True
-                break
-
-        if not found:
-            print("[INFO] - Configuration file didn't found")
-            configDict['thread_number']     = int(input('How Many Threads?'))
-            configDict['array_size']        = int(input('What is the size of the Systolic Array? Enter 1 number - array must be square'))
-            configDict['sparsity']          = float(input('What is the sparsity level? Enter number in range [0,1] to indicate the probability for zero'))
-            configDict['is_limited_buffer'] = input('Are the buffers depth limited? (Yes/No)')
-            if configDict['is_limited_buffer'] == 'Yes':
-                configDict['is_limited_buffer'] = True
-            elif configDict['is_limited_buffer'] == 'No':
-                configDict['is_limited_buffer'] = False
-            if configDict['is_limited_buffer']:
-                configDict['buffer_depth']  = int(input('What is the limit? Enter some Integer in range [2, inf].\n'))
-            else:
-                configDict['buffer_depth'] = -1
-            configDict['inputMultiplier'] = int(input('How long are the inputs? Enter an integer to multiply SA edge by.\n'
-                                                      'For example: for 8X8 SA, 8X800 west input tensors and 800X8 north input tensors, Enter 100.'))
-            configDict['loggingNow'] = input("Want's to log progress (Yes/No)? Note that it might make the simulation approx 16 time slower")
-            if configDict['loggingNow'] == 'Yes':
-                configDict['loggingNow'] = True
-            elif configDict['loggingNow'] == 'No':
-                configDict['loggingNow'] = False
-
-            with open('ConfigFile.json', 'w') as js:
-                json.dump(configDict, js)
-
-        top_value = 10
-        values    = np.arange(top_value)  # Matrices values would rand from: [0,top_value]
-
-        # We consider specified probability for 'zero' and Uniform Distribution on the rest.
-        probabilities = [configDict['sparsity']] + [(1 - configDict['sparsity']) / values[1:].shape[0] for _ in values[1:]]
-        print('Over Distribution: {}'.format(['{0:.2}'.format(p) for p in probabilities]))
+            return configDict
+
+    if not interactive:
+        raise IOError("Configuration file didn't found in " + dumpTo)
+
+    print("[INFO] - Configuration file didn't found")
+    configDict = prompt_config()
+
+    with open(os.path.join(dumpTo, 'ConfigFile.json'), 'w') as js:
+        json.dump(configDict, js)
+
+    return configDict
+
+
+def simulate_config(configDict, verbose=True, trace_path=None, checkpoint=None, profile_path=None, inputs=None):
+    """
+    Generate single experiment according to configuration dictionary.
+    Inputs are drawn from configDict['seed'] if given, otherwise from fresh entropy (so forked workers don't share inputs).
+    With configDict['loggingNow'], events are recorded into binary trace file trace_path (decode it with TraceRecorder.py).
+    :param checkpoint: Checkpointer of the run. The run resumes from its snapshot if there is one (inputs included,
+                       trace recorded from there on), saves snapshots periodically, and clears them once over.
+    With configDict['profile'], run phases are timed (see Profiler) into the summary 'profile' entry,
+    and exported to <profile_path>.pstats and <profile_path>.folded if profile_path is given.
+    :param inputs: InputStore to map seeded inputs and expected results from, read-only and in place (see InputStore).
+                   None to draw inputs and multiply them here.
+    :return: summary dictionary
+    :raise ValueError: if a checkpointed run asks for the parallel engine, whose runs can't be snapshotted.
+    :raise RuntimeError: if the array results differ from the expected matrix products.
+    """
+    if checkpoint is not None and configDict.get('engine', 'object') == 'parallel':
+        raise ValueError("Parallel engine runs can't be checkpointed - drop 'checkpoint_cycles' and 'checkpoint_seconds', or pick another engine")
 
-        west_tensor_shape  = (configDict['thread_number'], configDict['array_size'],                                 configDict['array_size'] * configDict['inputMultiplier'])
-        north_tensor_shape = (configDict['thread_number'], configDict['array_size'] * configDict['inputMultiplier'], configDict['array_size'])
+    # Fast estimate mode: keep the estimate if it is certain enough, otherwise fall back to cycle accurate simulation.
+    # The estimator models output-stationary dataflow on square arrays only.
+    rows, columns = array_shape(configDict['array_size'])
+    if configDict.get('estimate_tolerance') is not None and configDict.get('dataflow', 'output') == 'output' and rows == columns:
+        summaryDict = estimate(array_size=rows,
+                               thread_count=configDict['thread_number'],
+                               sparsity=configDict['sparsity'],
+                               buffer_depth=configDict['buffer_depth'],
+                               inputMultiplier=configDict['inputMultiplier'])
+        if summaryDict['relative_uncertainty'] <= configDict['estimate_tolerance']:
+            return summaryDict
+        if verbose:
+            print('[INFO] - Estimate Uncertainty {:.3f} Above Tolerance. Running Cycle Accurate Simulation'.format(summaryDict['relative_uncertainty']))
 
-        data_matrices   = np.random.choice(values, west_tensor_shape,  p=probabilities)
-        weight_matrices = np.random.choice(values, north_tensor_shape, p=probabilities)
-        result_matrices = np.matmul(data_matrices, weight_matrices)
+    trace = None
+    if configDict['loggingNow'] and trace_path is not None:
+        trace = TraceRecorder(array_size=configDict['array_size'],
+                              thread_count=configDict['thread_number'],
+                              limited=configDict['buffer_depth'] >= 0,
+                              path=trace_path)
+
+    systolic_array = None
+    if checkpoint is not None:
+        systolic_array = checkpoint.resume(log=configDict['loggingNow'], trace=trace, profile=configDict.get('profile', False))
+
+    result_matrices = None
+    if systolic_array is None:
+        stored = inputs.load(configDict, verbose=verbose) if inputs is not None else None
+        if stored is not None:
+            data_matrices, weight_matrices, result_matrices = stored
+        else:
+            data_matrices, weight_matrices = generate_inputs(configDict, verbose=verbose)
 
         systolic_array = SystolicArray(west_matrices=data_matrices,
                                        north_matrices=weight_matrices,
                                        array_size=configDict['array_size'],
                                        thread_count=configDict['thread_number'],
                                        buffer_depth=configDict['buffer_depth'],
-                                       log=configDict['loggingNow'])
+                                       log=configDict['loggingNow'],
+                                       engine=configDict.get('engine', 'object'),
+                                       telemetry=configDict.get('telemetry', 'full'),
+                                       trace=trace,
+                                       profile=configDict.get('profile', False),
+                                       workers=configDict.get('workers'),
+                                       arbitration=configDict.get('arbitration', 'round_robin'),
+                                       dataflow=configDict.get('dataflow', 'output'))
+
+    if result_matrices is None:
+        result_matrices = np.matmul(systolic_array.west_matrices, systolic_array.north_matrices)
+
+    while 1:
+
+        systolic_array.tick(log=configDict['loggingNow'])
+
+        if systolic_array.isDone():
+            systolic_array.summarize()
+            break
+
+        if checkpoint is not None:
+            checkpoint.update(systolic_array)
+
+    if checkpoint is not None:
+        checkpoint.clear()
+
+    if trace is not None:
+        trace.close()
+
+    if np.any(systolic_array.results - result_matrices):
+        raise RuntimeError('MTSA results are different then Expected results')
+
+    if systolic_array.profiler is not None and profile_path is not None:
+        systolic_array.profiler.dump_stats(profile_path + '.pstats')
+        systolic_array.profiler.dump_folded(profile_path + '.folded')
+
+    # Per cycle buffers load is recorded on 'full' telemetry level only - lower levels keep occupancy statistics.
+    return make_summary(clock=systolic_array.clock,
+                        thread_count=configDict['thread_number'],
+                        utilization_per_pe=systolic_array.utilization_per_pe,
+                        load_statistics=systolic_array.occupancy_statistics(),
+                        load_records=systolic_array.load_records() if systolic_array.telemetry.level == 'full' else None,
+                        profile=systolic_array.profile_report())
+
+
+def simulate_batch(configDicts, verbose=True, inputs=None):
+    """
+    Generate the experiments of several configurations in a single batched simulation (see SystolicArrayBatch).
+    Configurations must share array size, buffer depth, telemetry level, arbitration policy and dataflow - thread number, sparsity,
+    input length and seed may differ.
+    Inputs are drawn exactly as simulate_config draws them. Runs are always cycle accurate, on the vectorized engine:
+    'engine', 'loggingNow' and 'estimate_tolerance' are ignored.
+    :param inputs: InputStore to map seeded inputs and expected results from, None to draw inputs and multiply them here.
+    :return: list of summary dictionaries, one per configuration, as simulate_config returns them.
+    :raise ValueError: if configurations don't fit a single batch.
+    :raise RuntimeError: if the results of an element differ from its expected matrix products.
+    """
+    shared = [(array_shape(configDict['array_size']), configDict['buffer_depth'], configDict.get('telemetry', 'full'),
+               configDict.get('arbitration', 'round_robin'), configDict.get('dataflow', 'output'))
+              for configDict in configDicts]
+    if len(set(shared)) != 1:
+        raise ValueError('Batched configurations must share array size, buffer depth, telemetry level, arbitration policy and dataflow')
+    array_size, buffer_depth, telemetry, arbitration, dataflow = shared[0]
+
+    tensors = []
+    for configDict in configDicts:
+        stored = inputs.load(configDict, verbose=verbose) if inputs is not None else None
+        if stored is None:
+            data_matrices, weight_matrices = generate_inputs(configDict, verbose=verbose)
+            stored = data_matrices, weight_matrices, np.matmul(data_matrices, weight_matrices)
+        tensors.append(stored)
+
+    systolic_array = SystolicArrayBatch(west_matrices=[data_matrices for data_matrices, _, _ in tensors],
+                                        north_matrices=[weight_matrices for _, weight_matrices, _ in tensors],
+                                        array_size=array_size,
+                                        buffer_depth=buffer_depth,
+                                        log=False,
+                                        telemetry=telemetry,
+                                        arbitration=arbitration,
+                                        dataflow=dataflow)
+
+    while 1:
+
+        systolic_array.tick(log=False)
+
+        if systolic_array.isDone():
+            systolic_array.summarize()
+            break
+
+    summaries = []
+    for element, (configDict, (_, _, result_matrices)) in enumerate(zip(configDicts, tensors)):
 
-        while 1:
+        if np.any(systolic_array.results[element] - result_matrices):
+            raise RuntimeError('MTSA results are different then Expected results (batch element {})'.format(element))
 
-            systolic_array.tick(log=configDict['loggingNow'])
+        summaries.append(make_summary(clock=int(systolic_array.clock[element]),
+                                      thread_count=configDict['thread_number'],
+                                      utilization_per_pe=systolic_array.utilization_per_pe[element],
+                                      load_statistics=systolic_array.occupancy_statistics(element),
+                                      load_records=systolic_array.load_records(element) if telemetry == 'full' else None))
 
-            if systolic_array.isDone():
-                systolic_array.summarize()
-                break
+    return summaries
+
+
+def generate_inputs(configDict, verbose=True, paths=None):
+    """
+    Draw west (data) and north (weight) input tensors of a configuration, from configDict['seed'] if given.
+    With a 'pattern' key, tensors are drawn by InputGenerator.generate_tensor (vectorized, chunked, structured sparsity,
+    see PATTERN_KEYS) - without one, they are drawn as they always were, so seeded inputs of existing configurations stay the same.
+    Tensors are shaped for configDict['dataflow'] (see Utilities.dataflow_shapes) - streams are inputMultiplier times
+    the longer array edge long (array_size * inputMultiplier for square arrays).
+    :param paths: west and north .npy file paths - if given, tensors are written there and returned as np.memmap's.
+    :return: data matrices and weight matrices
+    """
+    dataflow = configDict.get('dataflow', 'output')
+    west_tensor_shape, north_tensor_shape = dataflow_shapes(configDict['array_size'], configDict['thread_number'],
+                                                            max(array_shape(configDict['array_size'])) * configDict['inputMultiplier'], dataflow)
+
+    if 'pattern' in configDict:
+        seed    = configDict.get('seed')
+        pattern = {key: configDict[key] for key in PATTERN_KEYS if key in configDict}
+        if verbose:
+            print('Over Pattern: {}, Sparsity {}'.format(pattern, configDict['sparsity']))
+
+        # West and north tensors are drawn from distinct children of the seed.
+        # Patterns run along the operand streams - weight-stationary streams west columns, input-stationary north rows.
+        data_matrices   = generate_tensor(west_tensor_shape,  configDict['sparsity'], axis=1 if dataflow == 'weight' else 2,
+                                          seed=None if seed is None else (seed, 0), path=paths[0] if paths else None, **pattern)
+        weight_matrices = generate_tensor(north_tensor_shape, configDict['sparsity'], axis=2 if dataflow == 'input' else 1,
+                                          seed=None if seed is None else (seed, 1), path=paths[1] if paths else None, **pattern)
+
+        return data_matrices, weight_matrices
+
+    random_state = np.random.RandomState(configDict.get('seed'))
+
+    top_value = 10
+    values    = np.arange(top_value)  # Matrices values would rand from: [0,top_value]
+
+    # We consider specified probability for 'zero' and Uniform Distribution on the rest.
+    probabilities = [configDict['sparsity']] + [(1 - configDict['sparsity']) / values[1:].shape[0] for _ in values[1:]]
+    if verbose:
+        print('Over Distribution: {}'.format(['{0:.2}'.format(p) for p in probabilities]))
+
+    data_matrices   = random_state.choice(values, west_tensor_shape,  p=probabilities)
+    weight_matrices = random_state.choice(values, north_tensor_shape, p=probabilities)
+
+    if paths:
+        mapped = []
+        for path, tensor in zip(paths, (data_matrices, weight_matrices)):
+            mapped.append(np.lib.format.open_memmap(path, mode='w+', dtype=tensor.dtype, shape=tensor.shape))
+            mapped[-1][...] = tensor
+            mapped[-1].flush()
+        data_matrices, weight_matrices = mapped
+
+    return data_matrices, weight_matrices
+
+
+def make_summary(clock, thread_count, utilization_per_pe, load_statistics, load_records=None, profile=None):
+    """
+    Summary dictionary of a single experiment, as appended to the results store by runOnce.
+    :param load_records: per cycle buffers load - recorded on 'full' telemetry level only, None otherwise.
+    :param profile: Profiler report of a profiled run, None otherwise.
+    :return: summary dictionary
+    """
+    summaryDict = dict()
+
+    summaryDict['total_clock'] = clock
+    summaryDict['avg_clock_per_matrix'] = summaryDict['total_clock'] / thread_count
+    summaryDict['utilization_per_pe'] = utilization_per_pe
+    summaryDict['total_avg_utilization'] = summaryDict['utilization_per_pe'].mean()
+    summaryDict['total_std_utilization'] = summaryDict['utilization_per_pe'].std()
+
+    if load_records is not None:
+        summaryDict['load_record_per_buffer'] = load_records
+    summaryDict['load_statistics_per_buffer'] = load_statistics
+
+    if profile is not None:
+        summaryDict['profile'] = profile
+
+    return summaryDict
+
+
+def lookup_cache(configDict, cache, store, rundir=None):
+    """
+    Look configDict up in cache. A cached summary is appended to store, unless it was appended there already.
+    :return: run id in store, or None on a cache miss (or without a cache).
+    """
+    summaryDict = cache.get(configDict) if cache is not None else None
+    if summaryDict is None:
+        return None
+
+    key    = cache_key(configDict)
+    run_id = store.find(key)
+    if run_id is None:
+        run_id = store.append(configDict, summaryDict, rundir=rundir, cache_key=key)
+
+    return run_id
+
+
+def record_run(configDict, summaryDict, store, cache=None, rundir=None):
+    """
+    Append the summary of a simulated run to store, and put it in cache if given.
+    :return: run id in store
+    """
+    if cache is not None:
+        cache.put(configDict, summaryDict)
+
+    return store.append(configDict, summaryDict, rundir=rundir, cache_key=cache_key(configDict))
+
+
+def runOnce(dumpTo='Default_WorkArea', interactive=True, store=None, cache=DEFAULT_CACHE_DIRECTORY):
+    """
+    - Create work dir 'dumpTo' if not exist.
+    - Check if exist config file in it. if so: read it, else: prompt the user to specify properties for the simulator
+      (or raise IOError if not interactive).
+    - Return the cached summary if this configuration (with its seed) was simulated already, otherwise
+      generate single experiment according to those parameters (no trace is recorded on a cache hit).
+    - With 'checkpoint_cycles' and/or 'checkpoint_seconds' in the configuration, snapshot the run into 'dumpTo' that often,
+      and resume an interrupted run from its snapshot (see Checkpoint). The parallel engine can't be checkpointed.
+    - With 'profile' in the configuration, export run phase timings to 'dumpTo' (Profile.pstats, Profile.folded).
+    - Append summary to the results store.
+    The working directory is never changed, so runs can execute in parallel (see SpeedUpAndUtilizationExpe.run_sweep).
+    :param dumpTo: Location directory to read configuration from
+    :param interactive: allow falling back to input() prompts when there is no config file
+    :param store: ResultsStore to append into, or its directory - 'dumpTo' if None
+    :param cache: ResultCache, or its directory - None to always simulate
+    :return: run id in the results store
+    """
+
+    if not os.path.exists(dumpTo):
+        try:
+            os.makedirs(dumpTo)
+        except OSError:
+            print("[ERROR] - Can't Create " + dumpTo + " Directory.")
+            exit(1)
 
-        if np.any(systolic_array.results - result_matrices):
-            print('[ERROR] - MTSA results are different then Expected results')
-            exit(3)
+    configDict = load_config(dumpTo, interactive=interactive)
 
-        summaryDict = dict()
+    results_store = store if isinstance(store, ResultsStore) else ResultsStore(dumpTo if store is None else store)
+    result_cache  = cache if cache is None or isinstance(cache, ResultCache) else ResultCache(cache)
 
-        summaryDict['total_clock'] = systolic_array.clock
-        summaryDict['avg_clock_per_matrix'] = summaryDict['total_clock'] / configDict['thread_number']
-        summaryDict['utilization_per_pe'] = systolic_array.utilization_per_pe
-        summaryDict['total_avg_utilization'] = summaryDict['utilization_per_pe'].mean()
-        summaryDict['total_std_utilization'] = summaryDict['utilization_per_pe'].std()
+    try:
+        run_id = lookup_cache(configDict, result_cache, results_store, rundir=dumpTo)
+        if run_id is None:
+            checkpoint = None
+            if configDict.get('checkpoint_cycles') or configDict.get('checkpoint_seconds'):
+                checkpoint = Checkpointer(os.path.join(dumpTo, 'Checkpoint.npz'),
+                                          every_cycles=configDict.get('checkpoint_cycles'),
+                                          every_seconds=configDict.get('checkpoint_seconds'))
 
-        summaryDict['load_record_per_buffer'] = dict()
-        for i in range(systolic_array.array_size-1):
-            for j in range(systolic_array.array_size-1):
-                summaryDict['load_record_per_buffer'][(systolic_array.horizontal_buffer_array[i][j].iindex,
-                                                       systolic_array.horizontal_buffer_array[i][j].jindex, 'H')] = systolic_array.horizontal_buffer_array[i][j].load
-                summaryDict['load_record_per_buffer'][(systolic_array.vertical_buffer_array[i][j].iindex,
-                                                       systolic_array.vertical_buffer_array[i][j].jindex, 'V')] = systolic_array.vertical_buffer_array[i][j].load
+            summaryDict = simulate_config(configDict, trace_path=os.path.join(dumpTo, 'Trace.bin'), checkpoint=checkpoint,
+                                          profile_path=os.path.join(dumpTo, 'Profile'))
+            run_id      = record_run(configDict, summaryDict, results_store, result_cache, rundir=dumpTo)
+    finally:
+        if results_store is not store:
+            results_store.close()
+        if result_cache is not cache and result_cache is not None:
+            result_cache.close()
 
-        np.save('Summary' + str(datetime.now().month) + '_' + str(datetime.now().day) + '_' + str(datetime.now().year) + '_' +
-                str(datetime.now().hour) + '_' + str(datetime.now().minute) + '_' + str(datetime.now().second), summaryDict)
+    return run_id
 
 
 if __name__ == '__main__':
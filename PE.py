@@ -1,4 +1,5 @@
 import logging
+from TraceRecorder import WEST_EMPTY, NORTH_EMPTY, LITERALS, LEFT, MAC, PE_DONE
 
 PELogger = logging.getLogger("PELogger")
 
@@ -8,13 +9,14 @@ class PE:
     PE logic element in SystolicArray
     """
 
-    def __init__(self, i, j, thread_count, matrix_size, log):
+    def __init__(self, i, j, thread_count, matrix_size, telemetry, log, arbiter=None):
         """
         Construct PE instance.
         PE is basically MAC unit that can multiply 2 scalars from it's west and north corners and accumulate the result
         with previous results.
         It save intermediate results in <threads_number> size array.
         If at least one of its west,north entrances equals zero, it can skip it, and perform the next thread data.
+        arbiter is the Arbiter that picks which thread gets the MAC when several could (see Arbitration), None for round-robin.
         """
         self.iindex = i
         self.jindex = j
@@ -30,12 +32,30 @@ class PE:
         self.thread_count = thread_count
         self.onThread = 0
 
-        # mac_utility is binary list. Each clock cycle, '1' is append if the MAC was enabled, '0' otherwise.
-        self.mac_utility = []
+        self.arbiter = arbiter
+
+        # For each thread, number of cycles its top non-zero couple has been left in the input buffers (see Arbiter.order).
+        self.waiting = [0 for _ in range(thread_count)]
+
+        # Telemetry store of the SystolicArray. Each clock cycle, <i,j> of its MAC row is set to '1' if the MAC was enabled.
+        self.telemetry = telemetry
+
+        # pending is True if at least one thread has input in both west and north buffers.
+        # A PE without pending work doesn't need to tock - input buffers raise it again on push.
+        self.pending = True
 
         if log:
             PELogger.info("PE <{},{}> Initialized.".format(self.iindex, self.jindex))
 
+    def reset(self):
+        """
+        Clear intermediate results and Round-Robin state for a new job. Buffers stay connected.
+        """
+        self.result   = [0 for _ in range(self.thread_count)]
+        self.onThread = 0
+        self.waiting  = [0 for _ in range(self.thread_count)]
+        self.pending  = True
+
     def connect(self, west_buffer, north_buffer, east_buffer, south_buffer, log):
         """
         Connect PE to adjacent Buffers.
@@ -45,6 +65,9 @@ class PE:
         self.east_buffer  = east_buffer
         self.south_buffer = south_buffer
 
+        self.west_buffer.consumer  = self
+        self.north_buffer.consumer = self
+
         if log:
             PELogger.debug("<{},{}> Connected: west: {}, north: {}, east: {}, south: {}".format(self.iindex,
                                                                                                 self.jindex,
@@ -60,66 +83,55 @@ class PE:
         For each such couple, it performs a single MAC move, save the results in local result list, and pass the arguments
         to south and west output buffers, accordingly.
         For zeroed / None couples, it just pass the arguments to the next buffers.
+        :param log: TraceRecorder to record events into (see TraceRecorder.decode for their log messages), or False.
         :return: None
         """
 
-        # Reorder buffers list to start at onThread buffers.
-        buffer_reorder = list(self.west_buffer.buffer.copy())[self.onThread:]
-        buffer_reorder += list(self.west_buffer.buffer.copy())[:self.onThread]
+        # Reorder threads to start at onThread - or at the thread the arbitration policy picked for the MAC.
+        if self.arbiter is None:
+            thread_reorder = list(range(self.onThread, self.thread_count)) + list(range(self.onThread))
+        else:
+            thread_reorder = self.arbiter.order(self)
 
         MAC_on = False # to indicate if a mac op have took place already this CC
 
-        for thread_id in buffer_reorder:
-
-            west_thread_buffer = self.west_buffer.buffer[thread_id]
-            north_thread_buffer = self.north_buffer.buffer[thread_id]
+        for thread_number in thread_reorder:
 
-            thread_number = int(thread_id[1:])
-
-            # Try to pull input from west buffer
-            try:
-                west_in = west_thread_buffer.pop(0)
-            except IndexError:
+            # Try to read input from west buffer
+            if self.west_buffer.is_empty(thread_number):
 
                 if log:
-                    PELogger.debug("<{},{}> - Thread: {}, West Buffer is Empty.".format(self.iindex, self.jindex, thread_number))
+                    log.record(WEST_EMPTY, self.iindex, self.jindex, thread_number)
                 continue
-            # Try to pull input from north buffer
-            try:
-                north_in = north_thread_buffer.pop(0)
-            except IndexError:
+            # Try to read input from north buffer
+            if self.north_buffer.is_empty(thread_number):
 
                 if log:
-                    PELogger.debug("<{},{}> - Thread: {}, North Buffer is Empty.".format(self.iindex, self.jindex, thread_number))
-
-                # If we got up here, it means that west succeeded. But if north failed, we need to push back west.
-                west_thread_buffer.insert(0, west_in)
-                if log:
-                    PELogger.debug("<{},{}> - Thread: {}, West Input Pushed Back to West Buffer".format(self.iindex, self.jindex, thread_number))
+                    log.record(NORTH_EMPTY, self.iindex, self.jindex, thread_number)
                 continue
 
+            west_in  = self.west_buffer.peek(thread_number)
+            north_in = self.north_buffer.peek(thread_number)
+
             if log:
-                PELogger.info("<{},{}> - Thread: {}, West Literal: {}, North Literal: {}".format(self.iindex, self.jindex, thread_number, west_in, north_in))
+                log.record(LITERALS, self.iindex, self.jindex, thread_number, west_in, north_in)
 
             # If MAC_on=True, that mean that the MAC has already worked this clock cycle.
-            # If that's the case, if inputs aren't zeros/bubbles, we need to push them beck to input buffers.
+            # If that's the case, if inputs aren't zeros/bubbles, we leave them in input buffers.
             if west_in != 0 and north_in != 0 and west_in is not None and north_in is not None and MAC_on:
 
-                west_thread_buffer.insert(0, west_in)
-
                 if log:
-                    PELogger.debug("<{},{}> - Thread: {}, West Input Pushed Back to West Buffer".format(self.iindex, self.jindex, thread_number))
-
-                north_thread_buffer.insert(0, north_in)
-
-                if log:
-                    PELogger.debug("<{},{}> - Thread: {}, North Input Pushed Back to North Buffer".format(self.iindex, self.jindex, thread_number))
+                    log.record(LEFT, self.iindex, self.jindex, thread_number, west_in, north_in)
 
                 continue
 
+            # Inputs are consumed from here on.
+            self.west_buffer.commit(thread_number)
+            self.north_buffer.commit(thread_number)
+
             # If both aren't zero, aren't None (=bubble), and MAC hasn't worked yet this clock cycle, Calculate.
             # Turn MAC_on to True to indicate that MAC is working this clock cycle.
-            elif west_in != 0 and north_in != 0 and west_in is not None and north_in is not None and not MAC_on:
+            if west_in != 0 and north_in != 0 and west_in is not None and north_in is not None and not MAC_on:
 
                 self.onThread += 1
                 if self.onThread > self.thread_count - 1:
@@ -131,16 +143,15 @@ class PE:
                 self.result[thread_number] += west_in * north_in
 
                 if log:
-                    PELogger.debug("<{},{}> - Thread: {}, "
-                                   "MAC On, Intermediate result: {}".format(self.iindex, self.jindex, thread_number, self.result[thread_number]))
+                    log.record(MAC, self.iindex, self.jindex, thread_number, self.result[thread_number])
                 # Push west input to east buffer
                 self.east_buffer.push_to(thread_number, west_in, log=log)
 
                 # Push north input to south buffer
                 self.south_buffer.push_to(thread_number, north_in, log=log)
 
-                # Add '1' to mac_utility to indicate that the MAC worked on this cycle.
-                self.mac_utility.append(1)
+                # Mark MAC row to indicate that the MAC worked on this cycle.
+                self.telemetry.mac_cycle[self.iindex, self.jindex] = 1
 
                 continue
 
@@ -168,14 +179,30 @@ class PE:
 
                 continue
 
-        # If after we passed through all Threads buffers, and yet MAC_on didn't change,
-        # that's mean that all inputs were zeros or bubbles.
-        # In that case, MAC is not working in this clock cycle, and we append '0' to utility logger.
-        if not MAC_on:
-            self.mac_utility.append(0)
+        self.update_pending()
 
         if log:
-            PELogger.info("<{},{}> - All Threads, Intermediate Result: {}, MAC Utilization History: {}".format(self.iindex, self.jindex, self.result, self.mac_utility))
+            log.record(PE_DONE, self.iindex, self.jindex, -1, MAC_on)
+
+    def is_mac_couple(self, thread_number, west_in, north_in):
+        """
+        :return: True if the couple of thread_number needs the MAC - two non-zero operands, no bubble.
+        """
+        return west_in is not None and north_in is not None and west_in != 0 and north_in != 0
+
+    def update_pending(self):
+        """
+        Check if at least one thread has input in both west and north buffers.
+        """
+        west_size  = self.west_buffer.size
+        north_size = self.north_buffer.size
+
+        for thread_number in range(self.thread_count):
+            if west_size[thread_number] and north_size[thread_number]:
+                self.pending = True
+                return
+
+        self.pending = False
 
     def __repr__(self):
         return '\n<{},{}>:\n\tWestBuffer: {}\n\tNorthBuffer: {}\n\t' \
@@ -189,9 +216,9 @@ class PElimited(PE):
     Special PE to support BUFFERlimited
     """
 
-    def __init__(self, i, j, thread_count, matrix_size, log):
+    def __init__(self, i, j, thread_count, matrix_size, telemetry, log, arbiter=None):
 
-        super().__init__(i=i, j=j, thread_count=thread_count, matrix_size=matrix_size, log=log)
+        super().__init__(i=i, j=j, thread_count=thread_count, matrix_size=matrix_size, telemetry=telemetry, log=log, arbiter=arbiter)
 
         if log:
             PELogger.info("PE Changed To PElimited")
@@ -203,82 +230,63 @@ class PElimited(PE):
         in case that the inputs are good to go, but correspondent output are full, next thread is being checked.
         """
 
-        buffer_reorder = list(self.west_buffer.buffer.copy())[self.onThread:]
-        buffer_reorder += list(self.west_buffer.buffer.copy())[:self.onThread]
+        if self.arbiter is None:
+            thread_reorder = list(range(self.onThread, self.thread_count)) + list(range(self.onThread))
+        else:
+            thread_reorder = self.arbiter.order(self)
 
         MAC_on = False
 
-        for thread_id in buffer_reorder:
+        for thread_number in thread_reorder:
 
-            west_thread_buffer = self.west_buffer.buffer[thread_id]
-            north_thread_buffer = self.north_buffer.buffer[thread_id]
-
-            thread_number = int(thread_id[1:])
-
-            # Try to pull input from west buffer
-            try:
-                west_in = west_thread_buffer.pop(0)
-            except IndexError:
+            # Try to read input from west buffer
+            if self.west_buffer.is_empty(thread_number):
 
                 if log:
-                    PELogger.debug("<{},{}> - Thread: {}, West Buffer is Empty.".format(self.iindex, self.jindex, thread_number))
+                    log.record(WEST_EMPTY, self.iindex, self.jindex, thread_number)
                 continue
 
-            # Try to pull input form north buffer
-            try:
-                north_in = north_thread_buffer.pop(0)
-            except IndexError:
-
-                if log:
-                    PELogger.debug("<{},{}> - Thread: {}, North Buffer is Empty.".format(self.iindex, self.jindex, thread_number))
-                west_thread_buffer.insert(0, west_in)
+            # Try to read input form north buffer
+            if self.north_buffer.is_empty(thread_number):
 
                 if log:
-                    PELogger.debug("<{},{}> - Thread: {}, West Input Pushed Back to West Buffer".format(self.iindex, self.jindex, thread_number))
+                    log.record(NORTH_EMPTY, self.iindex, self.jindex, thread_number)
                 continue
 
+            west_in  = self.west_buffer.peek(thread_number)
+            north_in = self.north_buffer.peek(thread_number)
+
             if log:
-                PELogger.info("<{},{}> - Thread: {}, West Literal: {}, North Literal: {}".format(self.iindex, self.jindex, thread_number, west_in, north_in))
+                log.record(LITERALS, self.iindex, self.jindex, thread_number, west_in, north_in)
 
             # If MAC_on=True, that mean that the MAC has already worked this clock cycle.
-            # If that's the case, if inputs aren't zeros/bubbles, we need to push them beck to input buffers.
+            # If that's the case, if inputs aren't zeros/bubbles, we leave them in input buffers.
             if west_in != 0 and north_in != 0 and west_in is not None and north_in is not None and MAC_on:
 
-                west_thread_buffer.insert(0, west_in)
-
-                if log:
-                    PELogger.debug("<{},{}> - Thread: {}, {} Pushed Back to West Buffer".format(self.iindex, self.jindex, thread_number, west_in))
-
-                north_thread_buffer.insert(0, north_in)
-
                 if log:
-                    PELogger.debug("<{},{}> - Thread: {}, {} Input Pushed Back to North Buffer".format(self.iindex, self.jindex, thread_number, north_in))
+                    log.record(LEFT, self.iindex, self.jindex, thread_number, west_in, north_in)
 
                 continue
 
             # If both aren't zero, aren't None (=bubble), and MAC hasn't worked yet this clock cycle, Calculate.
-            # Addition for PElimited only: calculate only if there are enough space in the output buffers for the literals. Otherwise, push back to input buffers.
+            # Addition for PElimited only: calculate only if there are enough space in the output buffers for the literals. Otherwise, leave them in input buffers.
             # Turn MAC_on to True to indicate that MAC is working this clock cycle.
             if west_in != 0 and north_in != 0 and west_in is not None and north_in is not None and not MAC_on:
 
                 # If One of the Output Channels are full, we can't perform computation for this Channel.
-                # Those We push back west_in & north_in.
-                if self.east_buffer.is_full(threadID=int(thread_id[1:]), log=log) or self.south_buffer.is_full(threadID=int(thread_id[1:]), log=log):
-
-                    west_thread_buffer.insert(0, west_in)
+                # Those We leave west_in & north_in in input buffers.
+                if self.east_buffer.is_full(threadID=thread_number, log=log) or self.south_buffer.is_full(threadID=thread_number, log=log):
 
                     if log:
-                        PELogger.debug("<{},{}> - Thread: {}, {} Pushed Back to West Buffer".format(self.iindex, self.jindex, thread_number, west_in))
-
-                    north_thread_buffer.insert(0, north_in)
-
-                    if log:
-                        PELogger.debug("<{},{}> - Thread: {}, {} Pushed Back to North Buffer".format(self.iindex, self.jindex, thread_number, north_in))
+                        log.record(LEFT, self.iindex, self.jindex, thread_number, west_in, north_in)
 
                     continue
 
                 else:
 
+                    self.west_buffer.commit(thread_number)
+                    self.north_buffer.commit(thread_number)
+
                     self.onThread += 1
                     if self.onThread > self.thread_count - 1:
                         self.onThread = 0
@@ -289,42 +297,37 @@ class PElimited(PE):
                     self.result[thread_number] += west_in * north_in
 
                     if log:
-                        PELogger.debug("<{},{}> - Thread: {}, "
-                                       "MAC On, Intermediate result: {}".format(self.iindex, self.jindex, thread_number, self.result[thread_number]))
+                        log.record(MAC, self.iindex, self.jindex, thread_number, self.result[thread_number])
                     # Push west input to east buffer
                     self.east_buffer.push_to(thread_number, west_in, log=log)
 
                     # Push north input to south buffer
                     self.south_buffer.push_to(thread_number, north_in, log=log)
 
-                    # Add '1' to mac_utility to indicate that the MAC worked on this cycle.
-                    self.mac_utility.append(1)
+                    # Mark MAC row to indicate that the MAC worked on this cycle.
+                    self.telemetry.mac_cycle[self.iindex, self.jindex] = 1
 
                     continue
 
             # If one of them or both are zero, result already known.
-            # PElimited Addition: check if there is enough space in next buffers. if not, push inputs back.
+            # PElimited Addition: check if there is enough space in next buffers. if not, leave inputs in input buffers.
             # Otherwise, Just push west input to east buffer, north input to south buffer.
             elif west_in == 0 or north_in == 0:
 
                 # If One of the Output Channels are full, we can't push even zeros to this Channel.
-                # Those We push back west_in & north_in.
-                if self.east_buffer.is_full(threadID=int(thread_id[1:]), log=log) or self.south_buffer.is_full(threadID=int(thread_id[1:]), log=log):
-
-                    west_thread_buffer.insert(0, west_in)
-
-                    if log:
-                        PELogger.debug("<{},{}> - Thread: {}, {} Pushed Back to West Buffer".format(self.iindex, self.jindex,  thread_number, west_in))
-
-                    north_thread_buffer.insert(0, north_in)
+                # Those We leave west_in & north_in in input buffers.
+                if self.east_buffer.is_full(threadID=thread_number, log=log) or self.south_buffer.is_full(threadID=thread_number, log=log):
 
                     if log:
-                        PELogger.debug("<{},{}> - Thread: {}, {} Pushed Back to North Buffer".format(self.iindex, self.jindex, thread_number, north_in))
+                        log.record(LEFT, self.iindex, self.jindex, thread_number, west_in, north_in)
 
                     continue
 
                 else:
 
+                    self.west_buffer.commit(thread_number)
+                    self.north_buffer.commit(thread_number)
+
                     # Push west input to east buffer
                     self.east_buffer.push_to(thread_number, west_in, log=log)
 
@@ -337,6 +340,9 @@ class PElimited(PE):
             # Just push west input to east buffer, north input to south buffer.
             elif west_in is None and north_in is None:
 
+                self.west_buffer.commit(thread_number)
+                self.north_buffer.commit(thread_number)
+
                 # Push west input to east buffer
                 self.east_buffer.push_to(thread_number, west_in, log=log)
 
@@ -345,11 +351,138 @@ class PElimited(PE):
 
                 continue
 
-        # If after we passed through all Threads buffers, and yet MAC_on didn't change,
-        # that's mean that all inputs were zeros or bubbles, or all output buffers are full.
-        # In that case, MAC is not working in this clock cycle, and we append '0' to utility logger.
-        if not MAC_on:
-            self.mac_utility.append(0)
+            # A bubble against a non-zero literal is consumed without being passed on.
+            self.west_buffer.commit(thread_number)
+            self.north_buffer.commit(thread_number)
+
+        self.update_pending()
+
+        if log:
+            log.record(PE_DONE, self.iindex, self.jindex, -1, MAC_on)
+
+
+class StationaryPE(PE):
+    """
+    PE of the weight-stationary and input-stationary dataflows (see Utilities.dataflow_streams).
+    Each thread holds one operand in a stationary register, and multiplies it by the operand streaming past:
+    weight-stationary - weights stay, inputs stream west to east and partial sums north to south.
+    input-stationary  - inputs stay, weights stream north to south and partial sums west to east.
+    A MAC adds its product to the partial sum passing by, so nothing accumulates in the PE.
+    Zero-skipping and multithreading work as in PE.tock: if the streamed operand or the stationary one is zero,
+    the couple is passed on as it is, without the MAC, and one thread per cycle gets the MAC.
+    With limited buffers, PElimited rules apply: couples stay in the input buffers while an output buffer is full.
+    """
+
+    def __init__(self, i, j, thread_count, matrix_size, telemetry, log, stationary, dataflow, limited, arbiter=None):
+        """
+        :param stationary: per thread operand held by the PE.
+        :param dataflow: 'weight' or 'input'.
+        :param limited: True for limited buffers.
+        """
+        super().__init__(i=i, j=j, thread_count=thread_count, matrix_size=matrix_size, telemetry=telemetry, log=log, arbiter=arbiter)
+
+        self.stationary = stationary
+
+        self.weight_stationary = dataflow == 'weight'
+        self.limited           = limited
+
+        if log:
+            PELogger.info("PE Changed To StationaryPE ({}-stationary)".format(dataflow))
+
+    def is_mac_couple(self, thread_number, west_in, north_in):
+        """
+        :return: True if the couple of thread_number needs the MAC - a non-zero streamed operand against a non-zero stationary one,
+                 with a partial sum to add the product to.
+        """
+        operand, partial_sum = (west_in, north_in) if self.weight_stationary else (north_in, west_in)
+        return operand is not None and partial_sum is not None and operand != 0 and self.stationary[thread_number] != 0
+
+    def tock(self, log):
+        """
+        Same round as PE.tock / PElimited.tock: one MAC couple gets the MAC, the others stay in the input buffers,
+        zero product couples and bubble couples are passed on. MAC'ed partial sums are passed on with the product added.
+        """
+        if self.arbiter is None:
+            thread_reorder = list(range(self.onThread, self.thread_count)) + list(range(self.onThread))
+        else:
+            thread_reorder = self.arbiter.order(self)
+
+        MAC_on = False
+
+        for thread_number in thread_reorder:
+
+            # Try to read input from west buffer
+            if self.west_buffer.is_empty(thread_number):
+
+                if log:
+                    log.record(WEST_EMPTY, self.iindex, self.jindex, thread_number)
+                continue
+
+            # Try to read input from north buffer
+            if self.north_buffer.is_empty(thread_number):
+
+                if log:
+                    log.record(NORTH_EMPTY, self.iindex, self.jindex, thread_number)
+                continue
+
+            west_in  = self.west_buffer.peek(thread_number)
+            north_in = self.north_buffer.peek(thread_number)
+
+            if log:
+                log.record(LITERALS, self.iindex, self.jindex, thread_number, west_in, north_in)
+
+            is_mac = self.is_mac_couple(thread_number, west_in, north_in)
+
+            # The MAC has already worked this clock cycle - leave the couple in the input buffers.
+            if is_mac and MAC_on:
+
+                if log:
+                    log.record(LEFT, self.iindex, self.jindex, thread_number, west_in, north_in)
+                continue
+
+            # Literal couples go on only if both output buffers have room. Bubbles are pushed regardless, as in PElimited.
+            if self.limited and west_in is not None and north_in is not None and \
+                    (self.east_buffer.is_full(threadID=thread_number, log=log) or self.south_buffer.is_full(threadID=thread_number, log=log)):
+
+                if log:
+                    log.record(LEFT, self.iindex, self.jindex, thread_number, west_in, north_in)
+                continue
+
+            # Inputs are consumed from here on.
+            self.west_buffer.commit(thread_number)
+            self.north_buffer.commit(thread_number)
+
+            # A bubble against a literal is consumed without being passed on.
+            if (west_in is None) != (north_in is None):
+                continue
+
+            if is_mac:
+
+                self.onThread += 1
+                if self.onThread > self.thread_count - 1:
+                    self.onThread = 0
+
+                MAC_on = True
+
+                # Add the product to the partial sum passing by.
+                if self.weight_stationary:
+                    north_in = north_in + west_in * self.stationary[thread_number]
+                    partial_sum = north_in
+                else:
+                    west_in = west_in + north_in * self.stationary[thread_number]
+                    partial_sum = west_in
+
+                if log:
+                    log.record(MAC, self.iindex, self.jindex, thread_number, partial_sum)
+
+                # Mark MAC row to indicate that the MAC worked on this cycle.
+                self.telemetry.mac_cycle[self.iindex, self.jindex] = 1
+
+            # Push west input to east buffer, north input to south buffer.
+            self.east_buffer.push_to(thread_number, west_in, log=log)
+            self.south_buffer.push_to(thread_number, north_in, log=log)
+
+        self.update_pending()
 
         if log:
-            PELogger.info("<{},{}> - All Threads, Intermediate Result: {}".format(self.iindex, self.jindex, self.result))
+            log.record(PE_DONE, self.iindex, self.jindex, -1, MAC_on)
@@ -0,0 +1,547 @@
+import os
+import time
+import logging
+import multiprocessing
+import numpy as np
+from threading import BrokenBarrierError
+from multiprocessing import shared_memory
+from PE        import PE, PElimited
+from BUFFER    import BUFFER, BUFFERlimited, FIFO, OUTPUT
+from Utilities import pack_FIFOs, unpack_BUFFERs, array_shape
+from Arbitration import Arbiter
+
+ParallelEngineLogger = logging.getLogger('ParallelEngineLogger')
+
+# Fewest PE rows per band by default - thinner bands spend more time synchronizing than simulating.
+MIN_BAND_ROWS = 8
+
+# Control words shared with the workers.
+ROUND, STOP = 0, 1
+
+
+class SharedArrays:
+    """
+    Named NumPy arrays carved out of a single multiprocessing.shared_memory block.
+    The parent creates the block from a layout - a list of (name, shape, dtype) - and workers attach to it:
+    forked workers inherit it as is, spawned ones unpickle it, which attaches by block name.
+    """
+
+    def __init__(self, layout, name=None):
+
+        offsets, size = [], 0
+        for _, shape, dtype in layout:
+            size += -size % 8
+            offsets.append(size)
+            size += int(np.prod(shape)) * np.dtype(dtype).itemsize
+
+        self.layout = layout
+        self.memory = shared_memory.SharedMemory(name=name, create=name is None, size=max(size, 1))
+
+        self.arrays = {array: np.ndarray(shape, dtype=dtype, buffer=self.memory.buf, offset=offset)
+                       for (array, shape, dtype), offset in zip(layout, offsets)}
+        if name is None:
+            for array in self.arrays.values():
+                array.fill(0)
+
+    def __reduce__(self):
+        return SharedArrays, (self.layout, self.memory.name)
+
+    def __getitem__(self, name):
+        return self.arrays[name]
+
+    def close(self, unlink=False):
+        """
+        Detach from the block, and remove it if <unlink>. Views handed out before must be dropped by then.
+        """
+        self.arrays = None
+        self.memory.close()
+        if unlink:
+            self.memory.unlink()
+
+
+class BoundarySender:
+    """
+    Producer end of vertical buffer <i,j> between two bands - the south buffer of PE <i,j> on the last row of the upper band.
+    Items are written to a per thread ring in shared memory, and published at the end of each clock cycle
+    (see Band.tock). The lower band imports them into its own copy of the buffer, the receiving end, at the start of that cycle.
+    For limited buffers, fullness is taken from the items the receiving end consumed by the end of the previous clock cycle.
+    """
+    __slots__ = ('values', 'bubbles', 'capacity', 'pushed', 'popped', 'depth_limit', 'iindex', 'jindex')
+
+    def __init__(self, values, bubbles, depth_limit, iindex, jindex):
+        """
+        :param values:  (threads, capacity) shared ring of the buffer items.
+        :param bubbles: (threads, capacity) shared ring, True where the item is a bubble.
+        """
+        self.values   = values
+        self.bubbles  = bubbles
+        self.capacity = values.shape[1]
+
+        # Items pushed so far, per thread - the buffer starts with a single bubble, as any BUFFER.
+        self.pushed = [1] * values.shape[0]
+        self.popped = [0] * values.shape[0]
+        self.bubbles[:, 0] = True
+
+        self.depth_limit = depth_limit
+
+        self.iindex = iindex
+        self.jindex = jindex
+
+    def push_to(self, threadID, value, log):
+
+        pushed = self.pushed[threadID]
+        if self.depth_limit is not None and pushed - self.popped[threadID] >= self.depth_limit:
+            return False
+
+        slot = pushed % self.capacity
+        if value is None:
+            self.bubbles[threadID, slot] = True
+        else:
+            self.values[threadID, slot]  = value
+            self.bubbles[threadID, slot] = False
+        self.pushed[threadID] = pushed + 1
+        return True
+
+    def is_full(self, threadID, log):
+
+        return self.pushed[threadID] - self.popped[threadID] >= self.depth_limit
+
+    def __repr__(self):
+        return "<{},{}>".format(self.iindex, self.jindex)
+
+
+class Band:
+    """
+    PE rows [first_row, last_row) of a SystolicArray, built from the object engine classes inside a worker process.
+    West FIFO's, PE's, horizontal buffers and east OUTPUT's of those rows are local, as are the vertical buffers in between.
+    The vertical buffers above the first row are local copies fed from shared memory (see BoundarySender),
+    and the ones below the last row are BoundarySender's - unless the band is at the array edge.
+    Each clock cycle, MAC activity, recorded buffers occupancy and drained OUTPUT threads are written to the shared
+    per cycle window, where the parent engine picks them up.
+    """
+
+    def __init__(self, index, west_matrices, north_matrices, array_size, buffer_depth, first_row, last_row, band_count, shared, window, records_occupancy,
+                 arbitration='round_robin'):
+        """
+        :param west_matrices:  (threads, last_row-first_row, input_length) west inputs of the band rows.
+        :param north_matrices: (threads, input_length, columns) north inputs - used by the first band only.
+        :param array_size: PE grid, an int or a (rows, columns) pair - see Utilities.array_shape.
+        :param arbitration: thread arbitration policy of the band PE's, see Arbitration.
+        """
+        thread_count, _, input_length = west_matrices.shape
+
+        self.index        = index
+        self.array_size   = array_size
+        self.thread_count = thread_count
+        self.first_row    = first_row
+        self.last_row     = last_row
+        self.shared       = shared
+        self.window       = window
+
+        # The band holds rows [first_row, last_row) of the array_rows x columns PE grid.
+        array_rows, columns = array_shape(array_size)
+
+        self.records_occupancy = records_occupancy
+
+        self.west_zero_rows     = ~west_matrices.any(axis=2)
+        self.north_zero_columns = ~north_matrices.any(axis=1)
+        self.drained = 0
+
+        limited = buffer_depth >= 0
+        if limited:
+            def new_buffer(i, j):
+                return BUFFERlimited(thread_count=thread_count, depth=buffer_depth, iindex=i, jindex=j, log=False)
+        else:
+            def new_buffer(i, j):
+                return BUFFER(thread_count=thread_count, iindex=i, jindex=j, log=False)
+
+        rows = range(first_row, last_row)
+
+        self.west_inputs = [FIFO(threads=[west_matrices[t, i - first_row, :] for t in range(thread_count)],
+                                 i=i, j=-1, thread_count=thread_count, log=False, skew=i) for i in rows]
+
+        # Vertical buffers above the band: north FIFO's on the array edge, local receiving ends otherwise.
+        if index == 0:
+            self.north_inputs = pack_FIFOs(north_matrices, axis=1, thread_count=thread_count, log=False)
+            self.receivers    = []
+        else:
+            self.north_inputs = [new_buffer(first_row - 1, j) for j in range(columns)]
+            self.receivers    = self.north_inputs
+            self.upper        = {name: shared['{}/{}'.format(name, index)] for name in ('values', 'bubbles', 'published', 'popped')}
+            # Items imported so far per receiving end and thread, the initial bubble included.
+            self.imported     = np.ones((columns, thread_count), dtype=np.int64)
+
+        pe_class = PElimited if limited else PE
+        arbiter  = None if arbitration == 'round_robin' else Arbiter(arbitration)
+        # PE's mark their MAC on mac_cycle[i, j] of their telemetry - the band stands in for it, pointing at the shared window.
+        self.mac_cycle = None
+        self.pe_array  = [[pe_class(i=i, j=j, thread_count=thread_count, matrix_size=array_size, telemetry=self, log=False, arbiter=arbiter)
+                           for j in range(columns)] for i in rows]
+
+        self.horizontal_buffer_array = [[new_buffer(i, j) for j in range(columns - 1)] +
+                                        [OUTPUT(thread_count=thread_count, iindex=i, jindex=columns - 1, log=False,
+                                                drain_length=input_length, on_drained=self._east_drained)]
+                                        for i in rows]
+
+        self.vertical_buffer_array = [[new_buffer(i, j) for j in range(columns)] for i in range(first_row, last_row - 1)]
+        if index == band_count - 1:
+            self.vertical_buffer_array.append([OUTPUT(thread_count=thread_count, iindex=last_row - 1, jindex=j, log=False,
+                                                      drain_length=input_length, on_drained=self._south_drained)
+                                               for j in range(columns)])
+            self.senders = []
+        else:
+            lower = index + 1
+            self.senders = [BoundarySender(values=shared['values/{}'.format(lower)][j],
+                                           bubbles=shared['bubbles/{}'.format(lower)][j],
+                                           depth_limit=buffer_depth if limited else None,
+                                           iindex=last_row - 1, jindex=j) for j in range(columns)]
+            self.vertical_buffer_array.append(self.senders)
+            self.lower = {name: shared['{}/{}'.format(name, lower)] for name in ('published', 'popped')}
+
+        self.east_outputs  = [row[-1] for row in self.horizontal_buffer_array]
+        self.south_outputs = self.vertical_buffer_array[-1] if index == band_count - 1 else []
+
+        # Recorded buffers the band holds, and their index on the Telemetry recorded buffers axis.
+        # The vertical buffers between two bands are recorded by the lower one, which holds their contents.
+        self.recorded_buffers = []
+        record_ids = []
+        for i in range(first_row - 1, last_row):
+            for j in range(columns - 1):
+                if i < 0 or i >= array_rows - 1:
+                    continue
+                if i >= first_row:
+                    self.recorded_buffers.append(self.horizontal_buffer_array[i - first_row][j])
+                    record_ids.append(2 * (i * (columns - 1) + j))
+                if i < last_row - 1:
+                    self.recorded_buffers.append(self.receivers[j] if i < first_row else self.vertical_buffer_array[i - first_row][j])
+                    record_ids.append(2 * (i * (columns - 1) + j) + 1)
+        self.record_ids = np.array(record_ids, dtype=np.int64)
+
+        for i in rows:
+            for j in range(columns):
+                self.pe_array[i - first_row][j].connect(
+                    west_buffer=self.west_inputs[i - first_row] if j == 0 else self.horizontal_buffer_array[i - first_row][j - 1],
+                    north_buffer=self.north_inputs[j] if i == first_row else self.vertical_buffer_array[i - first_row - 1][j],
+                    east_buffer=self.horizontal_buffer_array[i - first_row][j],
+                    south_buffer=self.vertical_buffer_array[i - first_row][j], log=False)
+
+    def _east_drained(self, buffer, threadID):
+
+        if not self.west_zero_rows[threadID, buffer.iindex - self.first_row]:
+            self.drained += 1
+
+    def _south_drained(self, buffer, threadID):
+
+        if not self.north_zero_columns[threadID, buffer.jindex]:
+            self.drained += 1
+
+    def tock(self, cycle):
+        """
+        Clock cycle <cycle> (counted from 0) of the band rows - SystolicArray.tick of the object engine, restricted to the band.
+        The band above must have finished <cycle>, and for limited buffers, the band below <cycle>-1.
+        """
+        slot = cycle % self.window
+
+        # Items the band above pushed up to the end of this cycle come in first - in row-major order,
+        # its rows tock before this band's on every cycle.
+        if self.receivers:
+            published = self.upper['published'][slot]
+            values, bubbles = self.upper['values'], self.upper['bubbles']
+            capacity = values.shape[2]
+            for j, t in zip(*np.nonzero(published > self.imported)):
+                receiver = self.receivers[j]
+                for pushed in range(self.imported[j, t], published[j, t]):
+                    receiver.push_to(t, None if bubbles[j, t, pushed % capacity] else values[j, t, pushed % capacity], log=False)
+            self.imported[:] = published
+
+        if self.senders:
+            popped = self.lower['popped'].tolist()
+            for sender, sender_popped in zip(self.senders, popped):
+                sender.popped = sender_popped
+
+        mac = self.shared['mac'][slot]
+        mac[self.first_row:self.last_row] = 0
+        self.mac_cycle = mac
+
+        self.drained = 0
+        for pe_row in self.pe_array:
+            for pe in pe_row:
+                if pe.pending:
+                    pe.tock(log=False)
+
+        if self.recorded_buffers and self.records_occupancy:
+            self.shared['occupancy'][slot, self.record_ids] = [buffer.occupancy for buffer in self.recorded_buffers]
+        self.shared['drained'][slot, self.index] = self.drained
+
+        if self.receivers:
+            self.upper['popped'][:] = self.imported - [receiver.size for receiver in self.receivers]
+        if self.senders:
+            self.lower['published'][slot] = [sender.pushed for sender in self.senders]
+
+    def dump(self):
+        """
+        Write accumulators and OUTPUT contents of the band rows to shared memory.
+        """
+        rows = slice(self.first_row, self.last_row)
+        for i, pe_row in enumerate(self.pe_array):
+            for j, pe in enumerate(pe_row):
+                self.shared['result'][:, self.first_row + i, j] = pe.result
+
+        self.shared['east'][:, rows] = unpack_BUFFERs(buffer_list=self.east_outputs, axis=1, matrix_shape=self.shared['east'].shape)[:, rows]
+        if self.south_outputs:
+            self.shared['south'][:] = unpack_BUFFERs(buffer_list=self.south_outputs, axis=0, matrix_shape=self.shared['south'].shape)
+
+
+def _band_worker(index, west_matrices, north_matrices, array_size, buffer_depth, first_row, last_row, band_count,
+                 shared, window, records_occupancy, arbitration, schedule, control, barrier):
+    """
+    Worker process of a band: run its clock cycles round after round, as the parent engine releases them (see ParallelEngine).
+    """
+    try:
+        band = Band(index=index, west_matrices=west_matrices, north_matrices=north_matrices, array_size=array_size,
+                    buffer_depth=buffer_depth, first_row=first_row, last_row=last_row, band_count=band_count,
+                    shared=shared, window=window, records_occupancy=records_occupancy, arbitration=arbitration)
+        stride, sync_cycles = schedule
+
+        while 1:
+            barrier.wait()
+            if control[STOP]:
+                break
+
+            batch, phase = divmod(control[ROUND] - index, stride)
+            if batch >= 0 and not phase:
+                for cycle in range(batch * sync_cycles, (batch + 1) * sync_cycles):
+                    band.tock(cycle)
+
+            barrier.wait()
+
+        band.dump()
+        barrier.wait()
+    except BaseException:
+        barrier.abort()
+        raise
+
+
+class ParallelEngine:
+    """
+    SystolicArray clock split over worker processes, for arrays too large for a single core.
+    The PE grid is cut into row bands, each one simulated by the object engine classes in a worker process (see Band).
+    Bands only share the vertical buffers between them, which live in shared memory:
+    cycle c of a band needs cycle c of the band above (its pushes), and for limited buffers cycle c-1 of the band below
+    (its pops, for fullness). Workers run rounds in lockstep, between two barriers:
+    - unlimited buffers: band k runs cycles [b*sync_cycles, (b+1)*sync_cycles) on round b+k - a pipeline, all bands busy.
+    - limited buffers:   band k runs cycle c on round 2c+k - a wavefront, even and odd bands take turns.
+    The parent replays finished cycles into the Telemetry store and completion counter one clock cycle at a time,
+    so clock, results, utilization and telemetry are those of the object engine.
+    Workers may run past the last cycle: once every OUTPUT drained, PE accumulators and OUTPUT contents don't change anymore.
+    """
+
+    def __init__(self, west_matrices, north_matrices, array_size, buffer_depth, telemetry, log, workers=None, sync_cycles=16, profiler=None,
+                 arbitration='round_robin'):
+        """
+        Construct ParallelEngine instance, and start its workers.
+        :param west_matrices:  sequence of a single (threads, rows, input_length) west tensor - runs aren't batched.
+        :param north_matrices: sequence of a single (threads, input_length, columns) north tensor.
+        :param array_size: PE grid, an int or a (rows, columns) pair - see Utilities.array_shape. Bands split its rows.
+        :param telemetry: Telemetry store MAC activity and buffers occupancy are replayed into.
+        :param workers: number of bands (worker processes). None for as many as CPU's, with at least MIN_BAND_ROWS rows each.
+        :param sync_cycles: clock cycles per round with unlimited buffers. Limited buffers synchronize every cycle.
+        :param profiler: Profiler that tick phases are timed into, None to time nothing.
+        :param arbitration: thread arbitration policy of the PE's, see Arbitration.
+        """
+        rows, columns = array_shape(array_size)
+        if workers is None:
+            workers = min(os.cpu_count() or 1, max(rows // MIN_BAND_ROWS, 1))
+        if not 1 <= workers <= rows:
+            ParallelEngineLogger.critical("Workers number most be between 1 and the array rows, not {}".format(workers))
+            raise ValueError("Workers number most be between 1 and the array rows, not {}".format(workers))
+
+        self.array_size     = array_size
+        self.rows           = rows
+        self.columns        = columns
+        self.buffer_depth   = buffer_depth
+        self.limited_buffer = buffer_depth >= 0
+        self.workers        = workers
+        self.telemetry      = telemetry
+        self.profiler       = profiler
+        self.arbitration    = arbitration
+
+        # Neighbour bands of limited buffers depend on each other - they can't run at the same time, nor ahead of a cycle.
+        wavefront        = self.limited_buffer and workers > 1
+        self.stride      = 2 if wavefront else 1
+        self.sync_cycles = 1 if wavefront else sync_cycles
+
+        # Per cycle window: cycles from the one the last band runs, to the one the first band runs, plus the one being replayed.
+        self.window = (workers + 1) * self.sync_cycles
+
+        self.bands = np.array_split(np.arange(rows), workers)
+
+        self.processes = None
+        self.reset(west_matrices, north_matrices)
+
+    def reset(self, west_matrices, north_matrices):
+        """
+        Start over on new inputs (same sequence form as in the constructor), with new workers.
+        """
+        self.close()
+
+        west, north = west_matrices[0], north_matrices[0]
+        self.west_matrices  = west
+        self.north_matrices = north
+
+        thread_count, _, input_length = west.shape
+        rows, columns = self.rows, self.columns
+
+        # Completion tracking, same as SystolicArray.pending_outputs.
+        self.pending_outputs = int(np.count_nonzero(west.any(axis=2)) + np.count_nonzero(north.any(axis=1)))
+
+        self.cycles    = 0   # clock cycles replayed so far
+        self.completed = 0   # clock cycles every band finished
+        self.round     = 0
+
+        self.result_matrices = None
+        self.outputs         = None
+
+        # A vertical buffer never holds more than its depth. Unlimited, at most its column input, skew and bubbles go through it.
+        capacity = self.buffer_depth if self.limited_buffer else input_length + rows + columns + 2
+
+        layout = [('mac',       (self.window, rows, columns),                              np.uint8),
+                  ('occupancy', (self.window, self.telemetry.record_count, thread_count), self.telemetry.occupancy.dtype),
+                  ('drained',   (self.window, self.workers),                               np.int64),
+                  ('result',    (thread_count, rows, columns),                             np.result_type(west, north)),
+                  ('east',      (thread_count, rows, input_length),                        np.float64),
+                  ('south',     (thread_count, input_length, columns),                     np.float64)]
+        for band in range(1, self.workers):
+            layout += [('values/{}'.format(band),    (columns, thread_count, capacity),    north.dtype),
+                       ('bubbles/{}'.format(band),   (columns, thread_count, capacity),    np.bool_),
+                       ('published/{}'.format(band), (self.window, columns, thread_count), np.int64),
+                       ('popped/{}'.format(band),    (columns, thread_count),              np.int64)]
+        self.shared = SharedArrays(layout)
+
+        context      = multiprocessing.get_context()
+        self.control = context.Array('q', 2, lock=False)
+        self.barrier = context.Barrier(self.workers + 1)
+
+        self.processes = []
+        for index, rows in enumerate(self.bands):
+            first_row, last_row = int(rows[0]), int(rows[-1]) + 1
+            process = context.Process(target=_band_worker,
+                                      name='ParallelEngineBand{}'.format(index),
+                                      args=(index, west[:, first_row:last_row, :], north, self.array_size, self.buffer_depth,
+                                            first_row, last_row, self.workers, self.shared, self.window,
+                                            self.telemetry.records_occupancy, self.arbitration, (self.stride, self.sync_cycles),
+                                            self.control, self.barrier),
+                                      daemon=True)
+            process.start()
+            self.processes.append(process)
+
+        ParallelEngineLogger.info("{} Bands Of Rows {} Started".format(self.workers, [(int(rows[0]), int(rows[-1])) for rows in self.bands]))
+
+    def _wait(self):
+
+        try:
+            self.barrier.wait()
+        except BrokenBarrierError:
+            self._terminate()
+            ParallelEngineLogger.critical("A Parallel Engine Worker Failed")
+            raise RuntimeError("A Parallel Engine Worker Failed")
+
+    def _round(self):
+        """
+        Release a round to the workers, and wait until it is over.
+        """
+        self.control[ROUND] = self.round
+        self._wait()
+        self._wait()
+
+        batch, phase = divmod(self.round - (self.workers - 1), self.stride)
+        if batch >= 0 and not phase:
+            self.completed = (batch + 1) * self.sync_cycles
+        self.round += 1
+
+    def tick(self):
+        """
+        Next clock cycle: run rounds until every band finished it, then replay its telemetry and drained OUTPUT's.
+        """
+        profiler = self.profiler
+        if profiler is not None:
+            mark = time.perf_counter()
+
+        while self.completed <= self.cycles:
+            self._round()
+            if profiler is not None:
+                profiler.count('rounds')
+        if profiler is not None:
+            mark = profiler.lap('tick/rounds', mark)
+
+        slot = self.cycles % self.window
+        row  = self.telemetry.open_cycle()
+        self.telemetry.mac[row, 0] = self.shared['mac'][slot]
+        if self.telemetry.records_occupancy:
+            self.telemetry.occupancy[row, 0] = self.shared['occupancy'][slot]
+        self.telemetry.close_cycle()
+
+        self.pending_outputs -= int(self.shared['drained'][slot].sum())
+        self.cycles += 1
+
+        if profiler is not None:
+            profiler.lap('tick/close_cycle', mark)
+
+    def is_done(self):
+        """
+        :return: True if all OUTPUT threads drained their whole input, as of the last replayed cycle.
+        """
+        return self.pending_outputs == 0
+
+    def _collect(self):
+        """
+        Stop the workers once they dumped accumulators and OUTPUT contents, and keep copies of those.
+        """
+        if self.processes is None or self.result_matrices is not None:
+            return
+
+        self.control[STOP] = 1
+        self._wait()
+        self._wait()
+
+        self.result_matrices = self.shared['result'].copy()
+        self.outputs         = (self.shared['east'].copy(), self.shared['south'].copy())
+        self.close()
+
+    def results(self, element=0):
+        """
+        :return: (threads, rows, columns) accumulators. Stops the workers - call it once done.
+        """
+        self._collect()
+        return self.result_matrices
+
+    def unpack_outputs(self, element=0):
+        """
+        Same as unpack_BUFFERs on the OUTPUT buffers. Stops the workers - call it once done.
+        :return: east and south output tensors
+        """
+        self._collect()
+        return self.outputs
+
+    def close(self):
+        """
+        Stop the workers and release shared memory. Results already collected stay available.
+        """
+        if self.processes is None:
+            return
+
+        if self.result_matrices is None:
+            self._terminate()
+        else:
+            for process in self.processes:
+                process.join()
+            self.processes = None
+            self.shared.close(unlink=True)
+
+    def _terminate(self):
+
+        for process in self.processes:
+            process.terminate()
+            process.join()
+        self.processes = None
+        self.shared.close(unlink=True)
@@ -0,0 +1,91 @@
+import time
+import marshal
+import logging
+from collections import defaultdict
+
+ProfilerLogger = logging.getLogger('ProfilerLogger')
+
+
+class Profiler:
+    """
+    Wall time and call count per run phase, plus event counters - filled in by SystolicArray and VectorizedEngine
+    when profiling is on (SystolicArray(profile=True)).
+    Phases are '/' separated paths, a child phase runs within its parent: 'tick', 'tick/tock', 'tick/steps/peek'...
+    Code marks phase ends with lap, so a profiled run pays a perf_counter call per phase, and an unprofiled one
+    a single 'is None' check.
+    Export to pstats (dump_stats) or folded stacks for flame graph tools (dump_folded).
+    """
+
+    def __init__(self):
+
+        self.seconds  = defaultdict(float)
+        self.calls    = defaultdict(int)
+        self.counters = defaultdict(int)
+
+    def lap(self, phase, since):
+        """
+        Add the time from <since> (a time.perf_counter() value) to now to <phase>.
+        :return: now - the start of the next phase.
+        """
+        now = time.perf_counter()
+        self.seconds[phase] += now - since
+        self.calls[phase]   += 1
+        return now
+
+    def count(self, counter, events=1):
+
+        self.counters[counter] += events
+
+    def self_seconds(self, phase):
+        """
+        Time of <phase> not spent in any of its child phases.
+        """
+        children = sum(seconds for child, seconds in self.seconds.items() if child.rpartition('/')[0] == phase)
+        return max(self.seconds[phase] - children, 0.0)
+
+    def report(self):
+        """
+        :return: dictionary - 'phases': phase to seconds, self_seconds and calls, 'counters': counter to events.
+        """
+        return {'phases':   {phase: {'seconds': self.seconds[phase], 'self_seconds': self.self_seconds(phase), 'calls': self.calls[phase]}
+                             for phase in sorted(self.seconds)},
+                'counters': dict(self.counters)}
+
+    def log_report(self):
+
+        for phase in sorted(self.seconds):
+            ProfilerLogger.info("{:32} {:10.4f}s (self {:10.4f}s) {:10} Calls".format(phase, self.seconds[phase], self.self_seconds(phase), self.calls[phase]))
+        for counter in sorted(self.counters):
+            ProfilerLogger.info("{:32} {:10}".format(counter, self.counters[counter]))
+
+    def dump_stats(self, path):
+        """
+        Write phases as a pstats file: one pseudo function per phase, called by its parent phase.
+        Read it with pstats.Stats(path), snakeviz, gprof2dot...
+        """
+        stats = dict()
+        for phase in self.seconds:
+            calls  = self.calls[phase]
+            parent = phase.rpartition('/')[0]
+            callers = {_function(parent): (calls, calls, self.self_seconds(phase), self.seconds[phase])} if parent in self.seconds else dict()
+            stats[_function(phase)] = (calls, calls, self.self_seconds(phase), self.seconds[phase], callers)
+
+        with open(path, 'wb') as f:
+            marshal.dump(stats, f)
+
+    def dump_folded(self, path):
+        """
+        Write phases as folded stacks ('tick;steps;peek <microseconds>' lines, self time) - the input format of
+        flamegraph.pl, speedscope and inferno.
+        """
+        with open(path, 'w') as f:
+            for phase in sorted(self.seconds):
+                f.write('{} {}\n'.format(phase.replace('/', ';'), int(round(self.self_seconds(phase) * 1e6))))
+
+
+def _function(phase):
+    """
+    pstats function key of a phase: (file, line, function name).
+    """
+    return ('SystolicArray', 0, phase)
+
@@ -0,0 +1,163 @@
+import os
+import json
+import time
+import pickle
+import sqlite3
+import hashlib
+import logging
+from SystolicArray import ENGINE_VERSION
+
+ResultCacheLogger = logging.getLogger('ResultCacheLogger')
+
+DEFAULT_CACHE_DIRECTORY = 'MTSA_ResultCache'
+DATABASE_NAME           = 'ResultCache.sqlite'
+
+# Configuration keys that don't change a run summary.
+IGNORED_KEYS = ('loggingNow', 'is_limited_buffer', 'checkpoint_cycles', 'checkpoint_seconds', 'profile', 'workers')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key       TEXT    PRIMARY KEY,
+    version   INTEGER NOT NULL,
+    size      INTEGER NOT NULL,
+    last_used REAL    NOT NULL,
+    summary   BLOB    NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used);
+"""
+
+
+def cache_key(configDict, version=ENGINE_VERSION):
+    """
+    Hash of the full configuration, its RNG seed and the engine version.
+    :return: hex digest, or None if the configuration has no seed - its inputs are drawn from fresh entropy, so it can't be reused.
+    """
+    if configDict.get('seed') is None:
+        return None
+
+    config = {key: value for key, value in configDict.items() if key not in IGNORED_KEYS}
+    config['engine_version'] = version
+
+    return hashlib.sha256(json.dumps(config, sort_keys=True).encode()).hexdigest()
+
+
+class ResultCache:
+    """
+    Cache of run summaries, keyed by cache_key and shared across work areas - sweeps re-run with extra
+    configurations simulate only the new ones.
+    Summaries are pickled into a SQLite table. Once the cache is above max_bytes, least recently used summaries are evicted.
+    Entries of another ENGINE_VERSION can never be hit: they are dropped when the cache is opened (see invalidate),
+    as are least recently used ones above max_bytes.
+    Estimated summaries aren't cached - they are cheap, and depend on the Estimator calibration.
+    A single process should use a cache at a time - sweep workers hand their summaries back to the parent (see run_sweep).
+    """
+
+    def __init__(self, directory=DEFAULT_CACHE_DIRECTORY, max_bytes=1 << 30):
+
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+        self.hits   = 0
+        self.misses = 0
+
+        self.connection = sqlite3.connect(os.path.join(directory, DATABASE_NAME))
+        self.connection.executescript(SCHEMA)
+
+        self.invalidate()
+        self.evict()
+
+    def close(self):
+
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+
+        return self.connection.execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+
+    def size(self):
+        """
+        :return: total size of the cached summaries [bytes]
+        """
+        return self.connection.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+
+    def get(self, configDict):
+        """
+        :return: cached summary of configDict, or None on a miss.
+        """
+        key = cache_key(configDict)
+        row = None if key is None else self.connection.execute('SELECT summary FROM entries WHERE key = ?', (key,)).fetchone()
+
+        if row is None:
+            self.misses += 1
+            return None
+
+        with self.connection:
+            self.connection.execute('UPDATE entries SET last_used = ? WHERE key = ?', (time.time(), key))
+
+        self.hits += 1
+        return pickle.loads(row[0])
+
+    def put(self, configDict, summaryDict):
+        """
+        Cache the summary of configDict, then evict least recently used summaries down to max_bytes.
+        :return: cache key, or None if the summary can't be cached.
+        """
+        key = cache_key(configDict)
+        if key is None or summaryDict.get('estimated'):
+            return None
+
+        summary = pickle.dumps(summaryDict, protocol=pickle.HIGHEST_PROTOCOL)
+
+        with self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO entries (key, version, size, last_used, summary) VALUES (?, ?, ?, ?, ?)',
+                                    (key, ENGINE_VERSION, len(summary), time.time(), summary))
+        self.evict()
+
+        return key
+
+    def evict(self):
+        """
+        Drop least recently used summaries until the cache fits in max_bytes.
+        :return: number of dropped summaries
+        """
+        excess = self.size() - self.max_bytes
+        if excess <= 0:
+            return 0
+
+        evicted = []
+        for key, size in self.connection.execute('SELECT key, size FROM entries ORDER BY last_used'):
+            if excess <= 0:
+                break
+            evicted.append((key,))
+            excess -= size
+
+        with self.connection:
+            self.connection.executemany('DELETE FROM entries WHERE key = ?', evicted)
+
+        ResultCacheLogger.info("{} Summaries Evicted".format(len(evicted)))
+        return len(evicted)
+
+    def invalidate(self, version=ENGINE_VERSION):
+        """
+        Drop every summary simulated by an engine version other than <version>.
+        Bump ENGINE_VERSION whenever simulated behavior changes, or invalidate(version=None) to drop everything.
+        :return: number of dropped summaries
+        """
+        with self.connection:
+            if version is None:
+                dropped = self.connection.execute('DELETE FROM entries').rowcount
+            else:
+                dropped = self.connection.execute('DELETE FROM entries WHERE version != ?', (version,)).rowcount
+
+        if dropped:
+            ResultCacheLogger.info("{} Summaries Invalidated".format(dropped))
+        return dropped
@@ -0,0 +1,349 @@
+import os
+import re
+import json
+import sqlite3
+import tempfile
+import logging
+import numpy as np
+from datetime import datetime
+from Utilities import array_shape
+
+ResultsStoreLogger = logging.getLogger('ResultsStoreLogger')
+
+DATABASE_NAME = 'Results.sqlite'
+TRACES_NAME   = 'Results.traces'
+
+# Configuration columns, in index order, and the configDict keys they come from.
+# array_size holds the array rows - its columns go to the array_columns column (see append).
+CONFIG_COLUMNS = (('array_size',       'array_size'),
+                  ('buffer_depth',     'buffer_depth'),
+                  ('thread_number',    'thread_number'),
+                  ('sparsity',         'sparsity'),
+                  ('input_multiplier', 'inputMultiplier'),
+                  ('seed',             'seed'))
+
+# Scalar summary columns. Any other scalar summary key goes to the 'extra' JSON column.
+SUMMARY_COLUMNS = ('total_clock', 'avg_clock_per_matrix', 'total_avg_utilization', 'total_std_utilization')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id                    INTEGER PRIMARY KEY,
+    array_size            INTEGER NOT NULL,
+    array_columns         INTEGER,
+    buffer_depth          INTEGER NOT NULL,
+    thread_number         INTEGER NOT NULL,
+    sparsity              REAL    NOT NULL,
+    input_multiplier      INTEGER NOT NULL,
+    seed                  INTEGER,
+    engine                TEXT,
+    telemetry             TEXT,
+    arbitration           TEXT    NOT NULL DEFAULT 'round_robin',
+    dataflow              TEXT    NOT NULL DEFAULT 'output',
+    rundir                TEXT,
+    cache_key             TEXT,
+    timestamp             TEXT    NOT NULL,
+    total_clock           REAL    NOT NULL,
+    avg_clock_per_matrix  REAL    NOT NULL,
+    total_avg_utilization REAL    NOT NULL,
+    total_std_utilization REAL    NOT NULL,
+    extra                 TEXT
+);
+CREATE TABLE IF NOT EXISTS traces (
+    run_id INTEGER NOT NULL REFERENCES runs (id),
+    name   TEXT    NOT NULL,
+    dtype  TEXT    NOT NULL,
+    shape  TEXT    NOT NULL,
+    offset INTEGER NOT NULL,
+    PRIMARY KEY (run_id, name)
+);
+"""
+
+# Indexes are created once older stores are migrated (see ADDED_COLUMNS) - they may index columns those stores lack.
+INDEXES = """
+CREATE INDEX IF NOT EXISTS runs_config ON runs (array_size, buffer_depth, thread_number, sparsity, input_multiplier, seed);
+CREATE INDEX IF NOT EXISTS runs_cache_key ON runs (cache_key);
+"""
+
+# Columns added to the runs table after its first release - stores created before them get them on open.
+# Their defaults are what the runs of those stores ran with - array_columns is set to array_size, as those arrays were square.
+ADDED_COLUMNS = (('cache_key',     "TEXT"),
+                 ('arbitration',   "TEXT NOT NULL DEFAULT 'round_robin'"),
+                 ('dataflow',      "TEXT NOT NULL DEFAULT 'output'"),
+                 ('array_columns', "INTEGER"))
+
+
+def buffer_keys(array_size, array_columns=None):
+    """
+    Recorded buffers keys, in Telemetry record order - the order of per buffer summary dictionaries.
+    Arrays are square unless <array_columns> is given.
+    """
+    array_columns = array_size if array_columns is None else array_columns
+    return [(i, j, direction) for i in range(array_size - 1) for j in range(array_columns - 1) for direction in ('H', 'V')]
+
+
+class ResultsStore:
+    """
+    Append-only store of experiment summaries, shared by every run of a work area.
+    Scalar results live in a SQLite table of runs, indexed by configuration
+    (array size, buffer depth, threads, sparsity, input multiplier, seed) - aggregating a sweep is a single query.
+    Arrays (utilization per PE, buffers load records and occupancy statistics) are appended raw to a side-car file,
+    and read back as read-only np.memmap views (see trace).
+    A single process should append at a time - sweep workers hand their summaries back to the parent (see run_sweep).
+    """
+
+    def __init__(self, directory):
+
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+        self.directory   = directory
+        self.traces_path = os.path.join(directory, TRACES_NAME)
+
+        self.connection = sqlite3.connect(os.path.join(directory, DATABASE_NAME))
+        self.connection.row_factory = sqlite3.Row
+        self.connection.executescript(SCHEMA)
+
+        # Stores created before the result cache, arbitration policies, dataflows and rectangular arrays - their runs have no
+        # cache key, and were all round-robin, output-stationary, on square arrays.
+        existing = [row['name'] for row in self.connection.execute('PRAGMA table_info(runs)')]
+        with self.connection:
+            for column, definition in ADDED_COLUMNS:
+                if column not in existing:
+                    self.connection.execute('ALTER TABLE runs ADD COLUMN {} {}'.format(column, definition))
+            # The inputMultiplier column was first named input_length, though it never held the stream length.
+            if 'input_length' in existing:
+                self.connection.execute('ALTER TABLE runs RENAME COLUMN input_length TO input_multiplier')
+            if 'array_columns' not in existing:
+                self.connection.execute('UPDATE runs SET array_columns = array_size')
+        self.connection.executescript(INDEXES)
+
+    def close(self):
+
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+
+        return self.connection.execute('SELECT COUNT(*) FROM runs').fetchone()[0]
+
+    def append(self, configDict, summaryDict, rundir=None, cache_key=None):
+        """
+        Append the summary of a run of configDict (see MTSA_generator_script.make_summary / Estimator.estimate).
+        :param cache_key: ResultCache key of the run, so a cached summary isn't appended twice (see find).
+        :return: run id
+        """
+        # configDict['array_size'] is an int or a (rows, columns) pair - stored as array_size rows by array_columns columns.
+        array_rows, array_columns = array_shape(configDict['array_size'])
+        config = dict(configDict, array_size=array_rows)
+
+        arrays = {'utilization_per_pe': np.asarray(summaryDict['utilization_per_pe'], dtype=np.float64)}
+
+        # Per buffer dictionaries are in buffer_keys order - arrays are stacked along that order.
+        if summaryDict.get('load_record_per_buffer'):
+            # (buffers, threads, cycles), in the smallest dtype that holds the loads.
+            loads = np.asarray(list(summaryDict['load_record_per_buffer'].values()))
+            arrays['load_record_per_buffer'] = loads.astype(np.min_scalar_type(loads.max() if loads.size else 0))
+        statistics = list(summaryDict.get('load_statistics_per_buffer', dict()).values())
+        if statistics:
+            for name in statistics[0]:
+                arrays['load_statistics_per_buffer/' + name] = np.asarray([buffer_statistics[name] for buffer_statistics in statistics])
+
+        extra = {key: value for key, value in summaryDict.items()
+                 if key not in SUMMARY_COLUMNS and key not in ('utilization_per_pe', 'load_record_per_buffer', 'load_statistics_per_buffer')}
+
+        # Arrays first: a failed append leaves unreferenced bytes in the side-car file, never a run without its arrays.
+        offsets = dict()
+        with open(self.traces_path, 'ab') as traces:
+            for name, array in arrays.items():
+                array = np.ascontiguousarray(array, dtype=array.dtype.newbyteorder('<'))
+                traces.write(b'\0' * (-traces.tell() % 8))
+                offsets[name] = traces.tell()
+                traces.write(array.tobytes())
+
+        with self.connection:
+            cursor = self.connection.execute(
+                'INSERT INTO runs ({}, array_columns, engine, telemetry, arbitration, dataflow, rundir, cache_key, timestamp, {}, extra) VALUES ({})'.format(
+                    ', '.join(column for column, _ in CONFIG_COLUMNS), ', '.join(SUMMARY_COLUMNS),
+                    ', '.join('?' * (len(CONFIG_COLUMNS) + 8 + len(SUMMARY_COLUMNS) + 1))),
+                [config.get(key) for _, key in CONFIG_COLUMNS] +
+                [array_columns, configDict.get('engine', 'object'), configDict.get('telemetry', 'full'), configDict.get('arbitration', 'round_robin'),
+                 configDict.get('dataflow', 'output'), rundir, cache_key, datetime.now().isoformat()] +
+                [float(summaryDict[key]) for key in SUMMARY_COLUMNS] +
+                [json.dumps(extra, default=lambda value: value.item()) if extra else None])
+            run_id = cursor.lastrowid
+            self.connection.executemany('INSERT INTO traces (run_id, name, dtype, shape, offset) VALUES (?, ?, ?, ?, ?)',
+                                        [(run_id, name, array.dtype.newbyteorder('<').str, json.dumps(array.shape), offsets[name])
+                                         for name, array in arrays.items()])
+
+        ResultsStoreLogger.info("Run {} Appended: {}".format(run_id, rundir))
+        return run_id
+
+    def find(self, cache_key):
+        """
+        :return: id of the run appended with <cache_key>, or None.
+        """
+        row = self.connection.execute('SELECT id FROM runs WHERE cache_key = ? ORDER BY id LIMIT 1', (cache_key,)).fetchone()
+        return None if row is None else row['id']
+
+    def query(self, columns='*', order_by='id', **config):
+        """
+        Runs matching configuration columns (see CONFIG_COLUMNS, plus array_columns, engine, telemetry, arbitration and dataflow)
+        given as keyword arguments, e.g. query(thread_number=4, arbitration='oldest_first') or query(array_size=32, array_columns=128).
+        :return: list of sqlite3.Row
+        """
+        where, parameters = _where(config)
+        return self.connection.execute('SELECT {} FROM runs{} ORDER BY {}'.format(columns, where, order_by), parameters).fetchall()
+
+    def aggregate(self, group_by=('thread_number', 'sparsity'), values=('avg_clock_per_matrix', 'total_avg_utilization'), **config):
+        """
+        Average result columns over the runs of each configuration group, in a single grouped query.
+        :return: list of sqlite3.Row - group columns, 'runs' count and the average of each value column.
+        """
+        where, parameters = _where(config)
+        group = ', '.join(group_by)
+        return self.connection.execute('SELECT {}, COUNT(*) AS runs, {} FROM runs{} GROUP BY {} ORDER BY {}'.format(
+            group, ', '.join('AVG({0}) AS {0}'.format(value) for value in values), where, group, group), parameters).fetchall()
+
+    def pivot(self, value, rows, columns, **config):
+        """
+        Average of <value> per (<rows>, <columns>) configuration, as a matrix - NaN where no run was stored.
+        :return: sorted row keys, sorted column keys and (rows, columns) array
+        """
+        groups = self.aggregate(group_by=(rows, columns), values=(value,), **config)
+
+        row_keys    = sorted({group[rows] for group in groups})
+        column_keys = sorted({group[columns] for group in groups})
+
+        matrix = np.full((len(row_keys), len(column_keys)), np.nan)
+        for group in groups:
+            matrix[row_keys.index(group[rows]), column_keys.index(group[columns])] = group[value]
+
+        return row_keys, column_keys, matrix
+
+    def trace(self, run_id, name):
+        """
+        :return: read-only np.memmap view of array <name> of a run, e.g. 'load_record_per_buffer' (buffers, threads, cycles).
+        :raise KeyError: if the run has no such array.
+        """
+        row = self.connection.execute('SELECT dtype, shape, offset FROM traces WHERE run_id = ? AND name = ?', (run_id, name)).fetchone()
+        if row is None:
+            raise KeyError('Run {} has no {} array'.format(run_id, name))
+
+        shape = tuple(json.loads(row['shape']))
+        if not int(np.prod(shape)):
+            return np.zeros(shape, dtype=row['dtype'])
+        return np.memmap(self.traces_path, dtype=row['dtype'], mode='r', offset=row['offset'], shape=shape)
+
+    def summary(self, run_id):
+        """
+        Summary dictionary of a run, as it was appended. Buffers load records and statistics are read into nested lists.
+        """
+        row = self.connection.execute('SELECT * FROM runs WHERE id = ?', (run_id,)).fetchone()
+        if row is None:
+            raise KeyError('No run {}'.format(run_id))
+
+        summaryDict = {key: row[key] for key in SUMMARY_COLUMNS}
+        summaryDict['utilization_per_pe'] = np.array(self.trace(run_id, 'utilization_per_pe'))
+        if row['extra']:
+            summaryDict.update(json.loads(row['extra']))
+
+        names = [name for (name,) in self.connection.execute('SELECT name FROM traces WHERE run_id = ? ORDER BY offset', (run_id,))]
+        keys  = buffer_keys(row['array_size'], row['array_columns'])
+        if 'load_record_per_buffer' in names:
+            loads = self.trace(run_id, 'load_record_per_buffer')
+            summaryDict['load_record_per_buffer'] = {key: loads[b].tolist() for b, key in enumerate(keys)}
+        statistics = {name.split('/', 1)[1]: self.trace(run_id, name) for name in names if name.startswith('load_statistics_per_buffer/')}
+        if statistics:
+            summaryDict['load_statistics_per_buffer'] = {key: {name: value[b].tolist() for name, value in statistics.items()}
+                                                         for b, key in enumerate(keys)}
+        else:
+            summaryDict['load_statistics_per_buffer'] = dict()
+
+        return summaryDict
+
+    def import_summaries(self, workdir):
+        """
+        Append the legacy per run Summary*.npy files (pickled dictionaries saved by np.save) found in the
+        run directories under workdir, next to their configuration file. Meant for a one time migration of old work areas.
+        :return: number of imported summaries
+        """
+        # Deferred import - MTSA_generator_script imports this module.
+        from MTSA_generator_script import load_config
+
+        imported = 0
+        for rundir, _, files in sorted(os.walk(workdir)):
+            summaries = sorted(f for f in files if re.match(r'^Summary.*\.npy$', f))
+            if not summaries:
+                continue
+            configDict = load_config(rundir, interactive=False, verbose=False)
+            for f in summaries:
+                self.append(configDict, np.load(os.path.join(rundir, f), allow_pickle=True).item(), rundir=rundir)
+                imported += 1
+
+        ResultsStoreLogger.info("{} Summaries Imported From {}".format(imported, workdir))
+        return imported
+
+
+def _where(config):
+    """
+    WHERE clause and parameters of configuration column equalities. None matches NULL (e.g. seed=None).
+    """
+    columns = [column for column, _ in CONFIG_COLUMNS] + ['array_columns', 'engine', 'telemetry', 'arbitration', 'dataflow']
+    for column in config:
+        if column not in columns:
+            raise ValueError('Unknown configuration column: {}'.format(column))
+
+    clauses    = ['{} IS ?'.format(column) if config[column] is None else '{} = ?'.format(column) for column in sorted(config)]
+    parameters = [config[column] for column in sorted(config)]
+
+    return (' WHERE ' + ' AND '.join(clauses) if clauses else ''), parameters
+
+
+if __name__ == '__main__':
+    # Migration check: a store in the first released layout (input_length column, no cache key, arbitration, dataflow or
+    # array columns) is migrated on open, and its runs read back through pivot - opened twice, as a migrated store is reopened.
+    FIRST_RUNS_TABLE = """
+    CREATE TABLE runs (
+        id                    INTEGER PRIMARY KEY,
+        array_size            INTEGER NOT NULL,
+        buffer_depth          INTEGER NOT NULL,
+        thread_number         INTEGER NOT NULL,
+        sparsity              REAL    NOT NULL,
+        input_length          INTEGER NOT NULL,
+        seed                  INTEGER,
+        engine                TEXT,
+        telemetry             TEXT,
+        rundir                TEXT,
+        timestamp             TEXT    NOT NULL,
+        total_clock           REAL    NOT NULL,
+        avg_clock_per_matrix  REAL    NOT NULL,
+        total_avg_utilization REAL    NOT NULL,
+        total_std_utilization REAL    NOT NULL,
+        extra                 TEXT
+    );
+    CREATE INDEX runs_config ON runs (array_size, buffer_depth, thread_number, sparsity, input_length, seed);
+    """
+    expected = np.array([[10.0, 15.0], [20.0, 25.0]])
+
+    with tempfile.TemporaryDirectory() as directory:
+        connection = sqlite3.connect(os.path.join(directory, DATABASE_NAME))
+        connection.executescript(FIRST_RUNS_TABLE)
+        connection.executemany('INSERT INTO runs (array_size, buffer_depth, thread_number, sparsity, input_length, timestamp, '
+                               'total_clock, avg_clock_per_matrix, total_avg_utilization, total_std_utilization) VALUES (4, 2, ?, ?, 7, ?, 1, ?, 0.5, 0)',
+                               [(threads, sparsity, datetime.now().isoformat(), expected[t, s])
+                                for t, threads in enumerate((1, 2)) for s, sparsity in enumerate((0.1, 0.5))])
+        connection.commit()
+        connection.close()
+
+        for _ in range(2):
+            with ResultsStore(directory) as store:
+                row_keys, column_keys, matrix = store.pivot('avg_clock_per_matrix', 'thread_number', 'sparsity',
+                                                            input_multiplier=7, array_columns=4, arbitration='round_robin',
+                                                            dataflow='output')
+                migrated = row_keys == [1, 2] and column_keys == [0.1, 0.5] and np.array_equal(matrix, expected)
+                print('[INFO] - Migrated Store Read Back Correctly: {}'.format(migrated))
@@ -0,0 +1,360 @@
+import time
+import numpy as np
+import logging
+from bisect import bisect_right
+from Arbitration import check_policy, LOOKAHEAD
+from Utilities import array_shape
+
+SparseEngineLogger = logging.getLogger('SparseEngineLogger')
+
+# Clock cycles of telemetry rebuilt at once when replaying (see _replay_window).
+WINDOW_CYCLES = 256
+
+# Ready cycle of a thread without MAC candidates left.
+NEVER = 1 << 62
+
+
+class SparseEngine:
+    """
+    Run-length implementation of the SystolicArray clock, for unlimited buffers.
+    Operand streams are kept compressed: per PE and thread, only the couples with two non-zero operands (MAC candidates)
+    are listed - the zero and bubble runs between them are never stepped through one operand at a time.
+    With unlimited buffers nothing pushes back, so every PE departure only depends on its west and north arrivals,
+    and the schedule is computed PE by PE (row-major, like SystolicArray.tick) for the whole run at construction:
+    - a couple without MAC leaves on the first cycle it is at the top of both its input buffers:
+      d(k) = max(a(k), d(k-1)+1), and over a run of such couples d(k) - k is a running maximum - a single
+      np.maximum.accumulate call per PE, whatever the run lengths.
+    - MAC candidates go through the arbitration of PE.tock (round-robin or an Arbiter policy), one Python step per MAC.
+    Python work grows with the number of MAC's instead of cycles * PE's * threads - the higher the sparsity, the larger the gain.
+    tick then replays MAC activity, buffers occupancy and drained OUTPUT's cycle by cycle, rebuilt from departure cycles
+    in windows of WINDOW_CYCLES. Same cycles, utilization, results and telemetry as the object engine.
+    Limited buffers aren't supported: full buffers hold upstream PE's back (and drop bubbles), so departures aren't
+    feed-forward anymore.
+    """
+
+    def __init__(self, west_matrices, north_matrices, array_size, telemetry, log, profiler=None, arbitration='round_robin'):
+        """
+        Construct SparseEngine instance, and schedule the whole run.
+        :param west_matrices:  single element sequence of a (threads, rows, input_length) west tensor.
+        :param north_matrices: single element sequence of a (threads, input_length, columns) north tensor.
+        :param array_size: PE grid, an int or a (rows, columns) pair - see Utilities.array_shape.
+        MAC activity and buffers occupancy are written into <telemetry> as cycles are replayed.
+        <profiler> is the Profiler that scheduling and replay are timed into, None to time nothing.
+        <arbitration> is the thread arbitration policy of every PE, one of Arbitration.ARBITRATION_POLICIES (see Arbiter).
+        """
+        check_policy(arbitration)
+
+        self.array_size         = array_size
+        self.rows, self.columns = array_shape(array_size)
+        self.telemetry          = telemetry
+        self.profiler           = profiler
+        self.arbitration        = arbitration
+
+        # Recorded buffers, in Telemetry order: the PE's pushing into them and the PE's popping them. PE <i,j> is i*columns + j.
+        rows, columns = self.rows, self.columns
+        self.producers = np.array([i * columns + j for i in range(rows - 1) for j in range(columns - 1) for _ in 'HV'], dtype=np.int64)
+        self.consumers = np.array([i * columns + j + 1 if direction == 'H' else (i + 1) * columns + j
+                                   for i in range(rows - 1) for j in range(columns - 1) for direction in 'HV'], dtype=np.int64)
+
+        self.reset(west_matrices, north_matrices)
+
+        if log:
+            SparseEngineLogger.info("SparseEngine Initialized: {} MAC's Over {} Cycles".format(len(self.mac_cycles), self.total_cycles))
+
+    def reset(self, west_matrices, north_matrices):
+        """
+        Load a new job and schedule it.
+        """
+        self.west_matrices  = west_matrices[0]
+        self.north_matrices = north_matrices[0]
+
+        self.thread_count = self.west_matrices.shape[0]
+        self.input_length = self.west_matrices.shape[2]
+
+        profiler = self.profiler
+        if profiler is not None:
+            start = time.perf_counter()
+
+        self._schedule()
+
+        if profiler is not None:
+            profiler.lap('construction/schedule', start)
+            profiler.count('MAC events', len(self.mac_cycles))
+
+        self.cycles = 0
+        self.window = None
+
+        # Completion tracking, same as SystolicArray.pending_outputs.
+        west_zero_rows     = ~self.west_matrices.any(axis=2)
+        north_zero_columns = ~self.north_matrices.any(axis=1)
+        self.pending_outputs = int(np.count_nonzero(~west_zero_rows) + np.count_nonzero(~north_zero_columns))
+
+        counted = np.concatenate((self.east_drain_cycles[~west_zero_rows], self.south_drain_cycles[~north_zero_columns]))
+        self.drained = np.bincount(counted, minlength=self.total_cycles)
+
+    def _schedule(self):
+        """
+        Departure cycle of every couple from every PE - cycles count from 0, the first tick.
+        PE <i,j> sees i+j leading bubble couples, then one couple per operand: the west FIFO skew plus one initial bubble
+        per buffer on the way. Edge FIFO's hold everything from cycle 0, and each buffer holds its initial bubble, then what
+        its producer pushed - readable on the same cycle, since producers tock first.
+        """
+        rows, columns, threads, length = self.rows, self.columns, self.thread_count, self.input_length
+
+        west_nonzero  = self.west_matrices != 0
+        north_nonzero = self.north_matrices != 0
+
+        mac_cycles, mac_pes, mac_threads, mac_products = [], [], [], []
+
+        # Operand departures of every PE and thread, in Telemetry's need for occupancy only.
+        operands = np.zeros((rows * columns, threads, length), dtype=np.int64) if self.telemetry.records_occupancy else None
+        self.east_drain_cycles  = np.zeros((threads, rows),    dtype=np.int64)
+        self.south_drain_cycles = np.zeros((threads, columns), dtype=np.int64)
+
+        above = [None] * columns
+        for i in range(rows):
+            left = None
+            for j in range(columns):
+                bubbles = i + j
+                items   = length + bubbles
+
+                arrival = np.zeros((threads, items), dtype=np.int64)
+                if j:
+                    np.maximum(arrival[:, 1:], left, out=arrival[:, 1:])
+                if i:
+                    np.maximum(arrival[:, 1:], above[j], out=arrival[:, 1:])
+
+                # Queue lengths are counted per input buffer.
+                sides = None
+                if self.arbitration == 'longest_queue_first':
+                    sides = np.zeros((2, threads, items), dtype=np.int64)
+                    if j:
+                        sides[0, :, 1:] = left
+                    if i:
+                        sides[1, :, 1:] = above[j]
+
+                candidates = west_nonzero[:, i, :] & north_nonzero[:, :, j]
+                cycles, mac_thread, operand = self._arbitrate(arrival, candidates, bubbles, sides)
+
+                # Departures: d(k) - k is the running maximum of a(k) - k, MAC couples set to their own departure.
+                arrival -= np.arange(items)
+                arrival[mac_thread, operand + bubbles] = cycles - (operand + bubbles)
+                departure = np.maximum.accumulate(arrival, axis=1)
+                departure += np.arange(items)
+
+                mac_cycles.append(cycles)
+                mac_pes.append(np.full(len(cycles), i * columns + j, dtype=np.int64))
+                mac_threads.append(mac_thread)
+                mac_products.append(self.west_matrices[mac_thread, i, operand] * self.north_matrices[mac_thread, operand, j])
+
+                if operands is not None:
+                    operands[i * columns + j] = departure[:, bubbles:]
+                if length:
+                    if j == columns - 1:
+                        self.east_drain_cycles[:, i] = departure[:, -1]
+                    if i == rows - 1:
+                        self.south_drain_cycles[:, j] = departure[:, -1]
+
+                above[j] = left = departure
+
+        # MAC events in cycle order.
+        mac_cycles = np.concatenate(mac_cycles)
+        order      = np.argsort(mac_cycles, kind='stable')
+
+        self.mac_cycles   = mac_cycles[order]
+        self.mac_pes      = np.concatenate(mac_pes)[order]
+        self.mac_threads  = np.concatenate(mac_threads)[order]
+        self.mac_products = np.concatenate(mac_products)[order]
+
+        # The last PE sees every couple last.
+        self.total_cycles = int(above[-1].max(initial=0)) + 1
+
+        # Operand departures as one sorted array: every PE thread row is offset by a span longer than the run.
+        if operands is not None:
+            keys = rows * columns * threads
+            self.span = self.total_cycles + 1
+            self.departure_keys = (operands.reshape(keys, length) + np.arange(keys)[:, None] * self.span).reshape(-1)
+
+    def _arbitrate(self, arrival, candidates, bubbles, sides=None):
+        """
+        MAC arbitration of a single PE over the whole run (see PE.tock): on every cycle, the first thread from onThread
+        whose top couple is a ready MAC candidate gets the MAC - or, with an arbitration policy, the ready candidate with
+        the highest Arbiter.score, round-robin order breaking ties - and onThread moves on by one.
+        A candidate is ready once both its operands arrived and the couple before it left - its ready cycle follows
+        from the departure of the previous candidate of its thread, and the largest a(k) - k in between.
+        Scores follow from the same cycles: a candidate at position p that is ready since r, on cycle c,
+            oldest_first        - has been left waiting c - r cycles.
+            longest_queue_first - has the west (north) items arrived by c in its buffer, less the p that left.
+            lookahead_nonzero   - is followed by zero / bubble couples up to the next candidate of its thread,
+                                  of which those arrived by c are visible.
+        :param arrival: (threads, items) arrival cycles of every couple.
+        :param candidates: (threads, input_length) True for couples of two non-zero operands.
+        :param sides: (2, threads, items) west and north arrival cycles, for longest_queue_first.
+        :return: MAC cycles, threads and operand indexes, in thread then operand order.
+        """
+        threads, items = arrival.shape
+
+        mac_thread, operand = np.nonzero(candidates)
+        if not len(operand):
+            return np.zeros(0, dtype=np.int64), mac_thread, operand
+
+        position = operand + bubbles
+
+        # Largest a(k) - k from the couple after the previous candidate of the thread, up to the candidate itself.
+        offsets = (arrival - np.arange(items)).reshape(-1)
+        offsets = np.append(offsets, 0)
+        flat    = mac_thread * items + position
+        follows = np.append(False, mac_thread[1:] == mac_thread[:-1])
+        starts  = np.where(follows, np.append(0, flat[:-1] + 1), mac_thread * items)
+        segment = np.maximum.reduceat(offsets, np.stack((starts, flat + 1), axis=1).reshape(-1))[::2]
+
+        positions = position.tolist()
+        segments  = segment.tolist()
+        bounds    = np.searchsorted(mac_thread, np.arange(threads + 1)).tolist()
+        pointer   = bounds[:-1]
+        ends      = bounds[1:]
+
+        ready = [positions[pointer[t]] + segments[pointer[t]] if pointer[t] < ends[t] else NEVER for t in range(threads)]
+
+        policy = self.arbitration
+        if policy == 'longest_queue_first':
+            west_arrivals, north_arrivals = sides[0].tolist(), sides[1].tolist()
+        elif policy == 'lookahead_nonzero':
+            arrivals  = arrival.tolist()
+            following = np.where(np.append(follows[1:], False), np.append(position[1:], 0), items).tolist()
+
+        cycles = [0] * len(positions)
+        on_thread, last = 0, -1
+        for _ in range(len(positions)):
+            cycle = max(last + 1, min(ready))
+
+            if policy == 'round_robin':
+                thread = on_thread
+                while ready[thread] > cycle:
+                    thread = thread + 1 if thread + 1 < threads else 0
+            else:
+                thread, best = None, None
+                for t in list(range(on_thread, threads)) + list(range(on_thread)):
+                    if ready[t] > cycle:
+                        continue
+                    p = positions[pointer[t]]
+                    if policy == 'oldest_first':
+                        score = cycle - ready[t]
+                    elif policy == 'longest_queue_first':
+                        score = bisect_right(west_arrivals[t], cycle) + bisect_right(north_arrivals[t], cycle) - 2 * p
+                    else:
+                        score = min(LOOKAHEAD, bisect_right(arrivals[t], cycle) - p - 1, following[pointer[t]] - p - 1)
+                    if thread is None or score > best:
+                        thread, best = t, score
+
+            s = pointer[thread]
+            cycles[s] = cycle
+            offset = cycle - positions[s]
+
+            s += 1
+            pointer[thread] = s
+            ready[thread] = positions[s] + max(offset, segments[s]) if s < ends[thread] else NEVER
+
+            on_thread = on_thread + 1 if on_thread + 1 < threads else 0
+            last = cycle
+
+        return np.array(cycles, dtype=np.int64), mac_thread, operand
+
+    def _replay_window(self, start):
+        """
+        MAC activity and recorded buffers occupancy of cycles [start, start+WINDOW_CYCLES).
+        Occupancy is the number of operands a buffer's producer pushed, less the ones its consumer popped, by each cycle.
+        """
+        pes  = self.rows * self.columns
+        stop = start + WINDOW_CYCLES
+
+        low, high = np.searchsorted(self.mac_cycles, (start, stop))
+        mac = np.bincount((self.mac_cycles[low:high] - start) * pes + self.mac_pes[low:high], minlength=WINDOW_CYCLES * pes)
+        mac = mac.reshape(WINDOW_CYCLES, self.rows, self.columns).astype(np.uint8)
+
+        occupancy = None
+        if self.telemetry.records_occupancy:
+            rows    = pes * self.thread_count
+            offsets = np.arange(rows) * self.span
+            low     = np.searchsorted(self.departure_keys, offsets + start)
+            high    = np.searchsorted(self.departure_keys, offsets + stop)
+
+            # Departures within the window, row by row.
+            counts = high - low
+            index  = np.repeat(low - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+            row    = np.repeat(np.arange(rows), counts)
+            cycle  = self.departure_keys[index] - offsets[row] - start
+
+            departed  = np.bincount(cycle * rows + row, minlength=WINDOW_CYCLES * rows).reshape(WINDOW_CYCLES, rows).cumsum(axis=0)
+            departed += low - np.arange(rows) * self.input_length
+            departed  = departed.reshape(WINDOW_CYCLES, pes, self.thread_count)
+
+            occupancy = departed[:, self.producers] - departed[:, self.consumers]
+
+        self.window = (start, mac, occupancy)
+
+    def tick(self):
+        """
+        Replay the next clock cycle: MAC activity, buffers occupancy and drained OUTPUT's.
+        """
+        profiler = self.profiler
+        if profiler is not None:
+            mark = time.perf_counter()
+
+        if self.window is None or self.cycles >= self.window[0] + WINDOW_CYCLES:
+            self._replay_window(self.cycles)
+            if profiler is not None:
+                mark = profiler.lap('tick/replay', mark)
+
+        start, mac, occupancy = self.window
+
+        row = self.telemetry.open_cycle()
+        self.telemetry.mac[row, 0] = mac[self.cycles - start]
+        if occupancy is not None and occupancy.shape[1]:
+            self.telemetry.occupancy[row, 0] = occupancy[self.cycles - start]
+        self.telemetry.close_cycle()
+
+        if self.cycles < self.total_cycles:
+            self.pending_outputs -= int(self.drained[self.cycles])
+        self.cycles += 1
+
+        if profiler is not None:
+            profiler.lap('tick/close_cycle', mark)
+
+    def is_done(self):
+        """
+        :return: True if all OUTPUT threads drained their whole input, as of the last replayed cycle.
+        """
+        return self.pending_outputs == 0
+
+    def state(self):
+        """
+        Replay position (see SystolicArray.snapshot) - the schedule is rebuilt from the inputs on restore.
+        """
+        return {'cycles': np.array(self.cycles), 'pending_outputs': np.array(self.pending_outputs)}
+
+    def load_state(self, state):
+
+        self.cycles          = int(state['cycles'])
+        self.pending_outputs = int(state['pending_outputs'])
+        self.window          = None
+
+    def results(self, element=0):
+        """
+        :return: (threads, rows, columns) accumulators, as of the last replayed cycle.
+        """
+        done = np.searchsorted(self.mac_cycles, self.cycles)
+
+        result = np.zeros((self.thread_count, self.rows * self.columns), dtype=np.result_type(self.west_matrices, self.north_matrices))
+        np.add.at(result, (self.mac_threads[:done], self.mac_pes[:done]), self.mac_products[:done])
+        return result.reshape(self.thread_count, self.rows, self.columns)
+
+    def unpack_outputs(self, element=0):
+        """
+        Same as unpack_BUFFERs on the OUTPUT buffers: threads that drained their whole input by the last replayed cycle
+        are copied, others are zeroed.
+        :return: east and south output tensors
+        """
+        east  = np.where((self.east_drain_cycles  < self.cycles)[:, :, None], self.west_matrices,  0)
+        south = np.where((self.south_drain_cycles < self.cycles)[:, None, :], self.north_matrices, 0)
+        return east, south
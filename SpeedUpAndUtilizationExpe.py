@@ -3,38 +3,210 @@ import os
 import json
 from pprint import pprint
 from MTSA_generator_script import *
-import re
+from ResultsStore import ResultsStore
+from ResultCache import ResultCache, DEFAULT_CACHE_DIRECTORY
+from InputStore import InputStore, DEFAULT_INPUT_DIRECTORY
+from Arbitration import ARBITRATION_POLICIES
+from Utilities import DATAFLOWS, dataflow_shapes, array_shape
+from functools import partial
+import time
+import traceback
+import multiprocessing
 import matplotlib.pyplot as plt
 
 np.set_printoptions(linewidth=np.nan)
 
 
-def generate_multiple_runs():
+def run_directory_name(configRun):
+
+    rows, columns = array_shape(configRun['array_size'])
+    rundir = 'MTSA_{}X{}SA_'.format(rows, columns)
+    if configRun['buffer_depth'] == -1:
+        rundir += 'BUFFINF_'
+    else:
+        rundir += 'BUFFLIM{}_'.format(configRun['buffer_depth'])
+
+    west_shape, north_shape = dataflow_shapes(configRun['array_size'], configRun['thread_number'],
+                                              max(rows, columns) * configRun['inputMultiplier'], configRun.get('dataflow', 'output'))
+    rundir += '{}X{}WEST_{}X{}NORTH_'.format(west_shape[1], west_shape[2], north_shape[1], north_shape[2])
+    rundir += '{0:.2f}SPARS_'.format(configRun['sparsity']).replace('.', '_')
+    rundir += '{}THREAD'.format(configRun['thread_number'])
+    if configRun.get('arbitration', 'round_robin') != 'round_robin':
+        rundir += '_{}'.format(configRun['arbitration'].upper())
+    if configRun.get('dataflow', 'output') != 'output':
+        rundir += '_{}STATIONARY'.format(configRun['dataflow'].upper())
+
+    return rundir
+
+
+def _run_job(rundir, inputs=None):
+    """
+    Pool worker: run a single experiment from the config file in rundir, without prompting.
+    Seeded inputs are mapped from the InputStore in directory <inputs>, if given.
+    Failures are returned rather than raised, so one bad run doesn't kill the sweep.
+    :return: (rundir, configuration, summary or None, error traceback or None, run time [s])
+    """
+    start = time.time()
+    configDict = None
+    try:
+        configDict  = load_config(rundir, interactive=False, verbose=False)
+        summaryDict = simulate_config(configDict, verbose=False, inputs=None if inputs is None else InputStore(inputs))
+        return rundir, configDict, summaryDict, None, time.time() - start
+    except Exception:
+        return rundir, configDict, None, traceback.format_exc(), time.time() - start
+
+
+def _run_batch_job(runDirs, inputs=None):
+    """
+    Pool worker: run the experiments of runDirs as a single batch (see simulate_batch), without prompting.
+    Seeded inputs are mapped from the InputStore in directory <inputs>, if given.
+    A failure fails the whole batch. Run time is the batch time, spread evenly over its runs.
+    :return: list of (rundir, configuration, summary or None, error traceback or None, run time [s])
+    """
+    start = time.time()
+    configDicts = [None] * len(runDirs)
+    try:
+        configDicts = [load_config(rundir, interactive=False, verbose=False) for rundir in runDirs]
+        summaries   = simulate_batch(configDicts, verbose=False, inputs=None if inputs is None else InputStore(inputs))
+        elapsed     = (time.time() - start) / len(runDirs)
+        return [(rundir, configDict, summaryDict, None, elapsed) for rundir, configDict, summaryDict in zip(runDirs, configDicts, summaries)]
+    except Exception:
+        error = traceback.format_exc()
+        return [(rundir, configDict, None, error, (time.time() - start) / len(runDirs)) for rundir, configDict in zip(runDirs, configDicts)]
+
+
+def batch_run_directories(runDirs, batch_size):
+    """
+    Group run directories into batches of at most batch_size runs that simulate_batch can run together
+    (same array size, buffer depth, telemetry level, arbitration policy and dataflow).
+    Runs whose config file is missing or corrupted get a batch of their own, so the worker reports them alone.
+    :return: list of run directory lists
+    """
+    groups  = dict()
+    singles = []
+    for rundir in runDirs:
+        try:
+            configRun = load_config(rundir, interactive=False, verbose=False)
+        except IOError:
+            singles.append([rundir])
+            continue
+        key = (array_shape(configRun['array_size']), configRun['buffer_depth'], configRun.get('telemetry', 'full'),
+               configRun.get('arbitration', 'round_robin'), configRun.get('dataflow', 'output'))
+        groups.setdefault(key, []).append(rundir)
+
+    return [group[first:first + batch_size] for group in groups.values() for first in range(0, len(group), batch_size)] + singles
+
+
+def run_sweep(runDirs, store, processes=None, batch_size=None, cache=DEFAULT_CACHE_DIRECTORY, inputs=DEFAULT_INPUT_DIRECTORY):
+    """
+    Run the experiments of runDirs (each holding a config file) across a process pool, and append their summaries to store.
+    Runs found in cache (see ResultCache) aren't simulated again - their cached summaries are appended instead,
+    unless store holds them already.
+    Runs are independent: each reads only its own directory, and the working directory is never changed.
+    Workers hand summaries back, so this process is the single writer of the results store and cache.
+    :param store: ResultsStore, or its directory.
+    :param processes: pool size, os.cpu_count() if None. 1 runs serially in this process.
+    :param batch_size: if given, runs are simulated in batches of up to batch_size runs (see batch_run_directories),
+                       one batch per pool job. Logging and estimate mode are ignored then.
+    :param cache: ResultCache, or its directory - None to simulate every run.
+    :param inputs: InputStore directory. Seeded inputs and expected results are drawn once into it, and workers map them
+                   read-only instead of each drawing, multiplying and holding their own copies. None to draw them in every run.
+    :return: dictionary of failed run directory to error traceback
+    """
+    failures = dict()
+    done     = 0
+    pool     = None
+
+    results_store = store if isinstance(store, ResultsStore) else ResultsStore(store)
+    result_cache  = cache if cache is None or isinstance(cache, ResultCache) else ResultCache(cache)
+
+    try:
+        pending = []
+        for rundir in runDirs:
+            try:
+                run_id = lookup_cache(load_config(rundir, interactive=False, verbose=False), result_cache, results_store, rundir=rundir)
+            except IOError:
+                # Bad config file - the worker reports it.
+                run_id = None
+
+            if run_id is None:
+                pending.append(rundir)
+            else:
+                done += 1
+                print('[INFO] - [{}/{}] {} Cached (Run {})'.format(done, len(runDirs), rundir, run_id))
+
+        if batch_size is None:
+            worker, tasks = partial(_run_job, inputs=inputs), pending
+        else:
+            worker, tasks = partial(_run_batch_job, inputs=inputs), batch_run_directories(pending, batch_size)
+
+        if processes == 1 or not tasks:
+            jobs = map(worker, tasks)
+        else:
+            pool = multiprocessing.Pool(processes=processes)
+            jobs = pool.imap_unordered(worker, tasks)
+
+        # Batch jobs return a list of runs, single jobs a single run.
+        if batch_size is not None:
+            jobs = (run for batch in jobs for run in batch)
+
+        for done, (rundir, configDict, summaryDict, error, elapsed) in enumerate(jobs, done + 1):
+            if error is None:
+                run_id = record_run(configDict, summaryDict, results_store, result_cache, rundir=rundir)
+                print('[INFO] - [{}/{}] {} Done In {:.1f}s (Run {})'.format(done, len(runDirs), rundir, elapsed, run_id))
+            else:
+                print('[ERROR] - [{}/{}] {} Failed:\n{}'.format(done, len(runDirs), rundir, error))
+                failures[rundir] = error
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        if results_store is not store:
+            results_store.close()
+        if result_cache is not cache and result_cache is not None:
+            result_cache.close()
+
+    if failures:
+        print('[ERROR] - {} Out Of {} Runs Failed:'.format(len(failures), len(runDirs)))
+        for rundir in sorted(failures):
+            print('\t' + rundir)
+
+    return failures
+
+
+def generate_multiple_runs(processes=None, batch_size=None, cache=DEFAULT_CACHE_DIRECTORY, inputs=DEFAULT_INPUT_DIRECTORY):
     """
     - Configurations according to config dictionary down here.
-    - Create work area based on Configurations, and step into it. save configurations in it.
-    - For each sparsity and threads number, create sub - work dir, step into it and apply run_once, with those parameters.
-    :return:
+    - Create work area based on Configurations, and save configurations in it.
+    - For each sparsity, threads number, arbitration policy and dataflow, create sub - work dir with its config file.
+      Inputs are drawn from a fixed seed, so re-running the sweep (e.g. with more threads) reuses the cached runs.
+    - Run all sub - work dirs across a process pool of 'processes' workers, in batches of 'batch_size' runs if given,
+      into the results store of the work area (see run_sweep), with inputs shared through the InputStore in 'inputs'.
+    :return: dictionary of failed run directory to error traceback
     """
 
-    configExp = {'array_size'      : 8,
+    configExp = {'array_size'      : 8,                      # or (rows, columns), e.g. (32, 128)
                  'buffer_depth'    : 2,
                  'top_value'       : 10,
                  'sparsity_values' : list(np.linspace(0, 0.96, 24)),
                  'input_times'     : 200,
-                 'threads'         : [1, 2, 4, 8, 16]}
+                 'threads'         : [1, 2, 4, 8, 16],
+                 'arbitration_policies' : ['round_robin'],   # any of Arbitration.ARBITRATION_POLICIES
+                 'dataflows'       : ['output'],              # any of Utilities.DATAFLOWS
+                 'seed'            : 0}
 
     configExp['values'] = np.arange(configExp['top_value'])
 
-    workdir = 'MTSA_{}X{}SA_'.format(configExp['array_size'], configExp['array_size'])
+    rows, columns = array_shape(configExp['array_size'])
+    workdir = 'MTSA_{}X{}SA_'.format(rows, columns)
     if configExp['buffer_depth'] == -1:
         workdir += 'BUFFINF_'
     else:
         workdir += 'BUFFLIM{}_'.format(configExp['buffer_depth'])
-    workdir += '{}X{}WEST_{}X{}NORTH_'.format(configExp['array_size'],
-                                              configExp['array_size'] * configExp['input_times'],
-                                              configExp['array_size'] * configExp['input_times'],
-                                              configExp['array_size'])
+    workdir += '{}X{}WEST_{}X{}NORTH_'.format(rows,
+                                              max(rows, columns) * configExp['input_times'],
+                                              max(rows, columns) * configExp['input_times'],
+                                              columns)
     for t in configExp['threads']:
         workdir += '{}_'.format(t)
     workdir = workdir[:-1]
@@ -47,85 +219,68 @@ def generate_multiple_runs():
             print("[ERROR] - Can't Create " + workdir + " Directory.")
             exit(1)
 
-        os.chdir(workdir)
-    else:
-        try:
-            os.chdir(workdir)
-        except OSError:
-            print("[ERROR] - Can't Change Directory To " + workdir)
-            exit(2)
+    np.save(os.path.join(workdir, 'ExpConfigFile'), configExp)
 
-    np.save('ExpConfigFile', configExp)
+    runDirs = []
 
     for sparsity in configExp['sparsity_values']:
 
         for t in configExp['threads']:
 
-            configRun = {'thread_number' : t,
-                         'array_size'    : configExp['array_size'],
-                         'sparsity'      : sparsity,
-                         'buffer_depth'  : configExp['buffer_depth'],
-                         'inputMultiplier' : configExp['input_times'],
-                         'loggingNow'      : False
-                         }
-            if configExp['buffer_depth'] < 0:
-                configRun['is_limited_buffer'] = 'No'
-            else:
-                configRun['is_limited_buffer'] = 'Yes'
+            for policy in configExp['arbitration_policies']:
 
-            rundir = 'MTSA_{}X{}SA_'.format(configRun['array_size'] , configRun['array_size'])
-            if configRun['buffer_depth'] == -1:
-                rundir += 'BUFFINF_'
-            else:
-                rundir += 'BUFFLIM{}_'.format(configRun['buffer_depth'])
-
-            rundir += '{}X{}WEST_{}X{}NORTH_'.format(configRun['array_size'] ,
-                                                     configRun['array_size'] * configRun['inputMultiplier'] ,
-                                                     configRun['array_size'] * configRun['inputMultiplier'] ,
-                                                     configRun['array_size'])
-            rundir += '{0:.2f}SPARS_'.format(sparsity).replace('.', '_')
-            rundir += '{}THREAD'.format(t)
-
-            if not os.path.exists(rundir):
-                try:
-                    os.makedirs(rundir)
-                except OSError:
-                    print("[ERROR] - Can't Create " + rundir + " Directory.")
-                    exit(3)
-
-                os.chdir(rundir)
-            else:
-                try:
-                    os.chdir(rundir)
-                except OSError:
-                    print("[ERROR] - Can't Change Directory To " + rundir)
-                    exit(4)
-
-            with open('ConfigFile.json', 'w') as js:
-                json.dump(configRun, js)
+                for dataflow in configExp['dataflows']:
 
-            os.chdir('..')
+                    configRun = {'thread_number' : t,
+                                 'array_size'    : configExp['array_size'],
+                                 'sparsity'      : sparsity,
+                                 'buffer_depth'  : configExp['buffer_depth'],
+                                 'inputMultiplier' : configExp['input_times'],
+                                 'loggingNow'      : False,
+                                 # The sparse engine is output-stationary only.
+                                 'engine'          : 'vectorized' if configExp['buffer_depth'] >= 0 or dataflow != 'output' else 'sparse',
+                                 'telemetry'       : 'histogram',
+                                 'seed'            : configExp['seed']
+                                 }
+                    # Round-robin, output-stationary runs keep the configuration they always had, so their cached summaries are reused.
+                    if policy != 'round_robin':
+                        configRun['arbitration'] = policy
+                    if dataflow != 'output':
+                        configRun['dataflow'] = dataflow
+                    if configExp['buffer_depth'] < 0:
+                        configRun['is_limited_buffer'] = 'No'
+                    else:
+                        configRun['is_limited_buffer'] = 'Yes'
 
-    dirList = [d for d in os.listdir('.') if os.path.isdir(os.path.join('.' , d))]
+                    rundir = os.path.join(workdir, run_directory_name(configRun))
 
-    for d in dirList:
+                    if not os.path.exists(rundir):
+                        try:
+                            os.makedirs(rundir)
+                        except OSError:
+                            print("[ERROR] - Can't Create " + rundir + " Directory.")
+                            exit(3)
 
-        print('RunDir:' + d)
+                    with open(os.path.join(rundir, 'ConfigFile.json'), 'w') as js:
+                        json.dump(configRun, js)
 
-        runOnce(dumpTo=d)
+                    runDirs.append(rundir)
 
-        os.chdir('..')
+    return run_sweep(runDirs, store=workdir, processes=processes, batch_size=batch_size, cache=cache, inputs=inputs)
 
 
 def plot_speedup_and_util_improvement_graph(workdir):
     """
-    - Iterate through all Experiments in work directory, from which extract relevant information (saved in summary file).
-    - Gather all information together, and plot:
+    - Query the results store of the work directory for all Experiments, averaged per threads number and sparsity.
+      Old work directories, holding per run Summary files, are imported into the store first.
+    - Plot, per arbitration policy and dataflow:
         - speedUp plot.
         - absolute average clock cycles plot.
         - Utilization plot.
         - Utilization Improvement plot.
-    - if more results gathered per experiment, average over them, and then add to plot.
+    - if more results gathered per experiment, they are averaged.
+    - if the sweep ran several arbitration policies, report them side by side (see report_arbitration_policies), per dataflow.
+    - if the sweep ran several dataflows, report them side by side (see report_dataflows).
 
     :param workdir: work directory
     :return:
@@ -138,119 +293,117 @@ def plot_speedup_and_util_improvement_graph(workdir):
         print("[ERROR] - Can't Change Directory To " + workdir)
         exit(10)
 
-    configExp = dict()
-    try:
-        configExp = np.load('ExpConfigFile.npy')
-    except IOError:
-        print("[ERROR] - Configuration Doe's not exist")
-        exit(11)
-
-    dirList    = [d for d in os.listdir('.') if os.path.isdir(os.path.join('.' , d))]
-    sparsities = []
-
-    avg_clock_per_matrix_per_thread_per_sparsity  = list()
-    total_avg_utilization_per_thread_per_sparsity = list()
-
-    for d in dirList:
-
-        sparsity_thread_regex = re.match('^MTSA_.*SA_BUFF.*WEST_.*NORTH_(.*)SPARS_{}THREAD$'.format(sorted(configExp.item().get('threads'))[0]) , d)
-
-        if sparsity_thread_regex:
-
-            sparsities.append(float(sparsity_thread_regex.group(1).replace('_', '.')))
-
-            print('[INFO] - read from: ' + d)
-            print('-------------------------------------------------------------------------------')
-            try:
-                os.chdir(d)
-
-            except OSError:
-                print("[ERROR] - Can't Change Directory To " + d)
-                exit(12)
-
-            summary_over_thread_per_sparsity_sample(avg_clock_per_matrix_per_thread_per_sparsity=avg_clock_per_matrix_per_thread_per_sparsity,
-                                                    total_avg_utilization_per_thread_per_sparsity=total_avg_utilization_per_thread_per_sparsity)
-
-            os.chdir('..')
-
-    avg_clock_per_matrix_per_thread_per_sparsity_for_plot  = np.asarray(avg_clock_per_matrix_per_thread_per_sparsity)
-    avg_clock_per_matrix_per_thread_per_sparsity_for_plot = \
-        avg_clock_per_matrix_per_thread_per_sparsity_for_plot.reshape(1, len(avg_clock_per_matrix_per_thread_per_sparsity_for_plot))
-
-    total_avg_utilization_per_thread_per_sparsity_for_plot = np.asarray(total_avg_utilization_per_thread_per_sparsity)
-    total_avg_utilization_per_thread_per_sparsity_for_plot = \
-        total_avg_utilization_per_thread_per_sparsity_for_plot.reshape(1, len(total_avg_utilization_per_thread_per_sparsity_for_plot))
-
-    for t in sorted(configExp.item().get('threads'))[1:]:
+    with ResultsStore('.') as store:
 
-        avg_clock_per_matrix_per_thread_per_sparsity = list()
-        total_avg_utilization_per_thread_per_sparsity = list()
+        if not len(store) and not store.import_summaries('.'):
+            print("[ERROR] - No results in " + workdir)
+            exit(11)
 
-        for d in dirList:
+        variants  = [(group['dataflow'], group['arbitration'])
+                     for group in store.aggregate(group_by=('dataflow', 'arbitration'), values=('avg_clock_per_matrix',))]
+        dataflows = sorted({dataflow for dataflow, _ in variants}, key=DATAFLOWS.index)
+        policies  = sorted({policy for _, policy in variants}, key=ARBITRATION_POLICIES.index)
 
-            sparsity_thread_regex = re.match('^MTSA_(.*)SA_BUFF.*WEST_(.*)NORTH_(.*)SPARS_{}THREAD$'.format(t), d)
+        pivots = dict()
+        for dataflow, policy in variants:
+            threads, sparsities, avg_clock_per_matrix_per_thread_per_sparsity = \
+                store.pivot('avg_clock_per_matrix', rows='thread_number', columns='sparsity', arbitration=policy, dataflow=dataflow)
+            _, _, total_avg_utilization_per_thread_per_sparsity = \
+                store.pivot('total_avg_utilization', rows='thread_number', columns='sparsity', arbitration=policy, dataflow=dataflow)
 
-            if not sparsity_thread_regex:
-                continue
+            # Plots are named after what the sweep varies - a single policy, output-stationary sweep keeps its plot names.
+            variant = '_'.join(([dataflow] if len(dataflows) > 1 else []) + ([policy] if len(policies) > 1 else [])) or None
+            pivots[variant] = threads, sparsities, avg_clock_per_matrix_per_thread_per_sparsity, total_avg_utilization_per_thread_per_sparsity
 
-            elif sparsity_thread_regex:
-                print('[INFO] - read from: ' + d)
-                print('-------------------------------------------------------------------------------')
-                try:
-                    os.chdir(d)
+        if len(policies) > 1:
+            for dataflow in dataflows:
+                report_arbitration_policies(store, dataflow=dataflow)
+        if len(dataflows) > 1:
+            report_dataflows(store)
 
-                except OSError:
-                    print("[ERROR] - Can't Change Directory To " + d)
-                    exit(12)
+    for variant, (threads, sparsities, avg_clock_per_matrix_per_thread_per_sparsity, total_avg_utilization_per_thread_per_sparsity) in pivots.items():
 
-            summary_over_thread_per_sparsity_sample(avg_clock_per_matrix_per_thread_per_sparsity=avg_clock_per_matrix_per_thread_per_sparsity ,
-                                                    total_avg_utilization_per_thread_per_sparsity=total_avg_utilization_per_thread_per_sparsity)
-            os.chdir('..')
+        plot_speedup(Y=avg_clock_per_matrix_per_thread_per_sparsity,  x=sparsities,  mode='speedup',                 threads=threads, mode2='sparsity', variant=variant)
+        plot_speedup(Y=avg_clock_per_matrix_per_thread_per_sparsity,  x=sparsities,  mode='clock',                   threads=threads, mode2='sparsity', variant=variant)
+        plot_speedup(Y=total_avg_utilization_per_thread_per_sparsity, x=sparsities,  mode='utilization_improvement', threads=threads, mode2='sparsity', variant=variant)
+        plot_speedup(Y=total_avg_utilization_per_thread_per_sparsity, x=sparsities,  mode='utilization',             threads=threads, mode2='sparsity', variant=variant)
 
-        v1 = np.asarray(avg_clock_per_matrix_per_thread_per_sparsity)
-        v2 = np.asarray(total_avg_utilization_per_thread_per_sparsity)
 
-        v1 = v1.reshape(1, len(v1))
-        v2 = v2.reshape(1, len(v2))
-
-        avg_clock_per_matrix_per_thread_per_sparsity_for_plot  = np.concatenate((avg_clock_per_matrix_per_thread_per_sparsity_for_plot,  v1), axis=0)
-        total_avg_utilization_per_thread_per_sparsity_for_plot = np.concatenate((total_avg_utilization_per_thread_per_sparsity_for_plot, v2), axis=0)
-
-        del v1, v2
-
-    plot_speedup(Y=avg_clock_per_matrix_per_thread_per_sparsity_for_plot,  x=sparsities,  mode='speedup',                 threads=sorted(configExp.item().get('threads')), mode2='sparsity')
-    plot_speedup(Y=avg_clock_per_matrix_per_thread_per_sparsity_for_plot,  x=sparsities,  mode='clock',                   threads=sorted(configExp.item().get('threads')), mode2='sparsity')
-    plot_speedup(Y=total_avg_utilization_per_thread_per_sparsity_for_plot, x=sparsities,  mode='utilization_improvement', threads=sorted(configExp.item().get('threads')), mode2='sparsity')
-    plot_speedup(Y=total_avg_utilization_per_thread_per_sparsity_for_plot, x=sparsities,  mode='utilization',             threads=sorted(configExp.item().get('threads')), mode2='sparsity')
-
-
-def summary_over_thread_per_sparsity_sample(avg_clock_per_matrix_per_thread_per_sparsity, total_avg_utilization_per_thread_per_sparsity):
-
-    summaryList = [f for f in os.listdir('.') if (os.path.isfile(os.path.join('.' , f)) and re.match('^Summary.*.npy$' , f))]
-
-    tmp_avg_clock_per_matrix = 0
-    tmp_total_avg_utilization = 0
-
-    for f in summaryList:
-        summary = np.load(f)
-
-        tmp_avg_clock_per_matrix += summary.item().get('avg_clock_per_matrix')
-        tmp_total_avg_utilization += summary.item().get('total_avg_utilization')
-
-    tmp_avg_clock_per_matrix /= len(summaryList)
-    tmp_total_avg_utilization /= len(summaryList)
-
-    avg_clock_per_matrix_per_thread_per_sparsity.append(tmp_avg_clock_per_matrix)
-    total_avg_utilization_per_thread_per_sparsity.append(tmp_total_avg_utilization)
-
-    return avg_clock_per_matrix_per_thread_per_sparsity, total_avg_utilization_per_thread_per_sparsity
-
-
-def plot_speedup(Y, x, mode, threads, mode2):
+def report_arbitration_policies(store, **config):
+    """
+    Print speedup and utilization of every arbitration policy in the results store, per threads number, averaged over sparsities:
+    speedup over the fewest threads of the same policy, speedup over round-robin with the same threads, and utilization.
+    Speedups are averaged over the sparsities both sides ran.
+    Runs are filtered by configuration columns given as keyword arguments, e.g. dataflow='weight' (see ResultsStore.query).
+    :return: dictionary of policy to list of (threads, speedup over fewest threads, speedup over round-robin, utilization)
+    """
+    groups = {(group['arbitration'], group['thread_number'], group['sparsity']): group
+              for group in store.aggregate(group_by=('arbitration', 'thread_number', 'sparsity'), **config)}
+
+    def speedup(base, keys):
+        ratios = [groups[base + key[2:]]['avg_clock_per_matrix'] / groups[key]['avg_clock_per_matrix']
+                  for key in keys if base + key[2:] in groups and groups[key]['avg_clock_per_matrix']]
+        return np.mean(ratios) if ratios else np.nan
+
+    report = dict()
+    print('[INFO] - Arbitration Policies{}, Averaged Over Sparsities:'.format(
+        ''.join(', {} {}'.format(column, value) for column, value in sorted(config.items()))))
+    print('\t{:<20} {:>8} {:>18} {:>18} {:>12}'.format('Policy', 'Threads', 'Speedup/Fewest', 'Speedup/RoundRobin', 'Utilization'))
+    for policy in [policy for policy in ARBITRATION_POLICIES if any(key[0] == policy for key in groups)]:
+        threads = sorted({key[1] for key in groups if key[0] == policy})
+        report[policy] = []
+        for t in threads:
+            keys = [key for key in groups if key[:2] == (policy, t)]
+            row  = (t,
+                    speedup((policy, threads[0]), keys),
+                    speedup(('round_robin', t), keys),
+                    np.mean([groups[key]['total_avg_utilization'] for key in keys]))
+            report[policy].append(row)
+            print('\t{:<20} {:>8} {:>18.3f} {:>18.3f} {:>12.3f}'.format(policy, *row))
+
+    return report
+
+
+def report_dataflows(store):
+    """
+    Print cycles and utilization of every dataflow in the results store, per arbitration policy and threads number,
+    averaged over sparsities: clock cycles per matrix, speedup over output-stationary with the same policy and threads,
+    and utilization. Dataflows of a sweep run jobs of the same size (see Utilities.dataflow_shapes) and sparsity.
+    Speedups are averaged over the sparsities both sides ran.
+    :return: dictionary of dataflow to list of (policy, threads, clock per matrix, speedup over output-stationary, utilization)
+    """
+    groups = {(group['dataflow'], group['arbitration'], group['thread_number'], group['sparsity']): group
+              for group in store.aggregate(group_by=('dataflow', 'arbitration', 'thread_number', 'sparsity'))}
+
+    report = dict()
+    print('[INFO] - Dataflows, Averaged Over Sparsities:')
+    print('\t{:<10} {:<20} {:>8} {:>14} {:>16} {:>12}'.format('Dataflow', 'Policy', 'Threads', 'Clock/Matrix', 'Speedup/Output', 'Utilization'))
+    for dataflow in [dataflow for dataflow in DATAFLOWS if any(key[0] == dataflow for key in groups)]:
+        report[dataflow] = []
+        runs = sorted({key[1:3] for key in groups if key[0] == dataflow}, key=lambda run: (ARBITRATION_POLICIES.index(run[0]), run[1]))
+        for policy, t in runs:
+            keys   = [key for key in groups if key[:3] == (dataflow, policy, t)]
+            ratios = [groups[('output',) + key[1:]]['avg_clock_per_matrix'] / groups[key]['avg_clock_per_matrix']
+                      for key in keys if ('output',) + key[1:] in groups and groups[key]['avg_clock_per_matrix']]
+            row    = (policy,
+                      t,
+                      np.mean([groups[key]['avg_clock_per_matrix'] for key in keys]),
+                      np.mean(ratios) if ratios else np.nan,
+                      np.mean([groups[key]['total_avg_utilization'] for key in keys]))
+            report[dataflow].append(row)
+            print('\t{:<10} {:<20} {:>8} {:>14.1f} {:>16.3f} {:>12.3f}'.format(dataflow, *row))
+
+    return report
+
+
+def plot_speedup(Y, x, mode, threads, mode2, variant=None):
 
     f, ax = plt.subplots(figsize=(16, 16))
 
     title = '_'.join(os.getcwd().split('\\')[-1].split('_')[:5])
+    if variant is not None:
+        title += '_' + variant.upper()
+    suffix = '' if variant is None else '_' + variant
 
     if mode == 'speedup':
         normalized_Y = 1 / np.divide(Y, Y[0])
@@ -260,7 +413,7 @@ def plot_speedup(Y, x, mode, threads, mode2):
 
         data2text = np.asarray(x).reshape(1, len(x))
         data2text = np.concatenate((data2text, normalized_Y), axis=0)
-        np.savetxt('data_speedup', data2text)
+        np.savetxt('data_speedup' + suffix, data2text)
 
     elif mode == 'utilization_improvement':
         normalized_Y = np.divide(Y, Y[0])
@@ -270,7 +423,7 @@ def plot_speedup(Y, x, mode, threads, mode2):
 
         data2text = np.asarray(x).reshape(1 , len(x))
         data2text = np.concatenate((data2text , normalized_Y) , axis=0)
-        np.savetxt('data_utilization_improvement' , data2text)
+        np.savetxt('data_utilization_improvement' + suffix , data2text)
 
     elif mode == 'clock':
         normalized_Y = Y
@@ -280,7 +433,7 @@ def plot_speedup(Y, x, mode, threads, mode2):
 
         data2text = np.asarray(x).reshape(1 , len(x))
         data2text = np.concatenate((data2text , normalized_Y) , axis=0)
-        np.savetxt('data_clock' , data2text)
+        np.savetxt('data_clock' + suffix , data2text)
 
     elif mode == 'utilization':
         normalized_Y = Y
@@ -290,7 +443,7 @@ def plot_speedup(Y, x, mode, threads, mode2):
 
         data2text = np.asarray(x).reshape(1 , len(x))
         data2text = np.concatenate((data2text , normalized_Y) , axis=0)
-        np.savetxt('data_utilization' , data2text)
+        np.savetxt('data_utilization' + suffix , data2text)
     else:
         normalized_Y = Y
 
@@ -323,6 +476,6 @@ def plot_speedup(Y, x, mode, threads, mode2):
 
 
 if __name__ == '__main__':
-    generate_multiple_runs()
+    generate_multiple_runs(processes=os.cpu_count())
     #plot_speedup_and_util_improvement_graph(workdir='MTSA_8X8SA_BUFFLIM2_8X1600WEST_1600X8NORTH_1_2_4_8_16THREADS')
 
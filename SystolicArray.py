@@ -1,47 +1,104 @@
-from PE        import PE, PElimited
+from PE        import PE, PElimited, StationaryPE
 from BUFFER    import BUFFER, OUTPUT, FIFO, BUFFERlimited
-from Utilities import pack_FIFOs, unpack_BUFFERs
+from Utilities import pack_FIFOs, reload_FIFOs, unpack_BUFFERs, dataflow_streams, array_shape, DATAFLOWS
+from VectorizedEngine import VectorizedEngine
+from ParallelEngine import ParallelEngine
+from SparseEngine import SparseEngine
+from Telemetry  import Telemetry, TELEMETRY_LEVELS
+from TraceRecorder import TraceRecorder, CLOCK
+from Profiler   import Profiler
+from Arbitration import Arbiter, check_policy
 import numpy as np
+import time
 import logging
 
 SystolicArrayLogger = logging.getLogger('SystolicArrayLogger')
 
+# Version of the simulated behavior - cycles, results and telemetry, on every engine.
+# Bump it on any change: it keys cached run summaries (see ResultCache).
+ENGINE_VERSION = 1
+
 
 class SystolicArray:
     """
     Systolic Array Class.
     """
 
-    def __init__(self, west_matrices, north_matrices, array_size, thread_count, buffer_depth, log):
+    def __init__(self, west_matrices, north_matrices, array_size, thread_count, buffer_depth, log, engine='object', telemetry='full', trace=None, profile=False, workers=None,
+                 arbitration='round_robin', dataflow='output'):
         """
         Construct SystolicArray object.
         SystolicArray is the heart of our system.
         It consist of an array of PE's - atomic logic elements to multiply and add 2 scalars.
         Intermediate results stored in logical buffer between each PE.
+        array_size is the PE grid: an int for a square array, or a (rows, columns) pair (see Utilities.array_shape).
+        engine selects the clock implementation:
+            'object'     - array of PE / BUFFER objects, each PE tock'ed on its own.
+            'vectorized' - VectorizedEngine, the whole array state in NumPy arrays. Same cycles, utilization and results -
+                           faster than 'object' from about 16x16 PE's only (see VectorizedEngine).
+            'parallel'   - ParallelEngine, row bands of the object engine in <workers> processes (None for one per CPU).
+                           Same cycles, utilization, results and telemetry - for large arrays. Not traced, and can't be snapshotted.
+            'sparse'     - SparseEngine, zero runs skipped in bulk, for unlimited buffers only.
+                           Same cycles, utilization, results and telemetry - for highly sparse inputs. Not traced.
+        telemetry selects what is recorded besides utilization, one of TELEMETRY_LEVELS (see Telemetry):
+            'off', 'summary' (occupancy mean/std/max), 'histogram' (plus occupancy histograms), 'full' (per cycle traces).
+        arbitration selects which thread of a PE gets the MAC when several could, on every engine (see Arbitration.Arbiter):
+            'round_robin' (default), 'oldest_first', 'longest_queue_first' or 'lookahead_nonzero'.
+        dataflow selects the operand that stays in the PE's, one of DATAFLOWS (see Utilities.dataflow_streams):
+            'output' - results accumulate in the PE's (default). west_matrices @ north_matrices, with
+                       (threads, rows, length) west and (threads, length, columns) north matrices.
+            'weight' - north_matrices (threads, rows, columns) stay in the PE's (StationaryPE),
+                       west_matrices (threads, length, rows) stream in, results drain out of the south edge.
+            'input'  - west_matrices (threads, rows, columns) stay in the PE's,
+                       north_matrices (threads, columns, length) stream in, results drain out of the east edge.
+            Results are west_matrices @ north_matrices in every dataflow. Object and vectorized engines only.
+        trace is the TraceRecorder that tick(log=True) records object engine events into.
+        If None, an in-memory one is created on the first logged tick. Use trace.replay() for the human-readable log.
+        profile times construction, tick phases, isDone and summarize into a Profiler (see profile_report).
+        Use reset to run further jobs on the same array.
         """
 
-        if west_matrices.shape[0] != north_matrices.shape[0]:
-            SystolicArrayLogger.critical("Threads number isn't equal in west matrix and north matrix")
-            raise ValueError("Threads number isn't equal in west matrix and north matrix")
-        if array_size != west_matrices.shape[1] or array_size != north_matrices.shape[2]:
-            SystolicArrayLogger.critical("Systolic array size can't be different them matrices edges.")
-            raise ValueError("Systolic array size can't be different them matrices edges.")
-        if thread_count != west_matrices.shape[0]:
-            SystolicArrayLogger.critical("Threads number isn't equal to west matrix threads")
-            raise ValueError("Threads number isn't equal to west matrix threads")
-        if thread_count != north_matrices.shape[0]:
-            SystolicArrayLogger.critical("Threads number isn't equal to north matrix threads")
-            raise ValueError("Threads number isn't equal to north matrix threads")
         if buffer_depth == 0 or buffer_depth == 1:
             SystolicArrayLogger.critical("Buffer Size most be at least 2.")
             raise ValueError("Buffer Size most be at least 2.")
-        elif buffer_depth < 0:
+        rows, columns = array_shape(array_size)
+        if rows < 1 or columns < 1:
+            SystolicArrayLogger.critical("Systolic array most have at least one PE row and one PE column.")
+            raise ValueError("Systolic array most have at least one PE row and one PE column.")
+        if engine not in ('object', 'vectorized', 'parallel', 'sparse'):
+            SystolicArrayLogger.critical("Unknown engine: {}".format(engine))
+            raise ValueError("Unknown engine: {}".format(engine))
+        if telemetry not in TELEMETRY_LEVELS:
+            SystolicArrayLogger.critical("Unknown telemetry level: {}".format(telemetry))
+            raise ValueError("Unknown telemetry level: {}".format(telemetry))
+        check_policy(arbitration)
+        if dataflow not in DATAFLOWS:
+            SystolicArrayLogger.critical("Unknown dataflow: {}".format(dataflow))
+            raise ValueError("Unknown dataflow: {}".format(dataflow))
+        if dataflow != 'output' and engine in ('parallel', 'sparse'):
+            SystolicArrayLogger.critical("{} engine supports output-stationary dataflow only.".format(engine.capitalize()))
+            raise ValueError("{} engine supports output-stationary dataflow only.".format(engine.capitalize()))
+        if engine == 'sparse' and buffer_depth >= 0:
+            SystolicArrayLogger.critical("Sparse engine supports unlimited buffers only.")
+            raise ValueError("Sparse engine supports unlimited buffers only.")
+        if buffer_depth < 0:
             SystolicArrayLogger.debug("Unlimited Buffer Size")
         else:
             SystolicArrayLogger.debug("Limited Buffer Size: {}".format(buffer_depth))
 
+        self.profiler = Profiler() if profile else None
+        if self.profiler is not None:
+            start = time.perf_counter()
+
         self.array_size   = array_size
+        self.rows         = rows
+        self.columns      = columns
         self.thread_count = thread_count
+        self.buffer_depth = buffer_depth
+        self.arbitration  = arbitration
+        self.dataflow     = dataflow
+
+        self._check_inputs(west_matrices, north_matrices)
 
         if buffer_depth < 0:
             self.limited_buffer = False
@@ -52,164 +109,505 @@ class SystolicArray:
         self.horizontal_buffer_array = [] # Horizontal Buffers array
         self.vertical_buffer_array   = [] # Vertical Buffers array
 
-        self.clock = 1
-        SystolicArrayLogger.info("Clock: {}".format(self.clock))
-
-        # Inputs from the west
-        self.west_matrices        = west_matrices
-        self.west_matrices_shape  = west_matrices.shape
-        # Inputs from the north
-        self.north_matrices       = north_matrices
-        self.north_matrices_shape = north_matrices.shape
-
-        self.results            = np.zeros((thread_count, array_size, array_size))
-        self.utilization_per_pe = np.zeros((array_size, array_size))
+        self.trace = trace
+
+        self._load_inputs(west_matrices, north_matrices)
+
+        # MAC activity and buffers occupancy. A buffer thread can't hold more than its depth, or than the whole input.
+        self.telemetry = Telemetry(array_size=array_size,
+                                   thread_count=thread_count,
+                                   max_occupancy=self._max_occupancy(),
+                                   trim=2*self._fill_cycles(),
+                                   level=telemetry)
+
+        self.engine = None
+        if engine == 'vectorized':
+            # PE's and Buffers live inside the engine arrays - no objects to build or connect.
+            self.engine = VectorizedEngine(west_matrices=[self.west_streams],
+                                           north_matrices=[self.north_streams],
+                                           array_size=array_size,
+                                           buffer_depth=buffer_depth,
+                                           telemetry=self.telemetry,
+                                           log=log,
+                                           profiler=self.profiler,
+                                           arbitration=arbitration,
+                                           dataflow=dataflow,
+                                           stationary_matrices=None if self.stationary is None else [self.stationary])
+            if self.profiler is not None:
+                self.profiler.lap('construction', start)
+            return
+        if engine == 'parallel':
+            # PE's and Buffers live inside the worker processes.
+            self.engine = ParallelEngine(west_matrices=[west_matrices],
+                                         north_matrices=[north_matrices],
+                                         array_size=array_size,
+                                         buffer_depth=buffer_depth,
+                                         telemetry=self.telemetry,
+                                         log=log,
+                                         workers=workers,
+                                         profiler=self.profiler,
+                                         arbitration=arbitration)
+            if self.profiler is not None:
+                self.profiler.lap('construction', start)
+            return
+        if engine == 'sparse':
+            # The whole run is scheduled up front - tick replays it.
+            self.engine = SparseEngine(west_matrices=[west_matrices],
+                                       north_matrices=[north_matrices],
+                                       array_size=array_size,
+                                       telemetry=self.telemetry,
+                                       log=log,
+                                       profiler=self.profiler,
+                                       arbitration=arbitration)
+            if self.profiler is not None:
+                self.profiler.lap('construction', start)
+            return
 
         # Generate FIFO inputs objects. See docstring in pack_FIFOs function.
+        if self.profiler is not None:
+            mark = time.perf_counter()
         if log:
             SystolicArrayLogger.debug("West Input Matrices:\n"
                                       "--------------------------------------------------------------")
-        self.west_inputs  = pack_FIFOs(west_matrices, axis=0, thread_count=thread_count, log=log)
+        self.west_inputs  = pack_FIFOs(self.west_streams, axis=0, thread_count=thread_count, log=log)
 
         if log:
             SystolicArrayLogger.debug("North Input Matrices:\n"
                                       "---------------------------------------------------------------")
-        self.north_inputs = pack_FIFOs(north_matrices, axis=1, thread_count=thread_count, log=log)
-
-        self.east_outputs  = []
-        self.south_outputs = []
+        self.north_inputs = pack_FIFOs(self.north_streams, axis=1, thread_count=thread_count, log=log)
+        if self.profiler is not None:
+            self.profiler.lap('construction/pack_FIFOs', mark)
 
         # Generate PE's array.
         if log:
             SystolicArrayLogger.info('PE Array:\n'
                                      '---------------------------------------------------')
-        for pe_iindex in range(array_size):
-            self.pe_array.append([])
-
-            for pe_jindex in range(array_size):
+        pe_class = PElimited if self.limited_buffer else PE
+        # PE's keep their own inline round-robin - an Arbiter is only needed for the other policies.
+        arbiter  = None if arbitration == 'round_robin' else Arbiter(arbitration)
 
-                if not self.limited_buffer:
-                    self.pe_array[-1].append(PE(i=pe_iindex, j=pe_jindex, thread_count=thread_count, matrix_size=array_size, log=log))
-
-                else:
-                    self.pe_array[-1].append(PElimited(i=pe_iindex, j=pe_jindex, thread_count=thread_count, matrix_size=array_size, log=log))
+        if self.stationary is None:
+            self.pe_array = [[pe_class(i=i, j=j, thread_count=thread_count, matrix_size=array_size, telemetry=self.telemetry, log=log, arbiter=arbiter)
+                              for j in range(columns)] for i in range(rows)]
+        else:
+            self.pe_array = [[StationaryPE(i=i, j=j, thread_count=thread_count, matrix_size=array_size, telemetry=self.telemetry, log=log,
+                                           stationary=list(self.stationary[:, i, j]), dataflow=dataflow, limited=self.limited_buffer, arbiter=arbiter)
+                              for j in range(columns)] for i in range(rows)]
+
+        # Different types of buffers for limited and unlimited buffers
+        if self.limited_buffer:
+            def new_buffer(i, j):
+                return BUFFERlimited(thread_count=thread_count, depth=buffer_depth, iindex=i, jindex=j, log=log)
+        else:
+            def new_buffer(i, j):
+                return BUFFER(thread_count=thread_count, iindex=i, jindex=j, log=log)
 
-        # Generate horizontal Buffers array.
+        # Generate horizontal Buffers array: buffer <i,j> is east of PE <i,j>, OUTPUT's on the east edge.
         if log:
             SystolicArrayLogger.debug('Horizontal Buffers Array:\n'
                                       '-------------------------------------------------------------------')
-        for b_iindex in range(array_size):
-            self.horizontal_buffer_array.append([])
+        self.horizontal_buffer_array = [[new_buffer(i, j) for j in range(columns - 1)] +
+                                        [OUTPUT(thread_count=thread_count, iindex=i, jindex=columns - 1, log=log,
+                                                drain_length=self.west_streams.shape[2], on_drained=self._east_drained)]
+                                        for i in range(rows)]
+
+        # Generate vertical Buffers array: buffer <i,j> is south of PE <i,j>, OUTPUT's on the south edge.
+        if log:
+            SystolicArrayLogger.debug('Vertical Buffers Array:\n'
+                                      '-----------------------------------------------------------------')
+        self.vertical_buffer_array = [[new_buffer(i, j) for j in range(columns)] for i in range(rows - 1)]
+        self.vertical_buffer_array.append([OUTPUT(thread_count=thread_count, iindex=rows - 1, jindex=j, log=log,
+                                                  drain_length=self.north_streams.shape[1], on_drained=self._south_drained)
+                                           for j in range(columns)])
+
+        self.east_outputs  = [row[-1] for row in self.horizontal_buffer_array]
+        self.south_outputs = self.vertical_buffer_array[-1]
 
-            for b_jindex in range(array_size):
+        # Buffers with occupancy record, in Telemetry order.
+        self.recorded_buffers = [buffer
+                                 for i in range(rows - 1)
+                                 for j in range(columns - 1)
+                                 for buffer in (self.horizontal_buffer_array[i][j], self.vertical_buffer_array[i][j])]
 
-                if b_jindex != array_size - 1:
+        # Connect PE's to adjacent Buffers. West (north) edge PE's read the west (north) inputs, the others their neighbours outputs.
+        if log:
+            SystolicArrayLogger.debug("Connect PE's to Adjacent Buffers:\n"
+                                      "---------------------------------------------------------------------------")
+        for pe_iindex in range(rows):
 
-                    # Different types of buffers for limited and unlimited buffers
-                    if not self.limited_buffer:
-                        self.horizontal_buffer_array[-1].append(BUFFER(thread_count=thread_count, iindex=b_iindex, jindex=b_jindex, log=log))
+            for pe_jindex in range(columns):
 
-                    else:
-                        self.horizontal_buffer_array[-1].append(BUFFERlimited(thread_count=thread_count, depth=buffer_depth, iindex=b_iindex, jindex=b_jindex, log=log))
+                self.pe_array[pe_iindex][pe_jindex].connect(
+                    west_buffer=self.west_inputs[pe_iindex] if pe_jindex == 0 else self.horizontal_buffer_array[pe_iindex][pe_jindex - 1],
+                    north_buffer=self.north_inputs[pe_jindex] if pe_iindex == 0 else self.vertical_buffer_array[pe_iindex - 1][pe_jindex],
+                    east_buffer=self.horizontal_buffer_array[pe_iindex][pe_jindex],
+                    south_buffer=self.vertical_buffer_array[pe_iindex][pe_jindex], log=log)
 
-                else:
-                    self.horizontal_buffer_array[-1].append(OUTPUT(thread_count=thread_count, iindex=b_iindex, jindex=b_jindex, log=log))
-                    self.east_outputs.append(self.horizontal_buffer_array[-1][-1])
+        if self.profiler is not None:
+            self.profiler.lap('construction', start)
 
-        # Generate vertical Buffers array.
-        if log:
-            SystolicArrayLogger.debug('Vertical Buffers Array:\n'
-                                      '-----------------------------------------------------------------')
-        for b_iindex in range(array_size):
-            self.vertical_buffer_array.append([])
+    def _check_inputs(self, west_matrices, north_matrices):
 
-            for b_jindex in range(array_size):
+        if west_matrices.shape[0] != north_matrices.shape[0]:
+            SystolicArrayLogger.critical("Threads number isn't equal in west matrix and north matrix")
+            raise ValueError("Threads number isn't equal in west matrix and north matrix")
+        # Edges are checked on the streams the FIFO's are packed from - the same tensors for output-stationary dataflow.
+        west_streams, north_streams, _ = dataflow_streams(west_matrices, north_matrices, self.dataflow)
+        if self.rows != west_streams.shape[1] or self.columns != north_streams.shape[2]:
+            SystolicArrayLogger.critical("Systolic array size can't be different them matrices edges.")
+            raise ValueError("Systolic array size can't be different them matrices edges.")
+        if west_matrices.shape[2] != north_matrices.shape[1]:
+            SystolicArrayLogger.critical("West matrices columns and north matrices rows are different")
+            raise ValueError("West matrices columns and north matrices rows are different")
+        if self.thread_count != west_matrices.shape[0]:
+            SystolicArrayLogger.critical("Threads number isn't equal to west matrix threads")
+            raise ValueError("Threads number isn't equal to west matrix threads")
+        if self.thread_count != north_matrices.shape[0]:
+            SystolicArrayLogger.critical("Threads number isn't equal to north matrix threads")
+            raise ValueError("Threads number isn't equal to north matrix threads")
 
-                if b_iindex != array_size - 1:
+    def _load_inputs(self, west_matrices, north_matrices):
+        """
+        Bind input matrices, and start clock, results and completion tracking over.
+        """
+        self.clock = 1
+        self.idle  = False
+        SystolicArrayLogger.info("Clock: {}".format(self.clock))
+
+        # Inputs from the west
+        self.west_matrices        = west_matrices
+        self.west_matrices_shape  = west_matrices.shape
+        # Inputs from the north
+        self.north_matrices       = north_matrices
+        self.north_matrices_shape = north_matrices.shape
 
-                    if not self.limited_buffer:
-                        self.vertical_buffer_array[-1].append(BUFFER(thread_count=thread_count, iindex=b_iindex, jindex=b_jindex, log=log))
+        # What the FIFO's stream, and what the PE's hold - see dataflow_streams.
+        self.west_streams, self.north_streams, self.stationary = dataflow_streams(west_matrices, north_matrices, self.dataflow)
 
-                    else:
-                        self.vertical_buffer_array[-1].append(BUFFERlimited(thread_count=thread_count, depth=buffer_depth, iindex=b_iindex, jindex=b_jindex, log=log))
+        self.results            = np.zeros((self.thread_count, west_matrices.shape[1], north_matrices.shape[2]))
+        self.utilization_per_pe = np.zeros((self.rows, self.columns))
 
-                else:
-                    self.vertical_buffer_array[-1].append(OUTPUT(thread_count=thread_count, iindex=b_iindex, jindex=b_jindex, log=log))
-                    self.south_outputs.append(self.vertical_buffer_array[-1][-1])
+        # Completion tracking: number of OUTPUT buffer threads that didn't drain their whole input yet.
+        # All-zero input rows/columns are left out - an undrained OUTPUT thread compares as zeros, so they never held isDone back.
+        # Partial sums streams are all-zero, but they carry the results - always pending.
+        self.west_zero_rows     = ~self.west_streams.any(axis=2)  if self.dataflow != 'input'  else np.zeros(self.west_streams.shape[:2],  dtype=bool)
+        self.north_zero_columns = ~self.north_streams.any(axis=1) if self.dataflow != 'weight' else np.zeros((self.thread_count, self.north_streams.shape[2]), dtype=bool)
+        self.pending_outputs    = int(np.count_nonzero(~self.west_zero_rows) + np.count_nonzero(~self.north_zero_columns))
 
-        # Connect PE's to adjacent Buffers
-        if log:
-            SystolicArrayLogger.debug("Connect PE's to Adjacent Buffers:\n"
-                                      "---------------------------------------------------------------------------")
-        for pe_iindex in range(array_size):
-
-            for pe_jindex in range(array_size):
-
-                if pe_jindex == 0 and pe_iindex == 0:  # Top corner PE. Interact with west inputs and north inputs
-                    self.pe_array[0][0].connect(west_buffer=self.west_inputs[0],
-                                                north_buffer=self.north_inputs[0],
-                                                east_buffer=self.horizontal_buffer_array[0][0],
-                                                south_buffer=self.vertical_buffer_array[0][0], log=log)
-
-                elif pe_iindex == 0:  # West edge of PE's array. PE's interact with west inputs, and each other
-                    self.pe_array[0][pe_jindex].connect(west_buffer=self.horizontal_buffer_array[0][pe_jindex - 1],
-                                                        north_buffer=self.north_inputs[pe_jindex],
-                                                        east_buffer=self.horizontal_buffer_array[0][pe_jindex],
-                                                        south_buffer=self.vertical_buffer_array[0][pe_jindex], log=log)
-
-                elif pe_jindex == 0:  # North edge of PE's array. PE's interact with north inputs, and each other
-                    self.pe_array[pe_iindex][0].connect(west_buffer=self.west_inputs[pe_iindex],
-                                                        north_buffer=self.vertical_buffer_array[pe_iindex - 1][0],
-                                                        east_buffer=self.horizontal_buffer_array[pe_iindex][0],
-                                                        south_buffer=self.vertical_buffer_array[pe_iindex][0], log=log)
-
-                else:  # Inner PE's. Interact with each other.
-                    self.pe_array[pe_iindex][pe_jindex].connect(
-                        west_buffer=self.horizontal_buffer_array[pe_iindex][pe_jindex - 1],
-                        north_buffer=self.vertical_buffer_array[pe_iindex - 1][pe_jindex],
-                        east_buffer=self.horizontal_buffer_array[pe_iindex][pe_jindex],
-                        south_buffer=self.vertical_buffer_array[pe_iindex][pe_jindex], log=log)
+    def _fill_cycles(self):
+        """
+        Time for steady-state of the Systolic Array: operands take (<rows>-1) + (<columns>-1) cycles to reach the last PE.
+        """
+        return (self.rows - 1) + (self.columns - 1)
 
-    def tick(self, log):
+    def _max_occupancy(self):
+
+        return self.buffer_depth if self.limited_buffer else self.west_streams.shape[2]
+
+    def reset(self, west_matrices=None, north_matrices=None):
         """
-        Single shift of data in between PE's
+        Prepare the array for a new job without building it again: PE's, buffers, FIFO's and telemetry arrays are reused,
+        only registers, counters and buffer contents are cleared. Much cheaper than a new SystolicArray for batches of runs.
+        New matrices must fit the array size and thread count - the input length may change.
+        Without matrices, the current job is run again. A trace recorder keeps recording.
         :return: None
         """
-        self.clock += 1
+        if west_matrices is None:
+            west_matrices, north_matrices = self.west_matrices, self.north_matrices
+        self._check_inputs(west_matrices, north_matrices)
+
+        self._load_inputs(west_matrices, north_matrices)
+        self.telemetry.reset(max_occupancy=self._max_occupancy())
+
+        if self.engine is not None:
+            # Only the vectorized engine runs stationary dataflows - the others take the streamed tensors alone.
+            if self.stationary is None:
+                self.engine.reset([self.west_streams], [self.north_streams])
+            else:
+                self.engine.reset([self.west_streams], [self.north_streams], [self.stationary])
+            return
+
+        reload_FIFOs(self.west_inputs,  self.west_streams,  axis=0)
+        reload_FIFOs(self.north_inputs, self.north_streams, axis=1)
 
-        SystolicArrayLogger.info("Raising Edge Clock: {}".format(self.clock))
+        for east_output in self.east_outputs:
+            east_output.drain_length = self.west_streams.shape[2]
+        for south_output in self.south_outputs:
+            south_output.drain_length = self.north_streams.shape[1]
 
-        for pe_iindex in range(self.array_size):
+        for buffer_row in self.horizontal_buffer_array + self.vertical_buffer_array:
+            for buffer in buffer_row:
+                buffer.reset()
 
-            for pe_jindex in range(self.array_size):
+        for pe_row in self.pe_array:
+            for pe in pe_row:
+                pe.reset()
+                if self.stationary is not None:
+                    pe.stationary = list(self.stationary[:, pe.iindex, pe.jindex])
+
+    def _buffers(self):
+
+        return [buffer for buffer_row in self.horizontal_buffer_array + self.vertical_buffer_array for buffer in buffer_row]
+
+    def snapshot(self):
+        """
+        Full state of the run, as a dictionary of arrays: configuration, inputs, clock and completion counters, telemetry,
+        and PE accumulators, round-robin pointers and buffer contents - or the engine state.
+        Restore it with SystolicArray.restore (see Checkpoint for files). The trace recorder isn't part of it.
+        :raise ValueError: on the parallel engine - its state is spread over worker processes.
+        """
+        if isinstance(self.engine, ParallelEngine):
+            SystolicArrayLogger.critical("Parallel Engine Runs Can't Be Snapshotted")
+            raise ValueError("Parallel Engine Runs Can't Be Snapshotted")
+
+        state = {'engine_version':  np.array(ENGINE_VERSION),
+                 'array_size':      np.array(self.array_size),
+                 'thread_count':    np.array(self.thread_count),
+                 'buffer_depth':    np.array(self.buffer_depth),
+                 'arbitration':     np.array(self.arbitration),
+                 'dataflow':        np.array(self.dataflow),
+                 'engine':          np.array('object' if self.engine is None else 'sparse' if isinstance(self.engine, SparseEngine) else 'vectorized'),
+                 'telemetry':       np.array(self.telemetry.level),
+                 'west_matrices':   np.asarray(self.west_matrices),
+                 'north_matrices':  np.asarray(self.north_matrices),
+                 'clock':           np.array(self.clock),
+                 'idle':            np.array(self.idle),
+                 'pending_outputs': np.array(self.pending_outputs)}
+        state.update(('telemetry/' + name, value) for name, value in self.telemetry.state().items())
+
+        if self.engine is not None:
+            state.update(('engine/' + name, value) for name, value in self.engine.state().items())
+            return state
+
+        dtype = np.result_type(self.west_matrices, self.north_matrices)
+        pes   = [pe for pe_row in self.pe_array for pe in pe_row]
+
+        state['pe/result']    = np.array([pe.result for pe in pes], dtype=dtype)
+        state['pe/on_thread'] = np.array([pe.onThread for pe in pes], dtype=np.int64)
+        state['pe/waiting']   = np.array([pe.waiting for pe in pes], dtype=np.int64)
+        state['pe/pending']   = np.array([pe.pending for pe in pes], dtype=bool)
+        state['fifo/head']    = np.array([fifo.head for fifo in self.west_inputs + self.north_inputs], dtype=np.int64)
+
+        # Every buffer thread contents, top first, one after the other. Bubbles are stored as zeros and marked off.
+        contents = [buffer.values(t) for buffer in self._buffers() for t in range(self.thread_count)]
+        items    = [value for values in contents for value in values]
+
+        state['buffer/size']    = np.array([len(values) for values in contents], dtype=np.int64)
+        state['buffer/bubbles'] = np.array([value is None for value in items], dtype=bool)
+        state['buffer/values']  = np.array([0 if value is None else value for value in items], dtype=dtype)
+
+        return state
+
+    @classmethod
+    def restore(cls, state, log=False, trace=None, profile=False):
+        """
+        Build a SystolicArray from its snapshot. It carries on from the clock cycle the snapshot was taken on,
+        and its results, clock and telemetry end up bit-identical to an uninterrupted run.
+        :raise ValueError: if the snapshot was taken by another ENGINE_VERSION.
+        """
+        if int(state['engine_version']) != ENGINE_VERSION:
+            SystolicArrayLogger.critical("Snapshot Engine Version {} Isn't {}".format(int(state['engine_version']), ENGINE_VERSION))
+            raise ValueError("Snapshot Engine Version {} Isn't {}".format(int(state['engine_version']), ENGINE_VERSION))
+
+        systolic_array = cls(west_matrices=state['west_matrices'],
+                             north_matrices=state['north_matrices'],
+                             array_size=_array_size(state['array_size']),
+                             thread_count=int(state['thread_count']),
+                             buffer_depth=int(state['buffer_depth']),
+                             log=log,
+                             engine=str(state['engine']),
+                             telemetry=str(state['telemetry']),
+                             trace=trace,
+                             profile=profile,
+                             arbitration=str(state['arbitration']) if 'arbitration' in state else 'round_robin',
+                             dataflow=str(state['dataflow']) if 'dataflow' in state else 'output')
+
+        systolic_array.clock           = int(state['clock'])
+        systolic_array.idle            = bool(state['idle'])
+        systolic_array.pending_outputs = int(state['pending_outputs'])
+        systolic_array.telemetry.load_state(_section(state, 'telemetry/'))
+
+        if systolic_array.engine is not None:
+            systolic_array.engine.load_state(_section(state, 'engine/'))
+        else:
+            systolic_array._load_state(state)
+
+        SystolicArrayLogger.info("Restored On Clock {}".format(systolic_array.clock))
+        return systolic_array
+
+    def _load_state(self, state):
+        """
+        Object engine part of restore: PE registers, FIFO read pointers and buffer contents.
+        """
+        pes = [pe for pe_row in self.pe_array for pe in pe_row]
+        for pe, result, on_thread, pending in zip(pes, state['pe/result'], state['pe/on_thread'].tolist(), state['pe/pending'].tolist()):
+            # Accumulators stay NumPy scalars, as they are when MAC'ed from the input tensors.
+            pe.result   = list(result)
+            pe.onThread = on_thread
+            pe.pending  = pending
 
-                self.pe_array[pe_iindex][pe_jindex].tock(log=log)
+        # Snapshots taken before arbitration policies have no waiting counters - round-robin doesn't use them.
+        if 'pe/waiting' in state:
+            for pe, waiting in zip(pes, state['pe/waiting'].tolist()):
+                pe.waiting = waiting
 
-        for buffer_iindex in range(self.array_size - 1):
+        for fifo, head in zip(self.west_inputs + self.north_inputs, state['fifo/head'].tolist()):
+            fifo.head = head
+            fifo.size = [fifo.skew + len(thread) - read for thread, read in zip(fifo.streams, head)]
 
-            for buffer_jindex in range(self.array_size - 1):
-                # Update Buffer's effective depth, for statistics extraction later on.
-                self.horizontal_buffer_array[buffer_iindex][buffer_jindex].update_load()
-                self.vertical_buffer_array[buffer_iindex][buffer_jindex].update_load()
+        items = [None if bubble else value for value, bubble in zip(list(state['buffer/values']), state['buffer/bubbles'].tolist())]
+        ends  = np.cumsum(state['buffer/size']).tolist()
+
+        threads = ((buffer, t) for buffer in self._buffers() for t in range(self.thread_count))
+        for (buffer, t), start, end in zip(threads, [0] + ends[:-1], ends):
+            buffer.fill(t, items[start:end])
+
+    def tick(self, log):
+        """
+        Single shift of data in between PE's.
+        On the object engine, only PE's with pending work tock (see PE.pending), but the clock always advances one cycle per tick -
+        there is no bulk advance over cycles where the array only forwards bubbles. Bubbles only lead the skewed streams,
+        so such cycles come with real operands elsewhere in the array. The one stretch that changes nothing is an array
+        with no pending PE at all, which is logged as a warning once.
+        :return: None
+        """
+        self.clock += 1
+
+        profiler = self.profiler
+        if profiler is not None:
+            start = mark = time.perf_counter()
+
+        # Hot path logging goes to the trace recorder, which PE's and Buffers get as their 'log' argument.
+        if log:
+            if self.trace is None:
+                self.trace = TraceRecorder(array_size=self.array_size, thread_count=self.thread_count, limited=self.limited_buffer)
+            self.trace.cycle = self.clock
+            self.trace.record(CLOCK, -1, -1, -1, self.clock)
+            log = self.trace
+            if profiler is not None:
+                mark = profiler.lap('tick/trace', mark)
+
+        if self.engine is not None:
+            self.engine.tick()
+            if profiler is not None:
+                profiler.lap('tick', start)
+            return
+
+        row = self.telemetry.open_cycle()
+
+        # Event driven: PE's without pending work are skipped, their MAC is idle this cycle.
+        # Input buffers wake their consumer on push, and consumers always come later in row-major order,
+        # so a PE woken up by its west or north neighbour still tocks on the same cycle.
+        active = 0
+
+        for pe_iindex in range(self.rows):
+
+            for pe_jindex in range(self.columns):
+
+                pe = self.pe_array[pe_iindex][pe_jindex]
+
+                if pe.pending:
+                    pe.tock(log=log)
+                    active += 1
+
+        if profiler is not None:
+            mark = profiler.lap('tick/tock', mark)
+            profiler.count('PE tocks', active)
+            profiler.count('PE skips', self.rows * self.columns - active)
+
+        if not active and not self.idle:
+            # Nothing moves anymore - every following cycle is the same as this one.
+            SystolicArrayLogger.warning("All PE's Idle On Clock {}, Systolic Array State Won't Change Anymore".format(self.clock))
+        self.idle = not active
+
+        # Record Buffer's effective depth, for statistics extraction later on.
+        if self.recorded_buffers and self.telemetry.records_occupancy:
+            self.telemetry.occupancy[row, 0] = [buffer.occupancy for buffer in self.recorded_buffers]
+        if profiler is not None:
+            mark = profiler.lap('tick/occupancy', mark)
+
+        self.telemetry.close_cycle()
+        if profiler is not None:
+            profiler.lap('tick/close_cycle', mark)
+            profiler.lap('tick', start)
+
+    def _east_drained(self, buffer, threadID):
+        """
+        OUTPUT callback. East output of row <buffer.iindex> drained the whole west input of thread <threadID>.
+        """
+        if not self.west_zero_rows[threadID, buffer.iindex]:
+            self.pending_outputs -= 1
+
+    def _south_drained(self, buffer, threadID):
+        """
+        OUTPUT callback. South output of column <buffer.jindex> drained the whole north input of thread <threadID>.
+        """
+        if not self.north_zero_columns[threadID, buffer.jindex]:
+            self.pending_outputs -= 1
 
     def isDone(self):
         """
         Check if matrix multiplication finished.
-        Matrix multiplication finished if both west inputs and north inputs equals east outputs and south outputs
+        Matrix multiplication finished if all west inputs and north inputs were drained into east outputs and south outputs.
+        Drained operands are counted by the OUTPUT buffers as they arrive, so this check is O(1).
+        Use verify_outputs for a full content check at the end of the run.
         :return: boolean. True for finished. False otherwise.
         """
-        is_west_equal_east   = np.array_equal(self.west_matrices,  unpack_BUFFERs(buffer_list=self.east_outputs, axis=1,
-                                                                                  matrix_shape=self.west_matrices_shape))
-        is_north_equal_south = np.array_equal(self.north_matrices, unpack_BUFFERs(buffer_list=self.south_outputs, axis=0,
-                                                                                  matrix_shape=self.north_matrices_shape))
+        if self.profiler is not None:
+            start = time.perf_counter()
+
+        if self.engine is not None:
+            done = self.engine.is_done()
+        else:
+            done = self.pending_outputs == 0
+
+        if self.profiler is not None:
+            self.profiler.lap('isDone', start)
 
-        if is_west_equal_east and is_north_equal_south:
+        if done:
 
-            SystolicArrayLogger.info("East Output Buffers Equal To West Input Matrices, South Output Buffers Equal To North Inputs Matrices. Systolic Array Done.")
+            SystolicArrayLogger.info("East Output Buffers Drained West Input Matrices, South Output Buffers Drained North Inputs Matrices. Systolic Array Done.")
             return True
         else:
             return False
 
+    def _unpack_outputs(self):
+        """
+        :return: east and south output tensors, shaped as the west and north streams.
+        """
+        if self.engine is not None:
+            return self.engine.unpack_outputs()
+
+        east_outputs  = unpack_BUFFERs(buffer_list=self.east_outputs,  axis=1, matrix_shape=self.west_streams.shape)
+        south_outputs = unpack_BUFFERs(buffer_list=self.south_outputs, axis=0, matrix_shape=self.north_streams.shape)
+        return east_outputs, south_outputs
+
+    def verify_outputs(self):
+        """
+        Full content check: east outputs equal west inputs, and south outputs equal north inputs.
+        On stationary dataflows, the streamed operands are checked the same way, and drained partial sums against west @ north.
+        Costs O(threads * (rows + columns) * input length) - meant for the end of the run, not for every clock cycle.
+        :return: boolean. True if outputs equal inputs.
+        """
+        east_outputs, south_outputs = self._unpack_outputs()
+
+        if self.dataflow == 'weight':
+            north_streams = np.matmul(self.west_matrices, self.north_matrices)
+        else:
+            north_streams = self.north_streams
+        if self.dataflow == 'input':
+            west_streams = np.matmul(self.west_matrices, self.north_matrices)
+        else:
+            west_streams = self.west_streams
+
+        is_west_equal_east   = np.array_equal(west_streams,  east_outputs)
+        is_north_equal_south = np.array_equal(north_streams, south_outputs)
+
+        if not (is_west_equal_east and is_north_equal_south):
+            SystolicArrayLogger.error("Output Buffers Are Different Than Input Matrices")
+
+        return is_west_equal_east and is_north_equal_south
+
     def summarize(self):
         """
         Summarize results.
@@ -219,28 +617,43 @@ class SystolicArray:
         - calculate utilization per PE as the division result of total clock cycles by those on which each MAC worked.
         :return: None
         """
+        if self.profiler is not None:
+            start = time.perf_counter()
 
-        # Time for steady-state of the Systolic Array: (<array_size>-1 * 2).
+        # Time for steady-state of the Systolic Array: (<rows>-1) + (<columns>-1), see _fill_cycles.
         # Therefore, we reduce that number*2 from clock counting (time to fill the Systolic Array, and time to evacuate)
-        self.clock -= 2*((self.array_size-1)*2)
+        self.clock -= 2*self._fill_cycles()
 
-        # For the same reason, we delete from mac_utility list 2*(<array_size>-1) from the beginning,
-        # and 2*(<array_size>-1) from the end
-        for pe_iindex in range(self.array_size):
+        # For the same reason, telemetry drops 2*_fill_cycles() cycles of MAC activity from the beginning,
+        # and as many from the end (see Telemetry.kept_mac_count)
 
-            for pe_jindex in range(self.array_size):
+        if self.engine is not None:
+            self.results[:] = self.engine.results()
+        elif self.dataflow != 'output':
+            # Results drained out of the array as partial sums.
+            east_outputs, south_outputs = self._unpack_outputs()
+            self.results[:] = south_outputs if self.dataflow == 'weight' else east_outputs
+        else:
+            for pe_iindex in range(self.rows):
 
-                self.pe_array[pe_iindex][pe_jindex].mac_utility = self.pe_array[pe_iindex][pe_jindex].mac_utility[2*((self.array_size-1)*2):]
+                for pe_jindex in range(self.columns):
 
-                self.pe_array[pe_iindex][pe_jindex].mac_utility = self.pe_array[pe_iindex][pe_jindex].mac_utility[:-2*((self.array_size - 1)*2)]
+                    self.results[:, pe_iindex, pe_jindex] = self.pe_array[pe_iindex][pe_jindex].result
 
-        for pe_iindex in range(self.array_size):
+        self.utilization_per_pe = self.telemetry.kept_mac_count() / self.clock
 
-            for pe_jindex in range(self.array_size):
+        if self.profiler is not None:
+            self.profiler.lap('summarize', start)
 
-                self.results[:, pe_iindex, pe_jindex] = self.pe_array[pe_iindex][pe_jindex].result
+        self._log_summary()
 
-                self.utilization_per_pe[pe_iindex][pe_jindex] = self.pe_array[pe_iindex][pe_jindex].mac_utility.count(1) / self.clock
+    def profile_report(self):
+        """
+        :return: Profiler.report() of the run so far, or None if profiling is off.
+        """
+        return None if self.profiler is None else self.profiler.report()
+
+    def _log_summary(self):
 
         SystolicArrayLogger.info("Final Clock: {}".format(self.clock))
         SystolicArrayLogger.info("Clock Cycles Per Matrix On Average: {}".format(self.clock / self.thread_count))
@@ -248,6 +661,34 @@ class SystolicArray:
         SystolicArrayLogger.info("Average, Std Utilization Per PE For Systolic Array: {}, {}".format(self.utilization_per_pe.mean(), self.utilization_per_pe.std()))
         SystolicArrayLogger.info("\n\nResults:\n{}".format(self.results))
 
+    def load_records(self):
+        """
+        Gather load logger of every recorded buffer. Recorded on 'full' telemetry level only.
+        :return: dictionary. key: (iindex, jindex, 'H'/'V'), value: buffer load logger (list of loads per thread).
+        """
+        return self.telemetry.load_records()
+
+    def occupancy_statistics(self):
+        """
+        Occupancy statistics of every recorded buffer. See Telemetry.occupancy_statistics.
+        :return: dictionary. key: (iindex, jindex, 'H'/'V'), value: dictionary of statistic name to list per thread.
+        """
+        return self.telemetry.occupancy_statistics()
+
+
+def _section(state, prefix):
+    """
+    Snapshot entries under <prefix>, without it.
+    """
+    return {name[len(prefix):]: value for name, value in state.items() if name.startswith(prefix)}
+
+
+def _array_size(value):
+    """
+    array_size of a snapshot: an int for square arrays, a (rows, columns) tuple for rectangular ones.
+    """
+    return int(value) if value.ndim == 0 else tuple(value.tolist())
+
 
 if __name__ == '__main__':
     pass
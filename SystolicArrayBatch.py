@@ -0,0 +1,176 @@
+from VectorizedEngine import VectorizedEngine
+from Telemetry import Telemetry, TELEMETRY_LEVELS
+from Utilities import dataflow_streams, array_shape, DATAFLOWS
+import numpy as np
+import logging
+
+SystolicArrayBatchLogger = logging.getLogger('SystolicArrayBatchLogger')
+
+
+class SystolicArrayBatch:
+    """
+    Batch of independent SystolicArray runs, simulated together.
+    """
+
+    def __init__(self, west_matrices, north_matrices, array_size, buffer_depth, log, telemetry='full', arbitration='round_robin', dataflow='output'):
+        """
+        Construct SystolicArrayBatch object.
+        Element b of the batch is a SystolicArray run of west_matrices[b] by north_matrices[b] - thread count and input length
+        may differ from element to element, array size - an int or a (rows, columns) pair - and buffer depth are shared.
+        A single VectorizedEngine advances all elements in lockstep, with a leading batch axis on all PE and buffer state,
+        so interpreter overhead is paid once per clock cycle for the whole batch.
+        Each element stops when its own outputs drained: its clock, results and telemetry are those of a SystolicArray
+        run on its own (vectorized engine, same telemetry level).
+        telemetry is one of TELEMETRY_LEVELS, see Telemetry.
+        arbitration is the thread arbitration policy shared by all elements, see Arbitration.
+        dataflow is the dataflow shared by all elements, one of DATAFLOWS - element matrices are shaped as SystolicArray takes them.
+        """
+        if dataflow not in DATAFLOWS:
+            SystolicArrayBatchLogger.critical("Unknown dataflow: {}".format(dataflow))
+            raise ValueError("Unknown dataflow: {}".format(dataflow))
+
+        rows, columns = array_shape(array_size)
+
+        # What the FIFO's stream, and what the PE's hold - see dataflow_streams.
+        streams = [dataflow_streams(west, north, dataflow) for west, north in zip(west_matrices, north_matrices)]
+
+        if len(west_matrices) != len(north_matrices):
+            SystolicArrayBatchLogger.critical("Batch size isn't equal in west matrices and north matrices")
+            raise ValueError("Batch size isn't equal in west matrices and north matrices")
+        if not len(west_matrices):
+            SystolicArrayBatchLogger.critical("Empty batch")
+            raise ValueError("Empty batch")
+        for west, north, (west_streams, north_streams, _) in zip(west_matrices, north_matrices, streams):
+            if west.shape[0] != north.shape[0]:
+                SystolicArrayBatchLogger.critical("Threads number isn't equal in west matrix and north matrix")
+                raise ValueError("Threads number isn't equal in west matrix and north matrix")
+            if rows != west_streams.shape[1] or columns != north_streams.shape[2]:
+                SystolicArrayBatchLogger.critical("Systolic array size can't be different them matrices edges.")
+                raise ValueError("Systolic array size can't be different them matrices edges.")
+            if west.shape[2] != north.shape[1]:
+                SystolicArrayBatchLogger.critical("West matrices columns and north matrices rows are different")
+                raise ValueError("West matrices columns and north matrices rows are different")
+        if buffer_depth == 0 or buffer_depth == 1:
+            SystolicArrayBatchLogger.critical("Buffer Size most be at least 2.")
+            raise ValueError("Buffer Size most be at least 2.")
+        if telemetry not in TELEMETRY_LEVELS:
+            SystolicArrayBatchLogger.critical("Unknown telemetry level: {}".format(telemetry))
+            raise ValueError("Unknown telemetry level: {}".format(telemetry))
+
+        self.array_size     = array_size
+        self.rows           = rows
+        self.columns        = columns
+        self.dataflow       = dataflow
+        self.batch_size     = len(west_matrices)
+        self.buffer_depth   = buffer_depth
+        self.limited_buffer = buffer_depth >= 0
+
+        self.west_matrices  = west_matrices
+        self.north_matrices = north_matrices
+        self.thread_counts  = [west.shape[0] for west in west_matrices]
+
+        # Per element clock and completion. Done elements are taken off the engine schedule.
+        self.clock = np.ones(self.batch_size, dtype=np.int64)
+        self.done  = np.zeros(self.batch_size, dtype=bool)
+
+        self.results            = [None] * self.batch_size
+        self.utilization_per_pe = [None] * self.batch_size
+
+        # A buffer thread can't hold more than its depth, or than the whole input of its element.
+        self.telemetry = Telemetry(array_size=array_size,
+                                   thread_count=max(self.thread_counts),
+                                   max_occupancy=buffer_depth if self.limited_buffer else np.array([west_streams.shape[2] for west_streams, _, _ in streams]),
+                                   trim=2*((rows-1)+(columns-1)),
+                                   level=telemetry,
+                                   batch_size=self.batch_size)
+
+        self.engine = VectorizedEngine(west_matrices=[west_streams for west_streams, _, _ in streams],
+                                       north_matrices=[north_streams for _, north_streams, _ in streams],
+                                       array_size=array_size,
+                                       buffer_depth=buffer_depth,
+                                       telemetry=self.telemetry,
+                                       log=log,
+                                       arbitration=arbitration,
+                                       dataflow=dataflow,
+                                       stationary_matrices=None if dataflow == 'output' else [stationary for _, _, stationary in streams])
+
+    def tick(self, log):
+        """
+        Single shift of data in between PE's, on every running element.
+        :return: None
+        """
+        self.clock[~self.done] += 1
+
+        self.engine.tick()
+
+        finished = np.flatnonzero(self.engine.done() & ~self.done)
+        if finished.size:
+            self.done[finished] = True
+            self.engine.stop(finished)
+
+            if log:
+                SystolicArrayBatchLogger.info("Elements {} Done On Clock {}".format(finished.tolist(), self.clock[finished[0]]))
+
+    def isDone(self):
+        """
+        :return: boolean. True once every element finished.
+        """
+        if self.done.all():
+
+            SystolicArrayBatchLogger.info("All {} Batch Elements Done.".format(self.batch_size))
+            return True
+        else:
+            return False
+
+    def verify_outputs(self, element):
+        """
+        SystolicArray.verify_outputs for <element>.
+        :return: boolean. True if outputs equal inputs.
+        """
+        east_outputs, south_outputs = self.engine.unpack_outputs(element)
+
+        west_streams, north_streams, _ = dataflow_streams(self.west_matrices[element], self.north_matrices[element], self.dataflow)
+        if self.dataflow == 'weight':
+            north_streams = np.matmul(self.west_matrices[element], self.north_matrices[element])
+        if self.dataflow == 'input':
+            west_streams = np.matmul(self.west_matrices[element], self.north_matrices[element])
+
+        is_west_equal_east   = np.array_equal(west_streams,  east_outputs)
+        is_north_equal_south = np.array_equal(north_streams, south_outputs)
+
+        if not (is_west_equal_east and is_north_equal_south):
+            SystolicArrayBatchLogger.error("Element {}: Output Buffers Are Different Than Input Matrices".format(element))
+
+        return is_west_equal_east and is_north_equal_south
+
+    def summarize(self):
+        """
+        SystolicArray.summarize for every element: trim fill and drain time off each clock,
+        copy results out of the engine, and calculate utilization per PE.
+        :return: None
+        """
+        self.clock -= 2*((self.rows-1)+(self.columns-1))
+
+        for element in range(self.batch_size):
+            self.results[element]            = self.engine.results(element).astype(np.float64)
+            self.utilization_per_pe[element] = self.telemetry.kept_mac_count(element) / self.clock[element]
+
+        SystolicArrayBatchLogger.info("Final Clocks: {}".format(self.clock.tolist()))
+
+    def load_records(self, element):
+        """
+        SystolicArray.load_records for <element>. Recorded on 'full' telemetry level only.
+        """
+        return self._own_threads(self.telemetry.load_records(element), element)
+
+    def occupancy_statistics(self, element):
+        """
+        SystolicArray.occupancy_statistics for <element>.
+        """
+        return {buffer: self._own_threads(statistics, element) for buffer, statistics in self.telemetry.occupancy_statistics(element).items()}
+
+    def _own_threads(self, records, element):
+        """
+        Drop padding threads from per thread lists - elements with fewer threads than the batch maximum have them.
+        """
+        return {key: value[:self.thread_counts[element]] for key, value in records.items()}
@@ -0,0 +1,304 @@
+import numpy as np
+import logging
+from Utilities import array_shape
+
+TelemetryLogger = logging.getLogger('TelemetryLogger')
+
+# Telemetry levels, from cheapest to richest:
+#   'off'       - MAC utilization only.
+#   'summary'   - plus running mean, std and max of every recorded buffer thread occupancy.
+#   'histogram' - plus a fixed-size occupancy histogram (and percentiles) per recorded buffer thread.
+#   'full'      - per clock cycle MAC activity and occupancy traces.
+TELEMETRY_LEVELS = ('off', 'summary', 'histogram', 'full')
+
+
+class Telemetry:
+    """
+    Central store for the per clock cycle telemetry of a SystolicArray run - or of a batch of runs (see SystolicArrayBatch).
+    Rows are NumPy arrays, one per clock cycle:
+    - mac:       (rows, elements, array rows, array columns) uint8. '1' if the MAC of PE <i,j> was enabled on that cycle, '0' otherwise.
+    - occupancy: (rows, elements, recorded buffers, threads) smallest unsigned int that fits the buffers depth.
+                 How many data items (not including bubbles) each thread of a recorded buffer holds at the end of the cycle.
+    Recorded buffers are horizontal and vertical buffers <i,j> with i < array rows-1 and j < array columns-1, in row-major order,
+    H before V.
+    A single run is element 0 of a batch of 1. Batch elements run in lockstep, each one until it is done:
+    cycles counts closed clock cycles, element_cycles the ones each element took part in.
+
+    On 'full' level rows are kept for the whole run, in preallocated arrays that double when a run outgrows them.
+    Below 'full', rows are a ring of lead+2 in-flight cycles (the vectorized engine runs up to lead cycles ahead, see __init__):
+    each cycle is folded into running statistics once closed, so memory doesn't grow with the cycle count.
+    """
+
+    def __init__(self, array_size, thread_count, max_occupancy, trim, level='full', histogram_bins=64, capacity=1024, batch_size=1):
+        """
+        :param array_size: PE grid, an int or a (rows, columns) pair - see Utilities.array_shape.
+        :param thread_count: threads per element - the most threads of any element in a batch.
+        :param max_occupancy: most data items a buffer thread can hold, a single value or one per element.
+                              Sets occupancy dtype and histogram size.
+        :param trim: cycles left out of MAC utilization at each end of the run (fill and drain time, see SystolicArray.summarize).
+        :param level: one of TELEMETRY_LEVELS.
+        :param histogram_bins: most histogram bins per buffer thread. The last bin counts every occupancy above it.
+        :param capacity: initial number of cycles to preallocate on 'full' level.
+        :param batch_size: number of batch elements.
+        """
+        if level not in TELEMETRY_LEVELS:
+            TelemetryLogger.critical("Unknown telemetry level: {}".format(level))
+            raise ValueError("Unknown telemetry level: {}".format(level))
+
+        self.array_size         = array_size
+        self.rows, self.columns = array_shape(array_size)
+        self.thread_count       = thread_count
+        self.batch_size         = batch_size
+        self.record_count       = 2 * (self.rows - 1) * (self.columns - 1)
+        self.trim               = trim
+        self.level              = level
+
+        # Whether recorded buffers occupancy is needed at all - engines skip recording it on 'off' level.
+        self.records_occupancy = level != 'off'
+
+        # Most cycles the last PE runs behind the first one: half the (rows-1) + (columns-1) steps between them.
+        self.lead = (self.rows + self.columns - 1) // 2
+
+        rows = capacity if level == 'full' else self.lead + 2
+
+        self.mac       = np.zeros((rows, batch_size, self.rows, self.columns), dtype=np.uint8)
+        self.occupancy = np.zeros((rows, batch_size, self.record_count, thread_count), dtype=np.min_scalar_type(np.max(max_occupancy)))
+
+        self.element_cycles = np.zeros(batch_size, dtype=np.int64)
+
+        # Running statistics, below 'full' level.
+        # MAC count per PE from cycle <trim> on, and MAC rows of the last <trim> cycles - taken off at the end.
+        self.mac_kept = np.zeros((batch_size, self.rows, self.columns), dtype=np.int64)
+        self.mac_tail = np.zeros((trim, batch_size, self.rows, self.columns), dtype=np.uint8)
+
+        self.occupancy_sum        = np.zeros((batch_size, self.record_count, thread_count), dtype=np.int64)
+        self.occupancy_square_sum = np.zeros((batch_size, self.record_count, thread_count), dtype=np.int64)
+        self.occupancy_max        = np.zeros((batch_size, self.record_count, thread_count), dtype=np.int64)
+
+        self.max_histogram_bins = histogram_bins
+        self.histogram_bins     = None
+
+        self.reset(max_occupancy)
+
+    def reset(self, max_occupancy):
+        """
+        Clear every record and statistic for a new run of the same array (see SystolicArray.reset).
+        Arrays are reused - on 'full' level with the capacity grown by earlier runs - unless <max_occupancy> changes their size.
+        """
+        self.mac.fill(0)
+
+        dtype = np.min_scalar_type(np.max(max_occupancy))
+        if dtype != self.occupancy.dtype:
+            self.occupancy = np.zeros(self.occupancy.shape, dtype=dtype)
+        else:
+            self.occupancy.fill(0)
+
+        # Number of closed clock cycles, and MAC row of the open cycle (PE.tock marks it).
+        self.cycles    = 0
+        self.mac_cycle = self.mac[0, 0]
+
+        for statistic in (self.element_cycles, self.mac_kept, self.mac_tail, self.occupancy_sum, self.occupancy_square_sum, self.occupancy_max):
+            statistic.fill(0)
+
+        # Histogram bins of each element. The histogram array has the most bins of all - other elements leave the top ones empty.
+        self.element_histogram_bins = np.minimum(np.broadcast_to(max_occupancy, (self.batch_size,)) + 1, self.max_histogram_bins)
+
+        histogram_bins = int(self.element_histogram_bins.max())
+        if histogram_bins != self.histogram_bins:
+            self.histogram_bins    = histogram_bins
+            self.histogram         = np.zeros((self.batch_size, self.record_count, self.thread_count, histogram_bins), dtype=np.int64)
+            self.histogram_offsets = np.arange(self.batch_size * self.record_count * self.thread_count).reshape(self.histogram.shape[:3]) * histogram_bins
+        else:
+            self.histogram.fill(0)
+
+    def state(self):
+        """
+        Every record and statistic, as a dictionary of arrays (see SystolicArray.snapshot).
+        On 'full' level, rows are cut right after the last cycle an engine may have written - see reserve.
+        """
+        rows = min(self.cycles + self.lead + 2, self.mac.shape[0]) if self.level == 'full' else self.mac.shape[0]
+
+        state = {'cycles': np.array(self.cycles), 'mac': self.mac[:rows], 'occupancy': self.occupancy[:rows], 'histogram': self.histogram}
+        for name in ('element_cycles', 'mac_kept', 'mac_tail', 'occupancy_sum', 'occupancy_square_sum', 'occupancy_max'):
+            state[name] = getattr(self, name)
+        return state
+
+    def load_state(self, state):
+        """
+        Restore records and statistics saved by state, into a store of the same configuration.
+        """
+        rows = state['mac'].shape[0]
+        self.reserve(rows)
+
+        self.cycles = int(state['cycles'])
+        self.mac[:rows]       = state['mac']
+        self.occupancy[:rows] = state['occupancy']
+        self.histogram[:]     = state['histogram']
+        for name in ('element_cycles', 'mac_kept', 'mac_tail', 'occupancy_sum', 'occupancy_square_sum', 'occupancy_max'):
+            getattr(self, name)[:] = state[name]
+
+    def record_index(self, i, j, direction):
+        """
+        Index of buffer <i,j> in occupancy recorded buffers axis.
+        """
+        return 2 * (i * (self.columns - 1) + j) + (0 if direction == 'H' else 1)
+
+    def row(self, cycle):
+        """
+        Row of clock cycle <cycle> (an integer or an array of them) in mac and occupancy.
+        """
+        if self.level == 'full':
+            return cycle
+        return cycle % self.mac.shape[0]
+
+    def reserve(self, cycles):
+        """
+        Make room for at least <cycles> rows. New rows are zeroed.
+        Below 'full' level the ring is fixed - callers never write further than lead+1 cycles ahead.
+        """
+        capacity = self.mac.shape[0]
+        if self.level != 'full' or cycles <= capacity:
+            return
+
+        while capacity < cycles:
+            capacity *= 2
+
+        self.mac       = np.concatenate((self.mac,       np.zeros((capacity - self.mac.shape[0],) + self.mac.shape[1:],             dtype=self.mac.dtype)))
+        self.occupancy = np.concatenate((self.occupancy, np.zeros((capacity - self.occupancy.shape[0],) + self.occupancy.shape[1:], dtype=self.occupancy.dtype)))
+
+        TelemetryLogger.debug("Telemetry Capacity Grew To {} Cycles".format(capacity))
+
+    def open_cycle(self):
+        """
+        Point mac_cycle at the row of the next clock cycle, for element 0.
+        :return: row of the opened cycle
+        """
+        self.reserve(self.cycles + 1)
+        row = self.row(self.cycles)
+        self.mac_cycle = self.mac[row, 0]
+        return row
+
+    def close_cycle(self, elements=None):
+        """
+        Clock cycle <cycles> is over for <elements> - index array of the elements still running, all of them if None.
+        Below 'full' level, fold its rows into their running statistics and clear them for reuse.
+        """
+        if elements is None:
+            elements = slice(None)
+
+        if self.level != 'full':
+            row = self.row(self.cycles)
+            mac = self.mac[row]
+
+            if self.trim:
+                if self.cycles >= self.trim:
+                    self.mac_kept[elements] += mac[elements]
+                self.mac_tail[self.cycles % self.trim, elements] = mac[elements]
+            mac[:] = 0
+
+            if self.records_occupancy:
+                occupancy = self.occupancy[row][elements]
+                self.occupancy_sum[elements]        += occupancy
+                self.occupancy_square_sum[elements] += occupancy.astype(np.int64) ** 2
+                self.occupancy_max[elements]         = np.maximum(self.occupancy_max[elements], occupancy)
+
+                if self.level == 'histogram':
+                    # Each buffer thread falls in exactly one bin, so a fancy-index increment doesn't collide.
+                    self.histogram.reshape(-1)[self.histogram_offsets[elements] + np.minimum(occupancy, self.histogram_bins - 1)] += 1
+
+                self.occupancy[row] = 0
+
+        self.element_cycles[elements] += 1
+        self.cycles += 1
+
+    def mac_activity(self, element=0):
+        """
+        :return: (cycles, rows, columns) view of the recorded MAC activity of <element>. 'full' level only.
+        """
+        if self.level != 'full':
+            raise ValueError("MAC activity trace is kept on 'full' telemetry level only")
+        return self.mac[:self.element_cycles[element], element]
+
+    def occupancy_trace(self, element=0):
+        """
+        :return: (cycles, recorded buffers, threads) view of the recorded buffers occupancy of <element>. 'full' level only.
+        """
+        if self.level != 'full':
+            raise ValueError("Occupancy trace is kept on 'full' telemetry level only")
+        return self.occupancy[:self.element_cycles[element], element]
+
+    def kept_mac_count(self, element=0):
+        """
+        :return: (rows, columns) MAC count per PE of <element>, without its first and last <trim> cycles.
+        """
+        if self.level == 'full':
+            return self.mac_activity(element)[self.trim:][:-self.trim].sum(axis=0)
+
+        # Same window as the slicing above: nothing is left when trim is 0 ([:-0] is empty) or the run is too short.
+        if not self.trim:
+            return np.zeros_like(self.mac_kept[element])
+        cycles = self.element_cycles[element]
+        kept   = self.mac_kept[element].copy()
+        for cycle in range(max(cycles - self.trim, self.trim), cycles):
+            kept -= self.mac_tail[cycle % self.trim, element]
+        return kept
+
+    def occupancy_statistics(self, element=0):
+        """
+        Recorded buffers occupancy statistics of <element>, per thread: mean, std and max,
+        plus histogram and p50/p90/p99 on 'histogram' and 'full' levels.
+        Percentiles are histogram bins - the last bin stands for itself and anything above it.
+        :return: dictionary. key: (i, j, 'H'/'V'), value: dictionary of statistic name to list per thread. Empty on 'off' level.
+        """
+        if self.level == 'off':
+            return dict()
+
+        cycles         = self.element_cycles[element]
+        histogram_bins = self.element_histogram_bins[element]
+
+        if self.level == 'full':
+            trace       = self.occupancy_trace(element).astype(np.int64)
+            total       = trace.sum(axis=0)
+            square_sum  = (trace ** 2).sum(axis=0)
+            maximum     = trace.max(axis=0) if cycles else np.zeros_like(total)
+            histogram   = np.zeros(total.shape + (histogram_bins,), dtype=np.int64)
+            bins        = np.arange(total.size).reshape(total.shape) * histogram_bins + np.minimum(trace, histogram_bins - 1)
+            histogram.reshape(-1)[:] = np.bincount(bins.reshape(-1), minlength=histogram.size)
+        else:
+            total, square_sum, maximum = self.occupancy_sum[element], self.occupancy_square_sum[element], self.occupancy_max[element]
+            histogram = self.histogram[element, :, :, :histogram_bins]
+
+        count = max(cycles, 1)
+        mean  = total / count
+        std   = np.sqrt(np.maximum(square_sum / count - mean ** 2, 0))
+
+        statistics = {'mean': mean, 'std': std, 'max': maximum}
+        if self.level != 'summary':
+            cumulative = histogram.cumsum(axis=2)
+            statistics['histogram'] = histogram
+            for name, quantile in (('p50', 0.5), ('p90', 0.9), ('p99', 0.99)):
+                statistics[name] = (cumulative >= quantile * cycles).argmax(axis=2)
+
+        records = dict()
+        for i in range(self.rows - 1):
+            for j in range(self.columns - 1):
+                for direction in ('H', 'V'):
+                    index = self.record_index(i, j, direction)
+                    records[(i, j, direction)] = {name: value[index].tolist() for name, value in statistics.items()}
+        return records
+
+    def load_records(self, element=0):
+        """
+        Buffers load history of <element>, as nested lists. Meant for saving a summary, not for analysis - use occupancy_trace for that.
+        :return: dictionary. key: (i, j, 'H'/'V'), value: list of loads per thread. Empty below 'full' level.
+        """
+        records = dict()
+        if self.level != 'full':
+            return records
+
+        trace = self.occupancy_trace(element)
+        for i in range(self.rows - 1):
+            for j in range(self.columns - 1):
+                for direction in ('H', 'V'):
+                    records[(i, j, direction)] = trace[:, self.record_index(i, j, direction), :].T.tolist()
+        return records
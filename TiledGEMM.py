@@ -0,0 +1,172 @@
+import time
+import logging
+import multiprocessing
+import numpy as np
+from SystolicArray import SystolicArray
+from Utilities import array_shape
+
+TiledGEMMLogger = logging.getLogger('TiledGEMMLogger')
+
+# One SystolicArray per configuration in each process, reset for every tile instead of built again (see SystolicArray.reset).
+# Parallel engine arrays hold worker processes and shared memory, so they aren't kept - each tile builds and closes its own.
+_tile_arrays = dict()
+
+
+def tile_jobs(M, N, K, array_size, k_tile=None):
+    """
+    Split an (M x K) @ (K x N) product into output-stationary tiles.
+    Each tile computes a rows x columns output block (see Utilities.array_shape) over a slice of the K axis -
+    the whole axis by default, or chunks of <k_tile> whose partial results are accumulated afterwards.
+    Tiles are independent of each other.
+    :return: list of (m0, n0, k0, k1) - output block origin and K slice.
+    """
+    rows, columns = array_shape(array_size)
+    k_tile = K if k_tile is None else k_tile
+    return [(m0, n0, k0, min(k0 + k_tile, K))
+            for m0 in range(0, M, rows)
+            for n0 in range(0, N, columns)
+            for k0 in range(0, K, k_tile)]
+
+
+def run_tile(west_tile, north_tile, array_size, buffer_depth, engine, telemetry):
+    """
+    Simulate a single tile. Tiles on the matrices edges are zero-padded up to the array rows and columns.
+    Tiles of the same configuration run on a single SystolicArray per process, reset between them
+    (except on the parallel engine, whose array is closed once the tile is over).
+    Tile utilization counts the whole run: fill and drain are real cycles once tiles are streamed one after the other,
+    and summarize() trims them away (short K slices may leave nothing at all). Every non-zero couple takes exactly one MAC,
+    so the MAC count per PE is the non-zero masks product.
+    :return: dictionary - results (threads, rows, columns), cycles (ticks run), macs and utilization per PE.
+    """
+    rows, columns = array_shape(array_size)
+    thread_count  = west_tile.shape[0]
+    west  = np.zeros((thread_count, rows, west_tile.shape[2]),     dtype=west_tile.dtype)
+    north = np.zeros((thread_count, north_tile.shape[1], columns), dtype=north_tile.dtype)
+    west[:, :west_tile.shape[1], :]   = west_tile
+    north[:, :, :north_tile.shape[2]] = north_tile
+
+    key = (rows, columns, thread_count, buffer_depth, engine, telemetry)
+    systolic_array = _tile_arrays.get(key)
+    if systolic_array is None:
+        systolic_array = SystolicArray(west_matrices=west,
+                                       north_matrices=north,
+                                       array_size=array_size,
+                                       thread_count=thread_count,
+                                       buffer_depth=buffer_depth,
+                                       log=False,
+                                       engine=engine,
+                                       telemetry=telemetry)
+        if engine != 'parallel':
+            _tile_arrays[key] = systolic_array
+    else:
+        systolic_array.reset(west, north)
+
+    try:
+        while 1:
+            systolic_array.tick(log=False)
+            if systolic_array.isDone():
+                cycles = systolic_array.clock - 1
+                # Short K slices may leave no steady state for summarize() - its clock and utilization aren't used here.
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    systolic_array.summarize()
+                break
+    finally:
+        if engine == 'parallel':
+            systolic_array.engine.close()
+
+    macs = np.matmul((west != 0).astype(np.int64), (north != 0).astype(np.int64)).sum(axis=0)
+
+    return {'results': systolic_array.results,
+            'cycles': cycles,
+            'macs': int(macs.sum()),
+            'utilization_per_pe': macs / cycles}
+
+
+def _run_tile_job(job):
+    """
+    Pool worker: (tile, west tile, north tile, array_size, buffer_depth, engine, telemetry) -> (tile, run_tile summary).
+    """
+    tile, west_tile, north_tile, array_size, buffer_depth, engine, telemetry = job
+    return tile, run_tile(west_tile, north_tile, array_size, buffer_depth, engine, telemetry)
+
+
+def tiled_matmul(west_matrices, north_matrices, array_size, buffer_depth, engine='vectorized', k_tile=None, processes=1, telemetry='off'):
+    """
+    Multiply (threads, M, K) west matrices by (threads, K, N) north matrices on a single SystolicArray of <array_size> -
+    an int for a square array, or a (rows, columns) pair.
+    Tiles (see tile_jobs) are streamed through the array one after the other, so total cycles is the sum of tile cycles.
+    Independent tiles can be simulated in parallel across <processes> workers (1 runs serially in this process,
+    None uses every core) - that speeds up the simulation, not the simulated array.
+    :return: results (threads, M, N) and summary dictionary:
+        total_cycles, tile_count, macs (threads*M*N*K), throughput (MACs per cycle, zeros included),
+        effective_macs and effective_throughput (non-zero couples only), wall_time,
+        avg_tile_utilization and per tile list of (m0, n0, k0, k1, cycles, effective macs, avg_utilization).
+    """
+    if west_matrices.shape[0] != north_matrices.shape[0]:
+        TiledGEMMLogger.critical("Threads number isn't equal in west matrix and north matrix")
+        raise ValueError("Threads number isn't equal in west matrix and north matrix")
+    if west_matrices.shape[2] != north_matrices.shape[1]:
+        TiledGEMMLogger.critical("West matrices columns and north matrices rows are different")
+        raise ValueError("West matrices columns and north matrices rows are different")
+
+    thread_count, M, K = west_matrices.shape
+    N = north_matrices.shape[2]
+    array_rows, array_columns = array_shape(array_size)
+
+    start = time.time()
+
+    results = np.zeros((thread_count, M, N), dtype=np.result_type(west_matrices, north_matrices))
+    jobs = [((m0, n0, k0, k1),
+             west_matrices[:, m0:m0 + array_rows, k0:k1],
+             north_matrices[:, k0:k1, n0:n0 + array_columns],
+             array_size, buffer_depth, engine, telemetry) for m0, n0, k0, k1 in tile_jobs(M, N, K, array_size, k_tile)]
+
+    if processes == 1:
+        done = map(_run_tile_job, jobs)
+    else:
+        pool = multiprocessing.Pool(processes=processes)
+        done = pool.imap_unordered(_run_tile_job, jobs)
+
+    tiles = []
+    try:
+        for (m0, n0, k0, k1), tile in done:
+            # Accumulate partial tiles - K slices of the same output block add up.
+            rows, columns = min(array_rows, M - m0), min(array_columns, N - n0)
+            results[:, m0:m0 + rows, n0:n0 + columns] += tile['results'][:, :rows, :columns].astype(results.dtype)
+
+            tiles.append((m0, n0, k0, k1, tile['cycles'], tile['macs'], float(tile['utilization_per_pe'].mean())))
+            TiledGEMMLogger.info("Tile <{},{}> K[{}:{}]: {} Cycles, Utilization {:.3f}".format(m0, n0, k0, k1, tile['cycles'], tiles[-1][-1]))
+    finally:
+        if processes != 1:
+            pool.close()
+            pool.join()
+
+    tiles.sort()
+
+    summary = dict()
+    summary['total_cycles']         = sum(t[4] for t in tiles)
+    summary['tile_count']           = len(tiles)
+    summary['macs']                 = thread_count * M * N * K
+    summary['throughput']           = summary['macs'] / max(summary['total_cycles'], 1)
+    summary['effective_macs']       = sum(t[5] for t in tiles)
+    summary['effective_throughput'] = summary['effective_macs'] / max(summary['total_cycles'], 1)
+    summary['wall_time']            = time.time() - start
+    summary['avg_tile_utilization'] = float(np.mean([t[6] for t in tiles])) if tiles else 0.0
+    summary['tiles']                = tiles
+
+    TiledGEMMLogger.info("Tiled GEMM {}x{}x{}, {} Threads: {} Tiles, {} Cycles, {:.2f} MACs Per Cycle".format(
+        M, K, N, thread_count, summary['tile_count'], summary['total_cycles'], summary['throughput']))
+
+    return results, summary
+
+
+if __name__ == '__main__':
+    # Small sanity run: 20x64 @ 64x12 on an 8x8 array, K split in two.
+    west  = np.random.choice(np.arange(10), (2, 20, 64), p=[0.5] + [0.5 / 9] * 9)
+    north = np.random.choice(np.arange(10), (2, 64, 12), p=[0.5] + [0.5 / 9] * 9)
+
+    results, summary = tiled_matmul(west, north, array_size=8, buffer_depth=2, k_tile=32, processes=None)
+
+    print('[INFO] - Results Correct: {}'.format(np.array_equal(results, np.matmul(west, north))))
+    print('[INFO] - {} Tiles, {} Cycles, {:.2f} MACs Per Cycle, Average Tile Utilization {:.3f}, Wall Time {:.2f}s'.format(
+        summary['tile_count'], summary['total_cycles'], summary['throughput'], summary['avg_tile_utilization'], summary['wall_time']))
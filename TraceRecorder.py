@@ -0,0 +1,225 @@
+import sys
+import logging
+import numpy as np
+
+TraceRecorderLogger = logging.getLogger('TraceRecorderLogger')
+
+# Binary trace record. a, b are the event operands (literals, result, buffer size...), flags bit 0/1 mark a/b as None (bubble).
+RECORD = np.dtype([('cycle',  '<u4'),
+                   ('event',  'u1'),
+                   ('flags',  'u1'),
+                   ('i',      '<i2'),
+                   ('j',      '<i2'),
+                   ('thread', '<i2'),
+                   ('a',      '<i8'),
+                   ('b',      '<i8')])
+
+# Trace file header: magic, then array rows, thread count, limited buffers flag and array columns as uint16 - 16 bytes.
+# Columns are 0 in traces of square arrays written before rectangular arrays.
+MAGIC       = b'MTSATRC1'
+HEADER_SIZE = 16
+
+# Event types, one per hot path log message.
+CLOCK          = 0   # SystolicArray.tick.                    a: clock
+WEST_EMPTY     = 1   # PE.tock, west buffer thread empty.
+NORTH_EMPTY    = 2   # PE.tock, north buffer thread empty.
+LITERALS       = 3   # PE.tock, couple read.                  a: west literal, b: north literal
+LEFT           = 4   # PE.tock, couple left in input buffers. a: west literal, b: north literal
+MAC            = 5   # PE.tock, MAC on.                       a: intermediate result
+PE_DONE        = 6   # PE.tock, all threads checked.          a: MAC on
+PUSH           = 7   # BUFFER.push_to.                        a: value, b: thread size after push
+PUSH_DROPPED   = 8   # BUFFERlimited.push_to, thread full.    a: value
+IS_FULL        = 9   # BUFFERlimited.is_full.                 a: full
+
+
+class TraceRecorder:
+    """
+    Structured event recorder for the object engine hot path (SystolicArray.tick, PE.tock, BUFFER.push_to, BUFFERlimited.is_full).
+    Events are appended as compact binary records (see RECORD) to a preallocated array.
+    With a path, full arrays are spilled to that file, which can be memory-mapped back by load_trace.
+    Otherwise the array doubles when full.
+    Hot path methods take the recorder as their 'log' argument - it is False when tracing is off, so nothing is paid then.
+    Use decode / replay (or run this module on a trace file) to get the human-readable log back.
+    """
+
+    def __init__(self, array_size, thread_count, limited, path=None, capacity=1 << 16):
+
+        self.array_size   = array_size
+        self.thread_count = thread_count
+        self.limited      = limited
+
+        self.records = np.zeros(capacity, dtype=RECORD)
+        self.count   = 0
+
+        # Clock cycle stamped on every record, set by SystolicArray.tick.
+        self.cycle = 0
+
+        self.path = path
+        self.file = None
+        if path is not None:
+            self.file = open(path, 'wb')
+            self.file.write(_header(array_size, thread_count, limited))
+
+    def record(self, event, i, j, thread, a=0, b=0):
+        """
+        Append a single event record.
+        """
+        flags = 0
+        if a is None:
+            flags |= 1
+            a = 0
+        if b is None:
+            flags |= 2
+            b = 0
+
+        if self.count == self.records.shape[0]:
+            self._spill()
+
+        self.records[self.count] = (self.cycle, event, flags, i, j, thread, a, b)
+        self.count += 1
+
+    def _spill(self):
+        """
+        Make room for more records: write them to file if there is one, otherwise double the array.
+        """
+        if self.file is not None:
+            self.file.write(self.records[:self.count].tobytes())
+            self.count = 0
+        else:
+            self.records = np.concatenate((self.records, np.zeros_like(self.records)))
+
+    def flush(self):
+
+        if self.file is not None:
+            self._spill()
+            self.file.flush()
+
+    def close(self):
+
+        if self.file is not None:
+            self.flush()
+            self.file.close()
+            self.file = None
+
+    def trace(self):
+        """
+        :return: all records so far. Memory-mapped from file if there is one.
+        """
+        if self.path is None:
+            return self.records[:self.count]
+
+        self.flush()
+        return load_trace(self.path)[1]
+
+    def replay(self):
+        """
+        Emit the recorded events to their loggers, as the string logging of the hot path used to.
+        """
+        replay(self.trace(), self.array_size, self.thread_count, self.limited)
+
+
+def _header(array_size, thread_count, limited):
+
+    rows, columns = np.broadcast_to(array_size, 2)
+    return MAGIC + np.array([rows, thread_count, limited, columns], dtype='<u2').tobytes()
+
+
+def load_trace(path):
+    """
+    Memory-map a trace file written by TraceRecorder.
+    :return: header dictionary (array_size, thread_count, limited) and records array.
+             array_size is an int for square arrays, a (rows, columns) tuple otherwise.
+    """
+    with open(path, 'rb') as f:
+        header = f.read(HEADER_SIZE)
+
+    if header[:len(MAGIC)] != MAGIC:
+        TraceRecorderLogger.error('Not A Trace File: ' + path)
+        raise ValueError('Not A Trace File: ' + path)
+
+    rows, thread_count, limited, columns = np.frombuffer(header[len(MAGIC):], dtype='<u2').tolist()
+    array_size = rows if columns in (0, rows) else (rows, columns)
+    header = {'array_size': array_size, 'thread_count': thread_count, 'limited': bool(limited)}
+
+    try:
+        records = np.memmap(path, dtype=RECORD, mode='r', offset=HEADER_SIZE)
+    except ValueError:
+        # Empty trace - nothing to map.
+        records = np.zeros(0, dtype=RECORD)
+
+    return header, records
+
+
+def decode(records, array_size, thread_count, limited):
+    """
+    Reproduce the hot path log messages from trace records.
+    PE intermediate results (printed with PE_DONE) are rebuilt from MAC events.
+    :return: generator of (logger name, level, message)
+    """
+    results = np.zeros(tuple(np.broadcast_to(array_size, 2)) + (thread_count,), dtype=np.int64)
+
+    for cycle, event, flags, i, j, thread, a, b in records.tolist():
+
+        a = None if flags & 1 else a
+        b = None if flags & 2 else b
+
+        if event == CLOCK:
+            yield 'SystolicArrayLogger', logging.INFO, "Raising Edge Clock: {}".format(a)
+
+        elif event == WEST_EMPTY:
+            yield 'PELogger', logging.DEBUG, "<{},{}> - Thread: {}, West Buffer is Empty.".format(i, j, thread)
+
+        elif event == NORTH_EMPTY:
+            yield 'PELogger', logging.DEBUG, "<{},{}> - Thread: {}, North Buffer is Empty.".format(i, j, thread)
+
+        elif event == LITERALS:
+            yield 'PELogger', logging.INFO, "<{},{}> - Thread: {}, West Literal: {}, North Literal: {}".format(i, j, thread, a, b)
+
+        elif event == LEFT:
+            if limited:
+                yield 'PELogger', logging.DEBUG, "<{},{}> - Thread: {}, {}, {} Left In West and North Buffers".format(i, j, thread, a, b)
+            else:
+                yield 'PELogger', logging.DEBUG, "<{},{}> - Thread: {}, Inputs Left In West and North Buffers".format(i, j, thread)
+
+        elif event == MAC:
+            results[i, j, thread] = a
+            yield 'PELogger', logging.DEBUG, "<{},{}> - Thread: {}, MAC On, Intermediate result: {}".format(i, j, thread, a)
+
+        elif event == PE_DONE:
+            if limited:
+                yield 'PELogger', logging.INFO, "<{},{}> - All Threads, Intermediate Result: {}".format(i, j, results[i, j].tolist())
+            else:
+                yield 'PELogger', logging.INFO, "<{},{}> - All Threads, Intermediate Result: {}, MAC On: {}".format(i, j, results[i, j].tolist(), bool(a))
+
+        elif event == PUSH:
+            if limited:
+                yield 'BufferLogger', logging.INFO, "<{},{}>: Value {} Pushed to Buffer-Thread: {}. Buffer Size Now: {}".format(i, j, a, thread, b)
+            else:
+                yield 'BufferLogger', logging.DEBUG, "<{},{}>: Value {} Pushed to Thread: {}".format(i, j, a, thread)
+
+        elif event == PUSH_DROPPED:
+            yield 'BufferLogger', logging.INFO, "BUFFERlimited <{},{}>: Value {} Didn't push to Thread: {} because it's full".format(i, j, a, thread)
+
+        elif event == IS_FULL:
+            yield 'BufferLogger', logging.DEBUG, "BUFFERlimited <{},{}> - Thread {} Is {}".format(i, j, thread, 'Full' if a else 'Not Full')
+
+        else:
+            yield 'TraceRecorderLogger', logging.WARNING, "Unknown Event {} On Cycle {}".format(event, cycle)
+
+
+def replay(records, array_size, thread_count, limited):
+    """
+    Emit decoded trace records to their loggers.
+    """
+    for name, level, message in decode(records, array_size, thread_count, limited):
+        logging.getLogger(name).log(level, message)
+
+
+if __name__ == '__main__':
+    # Usage: python TraceRecorder.py <trace file> [<first cycle> <last cycle>]
+    header, records = load_trace(sys.argv[1])
+    if len(sys.argv) > 3:
+        records = records[(records['cycle'] >= int(sys.argv[2])) & (records['cycle'] <= int(sys.argv[3]))]
+
+    for name, level, message in decode(records, **header):
+        print('[{}] - {} - {}'.format(logging.getLevelName(level), name, message))
@@ -1,12 +1,66 @@
 from BUFFER import *
 import numpy as np
 
+# SystolicArray dataflows - the operand that stays in the PE's: outputs, weights or inputs. See dataflow_streams.
+DATAFLOWS = ('output', 'weight', 'input')
+
+
+def array_shape(array_size):
+    """
+    PE grid of a SystolicArray: array_size is either an int, for a square array, or a (rows, columns) pair.
+    :return: rows, columns
+    """
+    rows, columns = np.broadcast_to(array_size, 2).tolist()
+    return rows, columns
+
+
+def dataflow_shapes(array_size, thread_count, stream_length, dataflow):
+    """
+    West and north tensor shapes of a <dataflow> job on a rows x columns array (see array_shape), with <stream_length>
+    operands per FIFO:
+        'output' - (threads, rows, stream_length) inputs by (threads, stream_length, columns) weights.
+        'weight' - (threads, stream_length, rows) inputs by (threads, rows, columns) stationary weights.
+        'input'  - (threads, rows, columns) stationary inputs by (threads, columns, stream_length) weights.
+    Results are west @ north in every dataflow.
+    :return: west shape, north shape
+    """
+    rows, columns = array_shape(array_size)
+    if dataflow == 'weight':
+        return (thread_count, stream_length, rows), (thread_count, rows, columns)
+    if dataflow == 'input':
+        return (thread_count, rows, columns), (thread_count, columns, stream_length)
+    return (thread_count, rows, stream_length), (thread_count, stream_length, columns)
+
+
+def dataflow_streams(west_matrices, north_matrices, dataflow):
+    """
+    Lay a job out as the west and north tensors its FIFO's stream, in output-stationary form - what pack_FIFOs packs, and
+    unpack_BUFFERs unpacks, in every dataflow - and the tensor held in the PE's stationary registers:
+        'output' - the job tensors themselves. Results accumulate in the PE's.
+        'weight' - west FIFO i streams column i of west_matrices, north FIFO's stream zero partial sums.
+                   PE <i,j> holds north_matrices[:, i, j], and south outputs collect the results.
+        'input'  - west FIFO's stream zero partial sums, north FIFO j streams row j of north_matrices.
+                   PE <i,j> holds west_matrices[:, i, j], and east outputs collect the results.
+    Streams are views - transposes, and read-only broadcast zeros - so nothing is copied.
+    :return: west streams tensor, north streams tensor and stationary (threads, rows, columns) tensor, None for 'output'.
+    """
+    if dataflow == 'output':
+        return west_matrices, north_matrices, None
+
+    zero = np.zeros((), dtype=np.result_type(west_matrices, north_matrices))
+    if dataflow == 'weight':
+        partial_sums = np.broadcast_to(zero, (north_matrices.shape[0], west_matrices.shape[1], north_matrices.shape[2]))
+        return west_matrices.transpose(0, 2, 1), partial_sums, north_matrices
+
+    partial_sums = np.broadcast_to(zero, (west_matrices.shape[0], west_matrices.shape[1], north_matrices.shape[2]))
+    return partial_sums, north_matrices.transpose(0, 2, 1), west_matrices
+
 
 def pack_FIFOs(tensor, axis, thread_count, log):
     """
-    Slice 3D ndarray matrix into <array_size>    list of
-                                 <threads_count> lists of
-                                 <matrix_size>   lists
+    Slice 3D ndarray matrix into <rows> (west) or <columns> (north) list of
+                                 <threads_count>                    lists of
+                                 <matrix_size>                      lists
     w.r.t axis direction.
     For example: if west_matrices = [[[11, 12, 13],
                                       [14, 15, 16],
@@ -20,38 +74,37 @@ def pack_FIFOs(tensor, axis, thread_count, log):
                            [24, 25, 26]] and
          west_inputs[2] = [[17, 18, 19],
                            [27, 28, 29]]
+    Each FIFO reads its slice of the tensor in place, with <index> leading bubbles applied as a virtual skew -
+    tensor may be a np.memmap (np.load(..., mmap_mode='r')) as well.
+    Stationary dataflows pack the streams laid out by dataflow_streams.
     """
     readyFIFO = []
 
     if axis == 0:    # west matrix
         for i in range(tensor.shape[1]):
-            tmp = tensor[:, i, :]
-            tmplist = []
-
-            for j in range(tmp.shape[0]):
-                tmplist.append(list(tmp[j, :]))
-
-            for t in range(len(tmplist)):
-                for ii in range(i):
-                    tmplist[t].insert(0, None)
-
-            readyFIFO.append(FIFO(threads=tmplist, i=i, j=-1, thread_count=thread_count, log=log))
+            threads = [tensor[t, i, :] for t in range(tensor.shape[0])]
+            readyFIFO.append(FIFO(threads=threads, i=i, j=-1, thread_count=thread_count, log=log, skew=i))
 
     if axis == 1:    # north matrix
         for i in range(tensor.shape[2]):
-            tmp = tensor[:, :, i]
-            tmplist = []
+            threads = [tensor[t, :, i] for t in range(tensor.shape[0])]
+            readyFIFO.append(FIFO(threads=threads, i=-1, j=i, thread_count=thread_count, log=log, skew=i))
 
-            for j in range(tmp.shape[0]):
-                tmplist.append(list(tmp[j, :]))
+    return readyFIFO
 
-            for t in range(len(tmplist)):
-                for ii in range(i):
-                    tmplist[t].insert(0, None)
 
-            readyFIFO.append(FIFO(threads=tmplist, i=-1, j=i, thread_count=thread_count, log=log))
+def reload_FIFOs(fifo_list, tensor, axis):
+    """
+    Point FIFO's built by pack_FIFOs at a new tensor of the same edge size and thread count (input length may differ),
+    and rewind them.
+    """
+    if axis == 0:    # west matrix
+        for i, fifo in enumerate(fifo_list):
+            fifo.load([tensor[t, i, :] for t in range(tensor.shape[0])])
 
-    return readyFIFO
+    if axis == 1:    # north matrix
+        for i, fifo in enumerate(fifo_list):
+            fifo.load([tensor[t, :, i] for t in range(tensor.shape[0])])
 
 
 def unpack_BUFFERs(buffer_list, axis, matrix_shape):
@@ -61,16 +114,16 @@ def unpack_BUFFERs(buffer_list, axis, matrix_shape):
     if axis == 0:   # south fifo_list
         south_output_matrices = np.zeros(matrix_shape)
         for buffer in buffer_list:
-            for thread_id, thread_list in buffer.buffer.items():
-                if len(thread_list) == south_output_matrices.shape[1]:
-                    south_output_matrices[int(thread_id[1:]), :, buffer.jindex] = thread_list
+            for thread_id in range(buffer.thread_count):
+                if buffer.length(thread_id) == south_output_matrices.shape[1]:
+                    south_output_matrices[thread_id, :, buffer.jindex] = buffer.values(thread_id)
         return south_output_matrices
     if axis == 1:   # east fifo list
         east_output_matrices = np.zeros(matrix_shape)
         for buffer in buffer_list:
-            for thread_id, thread_list in buffer.buffer.items():
-                if len(thread_list) == east_output_matrices.shape[2]:
-                    east_output_matrices[int(thread_id[1:]), buffer.iindex, :] = thread_list
+            for thread_id in range(buffer.thread_count):
+                if buffer.length(thread_id) == east_output_matrices.shape[2]:
+                    east_output_matrices[thread_id, buffer.iindex, :] = buffer.values(thread_id)
         return east_output_matrices
 
 
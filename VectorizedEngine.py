@@ -0,0 +1,638 @@
+import time
+import numpy as np
+import logging
+from functools import reduce
+from Arbitration import check_policy, LOOKAHEAD
+from Utilities import array_shape
+
+VectorizedEngineLogger = logging.getLogger('VectorizedEngineLogger')
+
+# Plan entries listing positions of the plan PE's (see _build_step) - shifted, not repeated, when a plan is batched.
+PLAN_POSITIONS = ('west_edge', 'west_internal', 'north_edge', 'north_internal',
+                  'east_edge', 'east_internal', 'south_edge', 'south_internal', 'record')
+
+# Engine state arrays, besides the cycles and step counters - see state.
+STATE = ('west_head', 'north_head', 'values', 'bubbles', 'head', 'length', 'load',
+         'east_outputs', 'south_outputs', 'east_count', 'south_count', 'pending_outputs',
+         'on_thread', 'waiting', 'result', 'drained', 'active')
+
+
+def _stack(tensors, shape):
+    """
+    Stack per element tensors along a leading batch axis, zero-padded up to <shape>.
+    A single tensor that fits is viewed, not copied - it may be a np.memmap.
+    """
+    if len(tensors) == 1 and tensors[0].shape == shape[1:]:
+        return tensors[0][None]
+
+    stacked = np.zeros(shape, dtype=reduce(np.promote_types, [tensor.dtype for tensor in tensors]))
+    for element, tensor in enumerate(tensors):
+        stacked[(element,) + tuple(slice(0, size) for size in tensor.shape)] = tensor
+    return stacked
+
+
+class VectorizedEngine:
+    """
+    Whole-array NumPy implementation of the SystolicArray clock.
+    Holds every PE register, round-robin pointer, accumulator and inter-PE buffer as NumPy arrays,
+    and advances all of them together instead of calling PE.tock / PElimited.tock one PE at a time.
+    The whole state has a leading batch axis: a batch of independent jobs (elements) on arrays of the same size and buffer depth
+    advance in lockstep, and an element leaves the schedule once it is stopped (see SystolicArrayBatch). A single run is a batch of 1.
+    Each cycle costs a fixed NumPy overhead, so a single run only pays off from about 16x16 PE's: it is slower than the object engine
+    up to 12x12 (2-8x slower at 4x4 and 8x8), 1.1-1.4x faster at 16x16, and over 2x faster from 24x24 on.
+    Below that, it is still the engine that batches runs.
+    """
+
+    def __init__(self, west_matrices, north_matrices, array_size, buffer_depth, telemetry, log, profiler=None, arbitration='round_robin',
+                 dataflow='output', stationary_matrices=None):
+        """
+        Construct VectorizedEngine instance.
+        :param west_matrices:  sequence of (threads, rows, input_length) west tensors, one per batch element.
+        :param north_matrices: sequence of (threads, input_length, columns) north tensors, one per batch element.
+        :param array_size: PE grid, an int or a (rows, columns) pair - see Utilities.array_shape.
+        Thread count and input length may differ between elements - state is padded to the largest ones.
+        Buffers are ring buffers - one row per (element, buffer) couple and thread - with head and length counters.
+        Index arithmetic for buffer ids:
+            horizontal buffer <i,j> (j < columns-1): i*(columns-1) + j
+            vertical buffer   <i,j> (i < rows-1):    rows*(columns-1) + i*columns + j
+        State rows are element-major, so the batch is the leading axis once reshaped:
+            buffer rows:                   element*buffer_count + buffer id
+            PE rows:                       (element*rows + i)*columns + j
+            edge FIFO and OUTPUT rows:     element*rows + row (west / east), element*columns + column (north / south)
+        The last column of horizontal buffers and the last row of vertical buffers are the OUTPUT buffers,
+        kept as (elements, threads, rows, input_length) and (elements, threads, input_length, columns) tensors
+        with per-thread drain counters.
+        Edge FIFOs are not materialized - they read the input tensors in place, with the diagonal skew applied as an offset.
+        MAC activity and buffers occupancy are written into <telemetry>, the Telemetry store with one element per batch element.
+        <profiler> is the Profiler that tick phases are timed into (tick/steps/peek, arbitrate, push, pop and mac), None to time nothing.
+        <arbitration> is the thread arbitration policy of every PE, one of Arbitration.ARBITRATION_POLICIES (see Arbiter).
+        <dataflow> is one of Utilities.DATAFLOWS. Stationary dataflows take the streams laid out by Utilities.dataflow_streams
+        as west and north matrices, and <stationary_matrices> - a sequence of (threads, rows, columns) tensors
+        held in the PE's, one per batch element. Their MAC's add to the partial sums passing by, as StationaryPE.tock does.
+        """
+        check_policy(arbitration)
+
+        self.array_size         = array_size
+        self.rows, self.columns = array_shape(array_size)
+        self.arbitration        = arbitration
+        self.dataflow           = dataflow
+
+        self.limited_buffer = buffer_depth >= 0
+        self.buffer_depth   = buffer_depth
+
+        self.horizontal_count = self.rows * (self.columns - 1)
+        self.buffer_count     = self.horizontal_count + (self.rows - 1) * self.columns
+
+        self.telemetry = telemetry
+        self.profiler  = profiler
+
+        # Skewed schedule of a single element, see _build_step. It depends on the topology only, so it is kept across jobs.
+        # Any step from the last fill one on holds the whole checkerboard - steady plans are built on an even and an odd one.
+        steady = max(self.rows, self.columns)
+        self.pe_steps  = [self._build_step(s) for s in range(self.rows + self.columns - 1)]
+        self.pe_steady = [self._build_step(2 * steady), self._build_step(2 * steady + 1)]
+        self.all_plans = None
+
+        self.reset(west_matrices, north_matrices, stationary_matrices)
+
+        if log:
+            VectorizedEngineLogger.info("VectorizedEngine Initialized: {} Elements, {} Buffers Each".format(self.element_count, self.buffer_count))
+
+    def reset(self, west_matrices, north_matrices, stationary_matrices=None):
+        """
+        Load new jobs, one per batch element (same array size, any number of elements):
+        clear every register, buffer and counter, and put every element on the schedule.
+        Stationary dataflows take the stationary tensors of the new jobs as well.
+        """
+        rows, columns = self.rows, self.columns
+
+        self.element_count = len(west_matrices)
+        self.thread_counts = np.array([west.shape[0] for west in west_matrices])
+        self.input_lengths = np.array([west.shape[2] for west in west_matrices])
+
+        element_count     = self.element_count
+        thread_count      = int(self.thread_counts.max())
+        self.thread_count = thread_count
+        self.threads      = np.arange(thread_count)
+
+        self.max_input_length = int(self.input_lengths.max())
+
+        self.west_matrices  = _stack(west_matrices,  (element_count, thread_count, rows, self.max_input_length))
+        self.north_matrices = _stack(north_matrices, (element_count, thread_count, self.max_input_length, columns))
+
+        # Input length of every element thread. Padding threads stream their skew bubbles only.
+        self.input_length = np.where(self.threads < self.thread_counts[:, None], self.input_lengths[:, None], 0)
+
+        dtype = np.result_type(self.west_matrices, self.north_matrices)
+
+        # Edge FIFOs read pointers, per edge row. west_head[e*rows + i, t] - row i of west matrix t,
+        # north_head[e*columns + j, t] - column j of north matrix t.
+        self.west_head  = np.zeros((element_count * rows,    thread_count), dtype=np.int64)
+        self.north_head = np.zeros((element_count * columns, thread_count), dtype=np.int64)
+
+        # Inter-PE buffers. Each one starts with a single bubble, just like BUFFER.
+        self.capacity = self.buffer_depth if self.limited_buffer else 4
+
+        buffer_rows  = element_count * self.buffer_count
+        self.values  = np.zeros((buffer_rows, thread_count, self.capacity), dtype=dtype)
+        self.bubbles = np.zeros((buffer_rows, thread_count, self.capacity), dtype=bool)
+        self.bubbles[:, :, 0] = True
+        self.head    = np.zeros((buffer_rows, thread_count), dtype=np.int64)
+        self.length  = np.ones((buffer_rows, thread_count), dtype=np.int64)
+
+        # For each buffer and thread, count how many data items in buffer, not including bubbles (BUFFER.occupancy)
+        self.load = np.zeros((buffer_rows, thread_count), dtype=np.int64)
+
+        # OUTPUT buffers with drain counters, per edge row.
+        self.east_outputs  = np.zeros(self.west_matrices.shape,  dtype=self.west_matrices.dtype)
+        self.south_outputs = np.zeros(self.north_matrices.shape, dtype=self.north_matrices.dtype)
+        self.east_count    = np.zeros((element_count * rows,    thread_count), dtype=np.int64)
+        self.south_count   = np.zeros((element_count * columns, thread_count), dtype=np.int64)
+
+        # Completion tracking, same as SystolicArray.pending_outputs. PE's run ahead of the clock,
+        # so drained OUTPUT threads are counted per clock cycle and taken off pending as the clock reaches that cycle.
+        # Padding threads are all-zero, so they are never pending.
+        self.west_zero_rows     = ~self.west_matrices.any(axis=3).transpose(0, 2, 1).reshape(-1, thread_count)
+        self.north_zero_columns = ~self.north_matrices.any(axis=2).transpose(0, 2, 1).reshape(-1, thread_count)
+        # Partial sums streams are all-zero, but they carry the results - pending on every thread but the padding ones.
+        padding = self.threads >= self.thread_counts[:, None]
+        if self.dataflow == 'weight':
+            self.north_zero_columns = np.repeat(padding, columns, axis=0)
+        if self.dataflow == 'input':
+            self.west_zero_rows = np.repeat(padding, rows, axis=0)
+        self.pending_outputs    = (np.count_nonzero(~self.west_zero_rows.reshape(element_count, -1), axis=1) +
+                                   np.count_nonzero(~self.north_zero_columns.reshape(element_count, -1), axis=1))
+
+        # PE registers, per PE row.
+        self.on_thread = np.zeros(element_count * rows * columns, dtype=np.int64)
+        self.waiting   = np.zeros((element_count * rows * columns, thread_count), dtype=np.int64)
+        self.result    = np.zeros((element_count * rows * columns, thread_count), dtype=dtype)
+
+        # Stationary registers, per PE row. Padding threads hold zeros.
+        self.stationary = None
+        if self.dataflow != 'output':
+            stationary = _stack(stationary_matrices, (element_count, thread_count, rows, columns))
+            self.stationary = np.ascontiguousarray(stationary.transpose(0, 2, 3, 1)).reshape(-1, thread_count)
+
+        self.drained = np.zeros((element_count, 16), dtype=np.int64)
+
+        self.cycles = 0
+        self.step   = 0
+
+        # Schedule of every element. Batched plans are kept for the next job with as many elements.
+        self.active = np.arange(element_count)
+        if self.all_plans is None or self.all_plans[0] != element_count:
+            self.all_plans = (element_count, self._batch_plans(self.active))
+        self.steps, self.steady = self.all_plans[1]
+
+    def state(self):
+        """
+        Every register, buffer and counter, as a dictionary of arrays (see SystolicArray.snapshot). Inputs aren't included.
+        """
+        state = {name: getattr(self, name) for name in STATE}
+        state['cycles'] = np.array(self.cycles)
+        state['step']   = np.array(self.step)
+        return state
+
+    def load_state(self, state):
+        """
+        Restore the state saved by state, into an engine reset with the same jobs.
+        """
+        for name in STATE:
+            # Snapshots taken before arbitration policies have no waiting counters - round-robin doesn't use them.
+            if name in state:
+                setattr(self, name, state[name])
+        self.cycles   = int(state['cycles'])
+        self.step     = int(state['step'])
+        self.capacity = self.values.shape[2]
+
+        if len(self.active) != self.element_count:
+            self.steps, self.steady = self._batch_plans(self.active)
+
+    def horizontal_id(self, i, j):
+        return i * (self.columns - 1) + j
+
+    def vertical_id(self, i, j):
+        return self.horizontal_count + i * self.columns + j
+
+    def _build_step(self, step):
+        """
+        Precompute index arrays for the PE's that tock on schedule step <step>.
+        SystolicArray.tick calls tock in row-major order, so PE <i,j> reads buffers written by <i,j-1> and <i-1,j>
+        earlier in the same clock cycle (data may cross an empty buffer within a single cycle),
+        and buffers popped by <i,j+1> and <i+1,j> on the previous clock cycle.
+        Clock cycle c of PE <i,j> is therefore scheduled on step 2*c + i + j:
+        each step is a checkerboard of PE's that share no buffer, every PE at its own clock cycle,
+        and every dependency is resolved on an earlier step.
+        Steps 0 to (rows-1) + (columns-1) fill the schedule, after that even and odd steps alternate.
+        Plans are built for a single element - _batch_plan repeats them over batch elements.
+        """
+        rows, columns = self.rows, self.columns
+        iindex, jindex = np.nonzero(np.add.outer(np.arange(rows), np.arange(columns)) <= step)
+        keep = (iindex + jindex) % 2 == step % 2
+        iindex, jindex = iindex[keep], jindex[keep]
+
+        plan = dict()
+        plan['iindex']   = iindex
+        plan['jindex']   = jindex
+        plan['diagonal'] = iindex + jindex
+
+        # Inputs. Edge positions read edge FIFOs, internal positions read inter-PE buffers.
+        plan['west_edge']      = np.flatnonzero(jindex == 0)
+        plan['west_internal']  = np.flatnonzero(jindex != 0)
+        plan['west_ids']       = self.horizontal_id(iindex, jindex - 1)[plan['west_internal']]
+        plan['north_edge']     = np.flatnonzero(iindex == 0)
+        plan['north_internal'] = np.flatnonzero(iindex != 0)
+        plan['north_ids']      = self.vertical_id(iindex - 1, jindex)[plan['north_internal']]
+
+        # Outputs. Edge positions push to OUTPUT buffers, internal positions to inter-PE buffers.
+        plan['east_edge']      = np.flatnonzero(jindex == columns - 1)
+        plan['east_internal']  = np.flatnonzero(jindex != columns - 1)
+        plan['east_ids']       = self.horizontal_id(iindex, jindex)[plan['east_internal']]
+        plan['south_edge']     = np.flatnonzero(iindex == rows - 1)
+        plan['south_internal'] = np.flatnonzero(iindex != rows - 1)
+        plan['south_ids']      = self.vertical_id(iindex, jindex)[plan['south_internal']]
+
+        # Input buffers with load record. Once PE <i,j> tocked, its input buffers hold their end of cycle state.
+        west_record  = np.flatnonzero((jindex != 0) & (iindex != rows - 1))
+        north_record = np.flatnonzero((iindex != 0) & (jindex != columns - 1))
+        plan['record']         = np.concatenate((west_record, north_record))
+        plan['record_ids']     = np.concatenate((self.horizontal_id(iindex, jindex - 1)[west_record],
+                                                 self.vertical_id(iindex - 1, jindex)[north_record]))
+        plan['record_columns'] = np.concatenate((self.telemetry.record_index(iindex, jindex - 1, 'H')[west_record],
+                                                 self.telemetry.record_index(iindex - 1, jindex, 'V')[north_record]))
+
+        return plan
+
+    def _batch_plan(self, plan, elements):
+        """
+        Repeat a single element plan over batch <elements>, element after element, and turn its ids into state rows:
+        - 'elements' holds the batch element of every PE, '<entry>_elements' the ones of every PLAN_POSITIONS entry.
+        - buffer ids become buffer rows, 'pes' holds PE rows, '<side>_rows' edge FIFO / OUTPUT rows of edge positions.
+        """
+        size  = len(plan['iindex'])
+        batch = dict()
+        for key, value in plan.items():
+            if key in PLAN_POSITIONS:
+                batch[key] = (value + size * np.arange(len(elements))[:, None]).reshape(-1)
+            else:
+                batch[key] = np.tile(value, len(elements))
+
+        batch['elements'] = np.repeat(elements, size)
+        for key in PLAN_POSITIONS:
+            batch[key + '_elements'] = batch['elements'][batch[key]]
+
+        for side in ('west', 'north', 'east', 'south'):
+            batch[side + '_ids'] += batch[side + '_internal_elements'] * self.buffer_count
+        batch['record_ids'] += batch['record_elements'] * self.buffer_count
+
+        batch['pes'] = (batch['elements'] * self.rows + batch['iindex']) * self.columns + batch['jindex']
+        for side, index, edge_size in (('west', 'iindex', self.rows), ('north', 'jindex', self.columns),
+                                       ('east', 'iindex', self.rows), ('south', 'jindex', self.columns)):
+            batch[side + '_rows'] = batch[side + '_edge_elements'] * edge_size + batch[index][batch[side + '_edge']]
+
+        return batch
+
+    def _batch_plans(self, elements):
+        """
+        :return: fill and steady state plans of <elements>
+        """
+        return [self._batch_plan(plan, elements) for plan in self.pe_steps], [self._batch_plan(plan, elements) for plan in self.pe_steady]
+
+    def stop(self, elements):
+        """
+        Take batch <elements> off the schedule: their state, results and telemetry stay as they are.
+        """
+        self.active = np.setdiff1d(self.active, elements)
+        self.steps, self.steady = self._batch_plans(self.active)
+
+    def _grow(self):
+        """
+        Double unlimited buffers capacity. Ring buffers are unrolled so every head returns to 0.
+        """
+        order   = (self.head[:, :, None] + np.arange(self.capacity)) % self.capacity
+        values  = np.take_along_axis(self.values,  order, axis=2)
+        bubbles = np.take_along_axis(self.bubbles, order, axis=2)
+
+        self.values  = np.concatenate((values,  np.zeros_like(values)),  axis=2)
+        self.bubbles = np.concatenate((bubbles, np.zeros_like(bubbles)), axis=2)
+        self.head[:] = 0
+        self.capacity *= 2
+
+        VectorizedEngineLogger.debug("Unlimited Buffers Capacity Grew To {}".format(self.capacity))
+
+    def _grow_history(self, cycle):
+        """
+        Make room in telemetry and drain counters up to clock cycle <cycle>.
+        """
+        self.telemetry.reserve(cycle + 1)
+        while cycle >= self.drained.shape[1]:
+            self.drained = np.concatenate((self.drained, np.zeros_like(self.drained)), axis=1)
+
+    def _peek(self, plan, side, offset=0):
+        """
+        Read the top of the input buffers of every PE in plan without removing it - or item <offset> from the top.
+        Items past the buffer length are meaningless, callers mask them by length.
+        :return: values, bubbles and length - (PE's, threads) arrays.
+        """
+        size    = len(plan['iindex'])
+        values  = np.zeros((size, self.thread_count), dtype=self.values.dtype)
+        bubbles = np.zeros((size, self.thread_count), dtype=bool)
+        length  = np.zeros((size, self.thread_count), dtype=np.int64)
+
+        internal = plan[side + '_internal']
+        if internal.size:
+            ids = plan[side + '_ids']
+            top = (self.head[ids] + offset) % self.capacity
+            values[internal]  = self.values[ids[:, None], self.threads, top]
+            bubbles[internal] = self.bubbles[ids[:, None], self.threads, top]
+            length[internal]  = self.length[ids]
+
+        edge = plan[side + '_edge']
+        if edge.size:
+            # Edge FIFO of row/column k is k bubbles followed by the input stream.
+            elements = plan[side + '_edge_elements']
+            if side == 'west':
+                k = plan['iindex'][edge]
+                head = self.west_head[plan['west_rows']]
+            else:
+                k = plan['jindex'][edge]
+                head = self.north_head[plan['north_rows']]
+            position = head - k[:, None] + offset
+            clipped  = np.clip(position, 0, self.max_input_length - 1)
+            length[edge]  = k[:, None] + self.input_length[elements] - head
+            bubbles[edge] = position < 0
+            if side == 'west':
+                values[edge] = self.west_matrices[elements[:, None], self.threads, k[:, None], clipped]
+            else:
+                values[edge] = self.north_matrices[elements[:, None], self.threads, clipped, k[:, None]]
+
+        return values, bubbles, length
+
+    def _pop(self, plan, side, pop, bubbles):
+        """
+        Remove the top of the input buffers where pop is True.
+        """
+        internal = plan[side + '_internal']
+        if internal.size:
+            ids = plan[side + '_ids']
+            taken = pop[internal]
+            self.head[ids]    = (self.head[ids] + taken) % self.capacity
+            self.length[ids] -= taken
+            self.load[ids]   -= taken & ~bubbles[internal]
+
+        edge = plan[side + '_edge']
+        if edge.size:
+            if side == 'west':
+                self.west_head[plan['west_rows']] += pop[edge]
+            else:
+                self.north_head[plan['north_rows']] += pop[edge]
+
+    def _is_full(self, plan, side):
+        """
+        BUFFERlimited.is_full for the output buffers of every PE in plan. OUTPUT buffers are never full.
+        """
+        full = np.zeros((len(plan['iindex']), self.thread_count), dtype=bool)
+        if self.limited_buffer:
+            internal = plan[side + '_internal']
+            if internal.size:
+                full[internal] = self.length[plan[side + '_ids']] >= self.buffer_depth
+        return full
+
+    def _push(self, plan, side, push, values, bubbles, cycle):
+        """
+        Push values to the output buffers where push is True.
+        OUTPUT buffers drop bubbles. BUFFERlimited drop values when full - callers check is_full when it matters.
+        """
+        internal = plan[side + '_internal']
+        if internal.size:
+            ids = plan[side + '_ids']
+            pushed = push[internal]
+            if self.limited_buffer:
+                pushed = pushed & (self.length[ids] < self.buffer_depth)
+            rows, threads = np.nonzero(pushed)
+            if rows.size:
+                buffer_ids = ids[rows]
+                tail = (self.head[buffer_ids, threads] + self.length[buffer_ids, threads]) % self.capacity
+                self.values[buffer_ids, threads, tail]  = values[internal][rows, threads]
+                self.bubbles[buffer_ids, threads, tail] = bubbles[internal][rows, threads]
+                self.length[ids] += pushed
+                self.load[ids]   += pushed & ~bubbles[internal]
+
+        edge = plan[side + '_edge']
+        if edge.size:
+            rows, threads = np.nonzero(push[edge] & ~bubbles[edge])
+            if rows.size:
+                positions = edge[rows]
+                elements  = plan[side + '_edge_elements'][rows]
+                edge_rows = plan[side + '_rows'][rows]
+                if side == 'east':
+                    k = plan['iindex'][positions]
+                    count = self.east_count[edge_rows, threads]
+                    self.east_outputs[elements, threads, k, count] = values[positions, threads]
+                    self.east_count[edge_rows, threads] += 1
+                    drained = (count + 1 == self.input_length[elements, threads]) & ~self.west_zero_rows[edge_rows, threads]
+                else:
+                    k = plan['jindex'][positions]
+                    count = self.south_count[edge_rows, threads]
+                    self.south_outputs[elements, threads, count, k] = values[positions, threads]
+                    self.south_count[edge_rows, threads] += 1
+                    drained = (count + 1 == self.input_length[elements, threads]) & ~self.north_zero_columns[edge_rows, threads]
+                np.add.at(self.drained, (elements[drained], cycle[positions[drained]]), 1)
+
+    def _mac_couples(self, plan, west_in, west_bubble, north_in, north_bubble):
+        """
+        PE.is_mac_couple / StationaryPE.is_mac_couple for every thread of every PE in plan.
+        :return: (PE's, threads) array, True for couples that need the MAC.
+        """
+        literal = ~west_bubble & ~north_bubble
+        if self.dataflow == 'output':
+            return literal & (west_in != 0) & (north_in != 0)
+
+        operand = west_in if self.dataflow == 'weight' else north_in
+        return literal & (operand != 0) & (self.stationary[plan['pes']] != 0)
+
+    def _score(self, plan, west_length, north_length):
+        """
+        Arbiter.score of every thread of every PE in plan, for the arbitration policy of the engine.
+        :return: (PE's, threads) array, higher first.
+        """
+        if self.arbitration == 'oldest_first':
+            return self.waiting[plan['pes']]
+
+        if self.arbitration == 'longest_queue_first':
+            return west_length + north_length
+
+        # lookahead_nonzero: zero / bubble couples right behind the top, up to the first non-zero couple or the end of a buffer.
+        visible = np.minimum(west_length, north_length)
+        going   = np.ones(visible.shape, dtype=bool)
+        score   = np.zeros(visible.shape, dtype=np.int64)
+        for offset in range(1, LOOKAHEAD + 1):
+            west_in,  west_bubble,  _ = self._peek(plan, 'west',  offset)
+            north_in, north_bubble, _ = self._peek(plan, 'north', offset)
+            going &= (visible > offset) & ~self._mac_couples(plan, west_in, west_bubble, north_in, north_bubble)
+            score += going
+        return score
+
+    def _tock(self, step):
+        """
+        Tock every PE scheduled on <step>, each on its own clock cycle.
+        Same rules as PE.tock / PElimited.tock, evaluated for all threads of all those PE's at once:
+        - the first thread in round-robin order (starting at onThread) with two non-zero inputs
+          (and room in both output buffers, for limited buffers) gets the MAC - or, with an arbitration policy,
+          the one with the highest score, round-robin order breaking ties.
+        - other non-zero couples stay in the input buffers.
+        - couples with a zero are passed on (for limited buffers, only if both output buffers have room).
+        - bubble couples are passed on.
+        Stationary dataflows follow StationaryPE.tock: the stationary operand takes part in the MAC couple check,
+        and MAC'ed partial sums are passed on with the product added.
+        """
+        plan = self.steps[step] if step < len(self.steps) else self.steady[step % 2]
+        self._grow_history(step // 2)
+        if not plan['iindex'].size:
+            return
+
+        if not self.limited_buffer and self.length.size and self.length.max() + 1 > self.capacity:
+            self._grow()
+
+        cycle = (step - plan['diagonal']) // 2
+
+        profiler = self.profiler
+        if profiler is not None:
+            mark = time.perf_counter()
+
+        west_in,  west_bubble,  west_length  = self._peek(plan, 'west')
+        north_in, north_bubble, north_length = self._peek(plan, 'north')
+
+        if profiler is not None:
+            mark = profiler.lap('tick/steps/peek', mark)
+
+        ready       = (west_length > 0) & (north_length > 0)
+        both_bubble = ready & west_bubble & north_bubble
+        non_zero    = ready & self._mac_couples(plan, west_in, west_bubble, north_in, north_bubble)
+        if self.stationary is None:
+            any_zero = ready & ((~west_bubble & (west_in == 0)) | (~north_bubble & (north_in == 0)))
+        else:
+            # Partial sums are passed on whatever their value - literal couples without the MAC.
+            any_zero = ready & ~west_bubble & ~north_bubble & ~non_zero
+
+        full = self._is_full(plan, 'east') | self._is_full(plan, 'south')
+
+        # Round-Robin: rank threads by their distance from onThread, pick the first candidate.
+        # Padding threads are never candidates, so ranks are taken modulo each element own thread count.
+        elements, pes = plan['elements'], plan['pes']
+        thread_counts = self.thread_counts[elements]
+        candidates = non_zero & ~full
+        rank       = np.where(candidates, (self.threads - self.on_thread[pes][:, None]) % thread_counts[:, None], self.thread_count)
+        if self.arbitration != 'round_robin':
+            # Highest score first, then round-robin rank. Scores are shifted to non-negative keys, so non candidates still rank last.
+            score = self._score(plan, west_length, north_length)
+            rank  = np.where(candidates, (score.max(initial=0) - score) * self.thread_count + rank, np.iinfo(np.int64).max)
+        chosen     = rank.argmin(axis=1)
+        is_mac     = candidates[np.arange(len(chosen)), chosen]
+
+        mac = np.zeros_like(candidates)
+        mac[is_mac, chosen[is_mac]] = True
+
+        # Cycles each non-zero couple is left waiting, as counted by Arbiter.order.
+        if self.arbitration != 'round_robin':
+            self.waiting[pes] = np.where(mac, 0, self.waiting[pes] + non_zero)
+
+        if profiler is not None:
+            mark = profiler.lap('tick/steps/arbitrate', mark)
+
+        rows = np.flatnonzero(is_mac)
+        if self.stationary is not None:
+            # Add the products to the partial sums before they are passed on.
+            stationary = self.stationary[pes[rows], chosen[rows]]
+            if self.dataflow == 'weight':
+                north_in[rows, chosen[rows]] += west_in[rows, chosen[rows]] * stationary
+            else:
+                west_in[rows, chosen[rows]] += north_in[rows, chosen[rows]] * stationary
+
+        passed = mac | (any_zero & ~full) | both_bubble
+        # Non-zero couples which didn't get the MAC, and couples blocked by full outputs, are pushed back.
+        # Couples with a single bubble and a non-zero value are consumed without being passed on.
+        popped = ready & ~(non_zero & ~mac) & ~(any_zero & full)
+
+        self._push(plan, 'east',  passed, west_in,  west_bubble,  cycle)
+        self._push(plan, 'south', passed, north_in, north_bubble, cycle)
+        if profiler is not None:
+            mark = profiler.lap('tick/steps/push', mark)
+        self._pop(plan, 'west',  popped, west_bubble)
+        self._pop(plan, 'north', popped, north_bubble)
+        if profiler is not None:
+            mark = profiler.lap('tick/steps/pop', mark)
+
+        if self.stationary is None:
+            self.result[pes[rows], chosen[rows]] += west_in[rows, chosen[rows]] * north_in[rows, chosen[rows]]
+        self.on_thread[pes[rows]] = (self.on_thread[pes[rows]] + 1) % thread_counts[rows]
+
+        row = self.telemetry.row(cycle)
+        self.telemetry.mac[row, elements, plan['iindex'], plan['jindex']] = is_mac
+        if plan['record'].size and self.telemetry.records_occupancy:
+            record = plan['record']
+            self.telemetry.occupancy[row[record], plan['record_elements'], plan['record_columns']] = self.load[plan['record_ids']]
+
+        if profiler is not None:
+            profiler.lap('tick/steps/mac', mark)
+            profiler.count('PE tocks', len(pes))
+
+    def tick(self):
+        """
+        Run schedule steps until every PE of the running elements finished the next clock cycle.
+        PE's closer to the array origin run up to ((rows-1) + (columns-1)) / 2 cycles ahead - see _build_step.
+        """
+        profiler = self.profiler
+        if profiler is not None:
+            mark = time.perf_counter()
+
+        last = 2 * self.cycles + (self.rows - 1) + (self.columns - 1)
+        while self.step <= last:
+            self._tock(self.step)
+            self.step += 1
+        if profiler is not None:
+            mark = profiler.lap('tick/steps', mark)
+
+        self.pending_outputs -= self.drained[:, self.cycles]
+        self.telemetry.close_cycle(None if len(self.active) == self.element_count else self.active)
+        if profiler is not None:
+            profiler.lap('tick/close_cycle', mark)
+        self.cycles += 1
+
+    def done(self):
+        """
+        :return: per element, True if all its OUTPUT threads drained their whole input, as of the last finished cycle.
+        """
+        return self.pending_outputs == 0
+
+    def is_done(self):
+        """
+        :return: True if every element is done.
+        """
+        return not self.pending_outputs.any()
+
+    def results(self, element=0):
+        """
+        :return: (threads, rows, columns) accumulators of <element> -
+                 or, on stationary dataflows, the partial sums drained by the south (weight) or east (input) outputs.
+        """
+        if self.dataflow != 'output':
+            east, south = self.unpack_outputs(element)
+            return south if self.dataflow == 'weight' else east
+
+        pes = self.rows * self.columns
+        return self.result[element * pes:(element + 1) * pes].T.reshape(-1, self.rows, self.columns)[:self.thread_counts[element]]
+
+    def unpack_outputs(self, element=0):
+        """
+        Same as unpack_BUFFERs on the OUTPUT buffers of <element>: threads that drained the whole input are copied, others are zeroed.
+        :return: east and south output tensors
+        """
+        thread_count, input_length = self.thread_counts[element], self.input_lengths[element]
+        east_edge  = slice(element * self.rows,    (element + 1) * self.rows)
+        south_edge = slice(element * self.columns, (element + 1) * self.columns)
+        drained    = self.input_length[element][:, None]
+        east  = np.where((self.east_count[east_edge].T   == drained)[:, :, None], self.east_outputs[element],  0)
+        south = np.where((self.south_count[south_edge].T == drained)[:, None, :], self.south_outputs[element], 0)
+        return east[:thread_count, :, :input_length], south[:thread_count, :input_length, :]
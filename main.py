@@ -2,6 +2,9 @@ import sys
 import numpy as np
 import logging
 from SystolicArray import SystolicArray
+from Checkpoint import Checkpointer
+from InputGenerator import generate_tensor
+from Utilities import dataflow_shapes, array_shape
 import os
 import time
 
@@ -22,9 +25,16 @@ def main():
     MainLogger.info('Welcome to Multithreaded Systolic Array Experiment. By the captain we want to wish you good flight.')
 
     thread_count: int    = 2                         # [1, inf].
-    array_size: int      = 16                        # [1, inf]. PE's array size - most be squared.
+    array_size           = 16                        # [1, inf]. PE's array size - an int for a square array, or (rows, columns), e.g. (32, 128).
     probability_for_zero = 0.3                       # [0,1].    Probability to have Zero in a cell.
-    buffer_depth         = array_size-2
+    sparsity_pattern     = 'element'                 # Zeros layout - one of InputGenerator.PATTERNS.
+    rows, columns        = array_shape(array_size)
+    buffer_depth         = min(rows, columns)-2
+    engine               = 'vectorized'              # 'object' - PE objects, 'vectorized' - NumPy engine, 'sparse' - zero runs skipped (unlimited buffers).
+    arbitration          = 'round_robin'             # Which thread gets the MAC - one of Arbitration.ARBITRATION_POLICIES.
+    dataflow             = 'output'                  # Operand that stays in the PE's - one of Utilities.DATAFLOWS ('object' / 'vectorized' engines).
+    checkpoint_seconds   = 600                       # Snapshot period. An interrupted run resumes from its last snapshot.
+    profile              = False                     # Time run phases, logged and exported to <basename>.pstats / .folded.
 
     top_value            = 10
     values               = np.arange(top_value)      # Matrices values would rand from: [0,top_value]
@@ -37,11 +47,14 @@ def main():
                     '\n\t2) Systolic Array size: {}x{}'
                     '\n\t3) Buffer depth: {}'
                     '\n\t4) Values: {}'
-                    '\n\t5) With probabilities: {}'.format(thread_count, array_size, array_size, buffer_depth, str(values), str(probabilities)))
+                    '\n\t5) With probabilities: {}'
+                    '\n\t6) Sparsity pattern: {}'
+                    '\n\t7) Dataflow: {}-stationary'.format(thread_count, rows, columns, buffer_depth, str(values), str(probabilities), sparsity_pattern, dataflow))
 
-    # Multiple data and weights matrices - one per each thread
-    data_matrices   = np.random.choice(values, (thread_count, array_size, array_size*100), p=probabilities)
-    weight_matrices = np.random.choice(values, (thread_count, array_size*100, array_size), p=probabilities)
+    # Multiple data and weights matrices - one per each thread. Sparsity patterns run along the streamed operands.
+    data_shape, weight_shape = dataflow_shapes(array_size, thread_count, max(rows, columns)*100, dataflow)
+    data_matrices   = generate_tensor(data_shape,   probability_for_zero, pattern=sparsity_pattern, axis=1 if dataflow == 'weight' else 2, top_value=top_value)
+    weight_matrices = generate_tensor(weight_shape, probability_for_zero, pattern=sparsity_pattern, axis=2 if dataflow == 'input' else 1, top_value=top_value)
 
     MainLogger.info('Inputs Matrices:\n-------------------------------------------------'
                     '\nWest Matrices Shape (data):\n---------------------------\n{}'
@@ -58,15 +71,27 @@ def main():
 
     MainLogger.info('Expected Result Matrices:\n----------------------------------------------------------\n{}'.format(result_matrices))
 
-    MainLogger.info('Create Systolic Array Object')
-
-    # MTSA C'tor
-    systolic_array = SystolicArray(west_matrices=data_matrices,
-                                   north_matrices=weight_matrices,
-                                   array_size=array_size,
-                                   thread_count=thread_count,
-                                   buffer_depth=buffer_depth,
-                                   log=loggingNow)
+    # Carry on from the last snapshot of an interrupted run, with its own inputs - or start over.
+    checkpointer   = Checkpointer('{}_checkpoint.npz'.format(basename), every_seconds=checkpoint_seconds)
+    systolic_array = checkpointer.resume(log=loggingNow, profile=profile)
+
+    if systolic_array is not None:
+        MainLogger.info('Resumed Systolic Array Object On Clock {}'.format(systolic_array.clock))
+        result_matrices = np.matmul(systolic_array.west_matrices, systolic_array.north_matrices)
+    else:
+        MainLogger.info('Create Systolic Array Object')
+
+        # MTSA C'tor
+        systolic_array = SystolicArray(west_matrices=data_matrices,
+                                       north_matrices=weight_matrices,
+                                       array_size=array_size,
+                                       thread_count=thread_count,
+                                       buffer_depth=buffer_depth,
+                                       log=loggingNow,
+                                       engine=engine,
+                                       profile=profile,
+                                       arbitration=arbitration,
+                                       dataflow=dataflow)
 
     # Each iteration is a clock cycle
     while 1:
@@ -80,7 +105,25 @@ def main():
             systolic_array.summarize()
             break
 
+        checkpointer.update(systolic_array)
+
+    checkpointer.clear()
+
+    # Where the time went, per run phase.
+    if profile:
+        systolic_array.profiler.log_report()
+        systolic_array.profiler.dump_stats('{}.pstats'.format(basename))
+        systolic_array.profiler.dump_folded('{}.folded'.format(basename))
+
+    # Hot path events were recorded in binary - write them to the log now.
+    if loggingNow:
+        systolic_array.trace.replay()
+
     # Check for correctness
+    if not systolic_array.verify_outputs():
+
+        MainLogger.error("Systolic Array Output Buffers Are Different Than Inputs")
+
     if np.any(systolic_array.results - result_matrices):
 
         MainLogger.error("Systolic Array Provided False Results")